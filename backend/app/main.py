@@ -1,28 +1,81 @@
 from __future__ import annotations
 
-from fastapi import FastAPI, HTTPException
+import asyncio
+import hashlib
+import json
+import math
+import time
+from contextlib import asynccontextmanager
+
+from dataclasses import asdict
+from typing import Optional
+
+from fastapi import FastAPI, File, Form, HTTPException, Query, Request, Response, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.routing import Match
 
 from .models import (
+    AvatarInfo,
+    AvatarListResponse,
     GenerateScriptRequest,
     GenerateScriptResponse,
     GenerateVideoRequest,
-    GenerateVideoResponse,
     GenerateXhsRequest,
     GenerateXhsResponse,
     ProductAnalysisRequest,
     ProductAnalysisResponse,
     HeygenStatusResponse,
+    RevisionResponse,
+    SaveCardRequest,
+    SavedCard,
+    SavedCardListResponse,
+    VideoJobResponse,
+    dump_model_json,
+    validate_model,
 )
-from .services.ai import analyze_product, generate_video_script, generate_xhs_copies
-from .services.video import ASSETS_DIR, generate_video_assets, check_heygen_status
+from .services.ai import analyze_product, generate_video_script, generate_xhs_copies, stream_product_analysis
+from .services.avatars import avatar_catalog
+from .services.assets import asset_store
+from .services.batch import MAX_ROWS, batch_limiter, parse_batch_rows, run_batch
+from .services.cache import analysis_cache
+from .services.deadline import DEADLINE_HEADER, deadline_scope, parse_deadline_header
+from .services.heygen import heygen_client
+from .services.library import card_library
+from .services.llm import llm_client
+from .services.metrics import CONTENT_TYPE, HTTP_DURATION, HTTP_IN_FLIGHT, registry
+from .services.outbound import OutboundWaitTooLong, outbound
+from .services.pregen import pregen_store
+from .services.revisions import instant_analysis, instant_script, revision_response, revision_store
+from .services.tokens import token_meter
+from .services.video import ASSETS_DIR, enqueue_video_job, resume_status_tracking, video_jobs
+from .services.video_status import TERMINAL_STATUSES, status_tracker, verify_callback_signature
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    avatar_catalog.load()
+    asset_store.start()
+    video_jobs.start()
+    status_tracker.start()
+    resume_status_tracking()
+    yield
+    await revision_store.stop()
+    status_tracker.stop()
+    video_jobs.stop()
+    asset_store.stop()
+    card_library.close()
+    pregen_store.close()
+    await llm_client.aclose()
+    heygen_client.close()
 
 
 app = FastAPI(
     title="aiPromo Demo API",
     description="Demo backend providing AI-driven marketing analysis and auto video generation.",
     version="0.1.0",
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -36,40 +89,369 @@ app.add_middleware(
 app.mount("/generated", StaticFiles(directory=ASSETS_DIR), name="generated")
 
 
+@app.exception_handler(OutboundWaitTooLong)
+async def outbound_wait_too_long(request: Request, exc: OutboundWaitTooLong) -> JSONResponse:
+    # 上游配额排队过长：返回预计等待时间，由调用方决定稍后重试
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc), "lane": exc.lane, "estimated_wait": round(exc.estimated_wait, 1)},
+        headers={"Retry-After": str(max(math.ceil(exc.estimated_wait), 1))},
+    )
+
+
+def _route_template(request: Request) -> str:
+    # 用路由模版而不是原始路径做标签，避免 /api/video_status/{job_id} 这类路径撑爆标签基数
+    for route in request.app.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return getattr(route, "path", "unmatched")
+    return "unmatched"
+
+
+@app.middleware("http")
+async def apply_deadline(request: Request, call_next):
+    # X-Deadline-Ms：本次请求花在上游（配额排队 + LLM 调用）上的总预算，超出后直接走模版兜底
+    try:
+        budget = parse_deadline_header(request.headers.get(DEADLINE_HEADER))
+    except ValueError:
+        return JSONResponse(status_code=400, content={"detail": f"{DEADLINE_HEADER} 需为正数（毫秒）"})
+    with deadline_scope(budget):
+        return await call_next(request)
+
+
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+    route = _route_template(request)
+    if route == "/metrics":
+        return await call_next(request)
+    started = time.perf_counter()
+    status = 500
+    HTTP_IN_FLIGHT.inc(route=route)
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        HTTP_IN_FLIGHT.dec(route=route)
+        HTTP_DURATION.observe(time.perf_counter() - started, method=request.method, route=route, status=status)
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics() -> Response:
+    return Response(registry.render(), media_type=CONTENT_TYPE)
+
+
+def _model_response(model) -> Response:
+    """
+    业务层返回的模型已经校验过，这里直接序列化成 JSON 返回，
+    跳过 FastAPI 按 response_model 的 dump → 再校验 → jsonable_encoder → json.dumps。
+    response_model 仍保留，用于 OpenAPI 文档。
+    """
+    return Response(dump_model_json(model), media_type="application/json")
+
+
 @app.post("/api/analyze", response_model=ProductAnalysisResponse)
-def analyze(req: ProductAnalysisRequest) -> ProductAnalysisResponse:
-    return analyze_product(req)
+async def analyze(req: ProductAnalysisRequest) -> Response:
+    if req.instant:
+        return _model_response(await instant_analysis(req))
+    return _model_response(await analyze_product(req))
+
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/api/analyze/stream")
+async def analyze_stream(req: ProductAnalysisRequest) -> StreamingResponse:
+    async def events():
+        async for event, data in stream_product_analysis(req):
+            yield _sse(event, data)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@app.post("/api/analyze_batch")
+async def analyze_batch(
+    file: UploadFile = File(..., description="CSV（表头为 ProductAnalysisRequest 字段）或 JSONL"),
+    provider: Optional[str] = Form(default=None, description="行内未指定 provider 时使用"),
+) -> StreamingResponse:
+    try:
+        rows = parse_batch_rows(await file.read(), file.filename or "", file.content_type or "")
+    except UnicodeDecodeError as exc:
+        raise HTTPException(status_code=400, detail="文件需为 UTF-8 编码") from exc
+    if not rows:
+        raise HTTPException(status_code=400, detail="文件中没有数据行")
+    if len(rows) > MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"单次最多 {MAX_ROWS} 行")
+
+    async def lines():
+        async for result in run_batch(rows, {"provider": provider} if provider else None):
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson", headers=SSE_HEADERS)
+
+
+@app.get("/api/cache_stats")
+def cache_stats() -> dict:
+    return {"analyze": analysis_cache.stats(), "revisions": revision_store.stats(), "precomputed": pregen_store.stats()}
+
+
+@app.get("/api/llm_stats")
+def llm_stats() -> dict:
+    return {
+        "singleflight": llm_client.singleflight_stats(),
+        "routing": llm_client.routing_stats(),
+        "tokens": token_meter.stats(),
+        "batch": batch_limiter.stats(),
+        "breakers": llm_client.breaker_stats(),
+    }
+
+
+@app.get("/api/outbound_stats")
+def outbound_stats() -> dict:
+    return outbound.stats()
 
 
 @app.post("/api/generate_script", response_model=GenerateScriptResponse)
-def script(req: GenerateScriptRequest) -> GenerateScriptResponse:
-    script = generate_video_script(req)
-    return GenerateScriptResponse(script=script)
+async def script(req: GenerateScriptRequest) -> Response:
+    if req.instant:
+        return _model_response(await instant_script(req))
+    script = await generate_video_script(req)
+    return _model_response(GenerateScriptResponse(script=script))
+
+
+@app.get("/api/revisions/{revision_id}", response_model=RevisionResponse)
+def get_revision(revision_id: str, request: Request) -> Response:
+    revision = revision_store.get(revision_id)
+    if revision is None:
+        raise HTTPException(status_code=404, detail="结果版本不存在或已过期")
+    # 版本号即 ETag：结果未升级且状态未变时返回 304
+    etag = f'"{revision.token}-{revision.status}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    response = _model_response(revision_response(revision))
+    response.headers.update(headers)
+    return response
+
+
+@app.get("/api/revisions/{revision_id}/stream")
+async def revision_stream(revision_id: str) -> StreamingResponse:
+    revision = revision_store.get(revision_id)
+    if revision is None:
+        raise HTTPException(status_code=404, detail="结果版本不存在或已过期")
+
+    async def events():
+        # 订阅用去掉版本号的 id，与 RevisionStore 发布时一致
+        queue = revision_store.broadcaster.subscribe(revision.id)
+        try:
+            current = revision_store.get(revision.id) or revision
+            snapshot = current.snapshot()
+            yield _sse("revision", snapshot)
+            if snapshot["status"] == "done":
+                return
+            while True:
+                try:
+                    payload = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield _sse("revision", payload)
+                if payload["status"] == "done":
+                    return
+        finally:
+            revision_store.broadcaster.unsubscribe(revision.id, queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
 
 
 @app.post("/api/generate_xhs", response_model=GenerateXhsResponse)
-def generate_xhs(req: GenerateXhsRequest) -> GenerateXhsResponse:
-    return generate_xhs_copies(req)
+async def generate_xhs(req: GenerateXhsRequest) -> Response:
+    return _model_response(await generate_xhs_copies(req))
+
+
+@app.post("/api/cards", response_model=SavedCard)
+def save_card(req: SaveCardRequest) -> Response:
+    card = req.card.model_dump(by_alias=True) if hasattr(req.card, "model_dump") else req.card.dict(by_alias=True)
+    return _model_response(validate_model(SavedCard, card_library.save(card, req.product_name)))
+
+
+@app.get("/api/cards", response_model=SavedCardListResponse)
+def list_cards(
+    q: Optional[str] = Query(default=None, description="关键词，空格分隔的多个词需同时命中"),
+    product: Optional[str] = Query(default=None, description="按产品名称筛选，忽略大小写与多余空白"),
+    channel: Optional[str] = Query(default=None, description="按推荐文案渠道筛选，如 朋友圈 / 公众号"),
+    since: Optional[float] = Query(default=None, description="保存时间下限（unix 秒，含）"),
+    until: Optional[float] = Query(default=None, description="保存时间上限（unix 秒，不含）"),
+    cursor: Optional[str] = None,
+    limit: int = Query(default=20, ge=1, le=100),
+) -> Response:
+    try:
+        page, next_cursor = card_library.query(q, product, channel, since, until, cursor, limit)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail="cursor 无效") from exc
+    return _model_response(validate_model(SavedCardListResponse, {"cards": page, "next_cursor": next_cursor}))
+
 
+@app.delete("/api/cards/{card_id}")
+def delete_card(card_id: str) -> dict:
+    if not card_library.delete(card_id):
+        raise HTTPException(status_code=404, detail="卡片不存在")
+    return {"card_id": card_id, "deleted": True}
 
-@app.post("/api/generate_video", response_model=GenerateVideoResponse)
-def video(req: GenerateVideoRequest) -> GenerateVideoResponse:
+
+@app.get("/api/card_library_stats")
+def card_library_stats() -> dict:
+    return card_library.stats()
+
+
+AVATAR_CACHE_CONTROL = "public, max-age=300"
+
+
+def _avatar_etag(*parts: object) -> str:
+    digest = hashlib.sha1(json.dumps(parts, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+    return f'W/"{avatar_catalog.version}-{digest}"'
+
+
+def _not_modified(request: Request, etag: str) -> bool:
+    candidates = request.headers.get("if-none-match", "")
+    return etag in {item.strip() for item in candidates.split(",")} or candidates.strip() == "*"
+
+
+@app.get("/api/avatars", response_model=AvatarListResponse)
+def list_avatars(
+    request: Request,
+    gender: Optional[str] = Query(default=None, description="female / male"),
+    premium: Optional[bool] = None,
+    name_prefix: Optional[str] = Query(default=None, description="按名称前缀筛选，不区分大小写"),
+    cursor: Optional[str] = None,
+    limit: int = Query(default=50, ge=1, le=200),
+) -> Response:
+    if not avatar_catalog.available:
+        raise HTTPException(status_code=503, detail="数字人目录不可用")
+    etag = _avatar_etag(gender, premium, name_prefix, cursor, limit)
+    headers = {"ETag": etag, "Cache-Control": AVATAR_CACHE_CONTROL}
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
     try:
-        video_path, audio_path, job_id = generate_video_assets(req)
+        page, next_cursor, total = avatar_catalog.query(gender, premium, name_prefix, cursor, limit)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail="cursor 无效") from exc
+    body = {"avatars": [asdict(avatar) for avatar in page], "total": total, "next_cursor": next_cursor}
+    return JSONResponse(body, headers=headers)
+
+
+@app.get("/api/avatars/{avatar_id}", response_model=AvatarInfo)
+def get_avatar(avatar_id: str, request: Request) -> Response:
+    avatar = avatar_catalog.get(avatar_id)
+    if avatar is None:
+        raise HTTPException(status_code=404, detail="数字人不存在")
+    etag = _avatar_etag(avatar_id)
+    headers = {"ETag": etag, "Cache-Control": AVATAR_CACHE_CONTROL}
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(asdict(avatar), headers=headers)
+
+
+@app.post("/api/generate_video", response_model=VideoJobResponse)
+def video(req: GenerateVideoRequest) -> VideoJobResponse:
+    # 目录缺失时不做校验，交给 HeyGen 判断
+    if req.avatar_id and avatar_catalog.available and req.avatar_id not in avatar_catalog:
+        raise HTTPException(status_code=422, detail=f"未知的 avatar_id: {req.avatar_id}")
+    try:
+        job_id = enqueue_video_job(req)
     except Exception as exc:  # pragma: no cover - logging stub
-        raise HTTPException(status_code=500, detail=f"视频生成失败: {exc}") from exc
+        raise HTTPException(status_code=500, detail=f"视频任务入队失败: {exc}") from exc
+    return VideoJobResponse(job_id=job_id, status="queued")
 
-    video_url = video_path if isinstance(video_path, str) else f"/generated/{video_path.name}"
-    audio_url = audio_path if isinstance(audio_path, str) else f"/generated/{audio_path.name}"
 
-    return GenerateVideoResponse(
-        video_url=video_url,
-        audio_url=audio_url,
-        job_id=job_id,
-        status="queued" if job_id else None,
+@app.get("/api/video_jobs/{job_id}", response_model=VideoJobResponse)
+def video_job(job_id: str) -> Response:
+    job = video_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="视频任务不存在")
+    response = VideoJobResponse(
+        job_id=job["id"],
+        status=job["status"],
+        attempts=job["attempts"],
+        error=job["error"],
+        result=job["result"],
+        created_at=job["created_at"],
+        started_at=job["first_started_at"],
+        finished_at=job["finished_at"],
     )
+    return _model_response(response)
+
+
+@app.get("/api/video_queue_stats")
+def video_queue_stats() -> dict:
+    return video_jobs.stats()
 
 
 @app.get("/api/video_status", response_model=HeygenStatusResponse)
-def video_status(video_id: str) -> HeygenStatusResponse:
-    return check_heygen_status(video_id)
+def video_status(video_id: str) -> Response:
+    return _model_response(_tracked_status(video_id))
+
+
+def _tracked_status(video_id: str) -> HeygenStatusResponse:
+    status = status_tracker.get(video_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="未知的 video_id：只能查询本服务提交的视频")
+    return status
+
+
+@app.get("/api/video_status/stream")
+async def video_status_stream(video_id: str) -> StreamingResponse:
+    _tracked_status(video_id)
+
+    async def events():
+        queue = status_tracker.broadcaster.subscribe(video_id)
+        try:
+            current = status_tracker.get(video_id)
+            if current is None:  # 订阅前刚好过期被清理
+                return
+            snapshot = current.model_dump() if hasattr(current, "model_dump") else current.dict()
+            yield _sse("status", snapshot)
+            if snapshot["status"] in TERMINAL_STATUSES or snapshot["status"] == "unconfigured":
+                return
+            while True:
+                try:
+                    payload = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield _sse("status", payload)
+                if payload["status"] in TERMINAL_STATUSES:
+                    return
+        finally:
+            status_tracker.broadcaster.unsubscribe(video_id, queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@app.post("/api/heygen/callback")
+async def heygen_callback(request: Request) -> dict:
+    secret = heygen_client.config.webhook_secret
+    if not secret:
+        raise HTTPException(status_code=503, detail="HEYGEN_WEBHOOK_SECRET 未配置，回调未启用")
+    body = await request.body()
+    if not verify_callback_signature(secret, body, request.headers.get("signature")):
+        raise HTTPException(status_code=401, detail="回调签名校验失败")
+    try:
+        event = json.loads(body)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail="回调内容不是合法 JSON") from exc
+    return {"accepted": status_tracker.apply_callback_event(event)}
+
+
+@app.get("/api/video_status_stats")
+def video_status_stats() -> dict:
+    return status_tracker.stats()
+
+
+@app.get("/api/asset_stats")
+def asset_stats() -> dict:
+    return asset_store.stats()
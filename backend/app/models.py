@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from enum import Enum
-from typing import List, Optional
+from typing import List, Optional, Type, TypeVar
 
 from pydantic import BaseModel, Field
 try:  # pydantic v2
@@ -15,6 +15,11 @@ class AudienceType(str, Enum):
     c_end = "C端"
 
 
+class CacheMode(str, Enum):
+    bypass = "bypass"
+    refresh = "refresh"
+
+
 class ProductAnalysisRequest(BaseModel):
     product_name: str = Field(..., description="产品名称")
     persona: str = Field(..., description="用户身份角色，例如：工厂老板 / 代理商 / 运营")
@@ -30,6 +35,14 @@ class ProductAnalysisRequest(BaseModel):
         default=None,
         description="补充信息，可选"
     )
+    cache: Optional[CacheMode] = Field(
+        default=None,
+        description="结果缓存控制：bypass 不读不写缓存；refresh 跳过读取并用新结果覆盖"
+    )
+    instant: Optional[bool] = Field(
+        default=None,
+        description="立即返回缓存或模版卡片，大模型结果在后台生成，通过 revision 获取升级后的版本"
+    )
 
 
 class MarketingCopy(BaseModel):
@@ -57,6 +70,9 @@ class PainPointCard(BaseModel):
 
 class ProductAnalysisResponse(BaseModel):
     cards: List[PainPointCard]
+    source: Optional[str] = Field(default=None, description="instant 模式下结果来源：precomputed / cache / fallback / llm")
+    revision: Optional[str] = Field(default=None, description="instant 模式下的版本号，用于获取升级后的结果")
+    pending: bool = Field(default=False, description="后台是否仍在生成大模型结果")
 
 
 class VoiceConfig(BaseModel):
@@ -70,11 +86,27 @@ class GenerateScriptRequest(BaseModel):
     voice: VoiceConfig
     video_style: str
     provider: Optional[str] = Field(default=None, description="llm 提供商，如 openai/deepseek/chatgpt")
+    parallel_variants: Optional[bool] = Field(
+        default=None,
+        description="三条口播文案分别并发生成；为空时取环境变量 SCRIPT_PARALLEL_VARIANTS"
+    )
+    instant: Optional[bool] = Field(
+        default=None,
+        description="立即返回模版脚本，大模型脚本在后台生成，通过 revision 获取升级后的版本"
+    )
+    cache: Optional[CacheMode] = Field(
+        default=None,
+        description="预生成结果控制：bypass / refresh 不读取离线预生成的脚本，直接调用大模型"
+    )
 
 
 class GenerateXhsRequest(BaseModel):
     selected_card: PainPointCard
     provider: Optional[str] = Field(default=None, description="llm 提供商，如 openai/deepseek/chatgpt")
+    cache: Optional[CacheMode] = Field(
+        default=None,
+        description="预生成结果控制：bypass / refresh 不读取离线预生成的文案，直接调用大模型"
+    )
 
 
 class GenerateXhsResponse(BaseModel):
@@ -96,6 +128,19 @@ class VideoScript(BaseModel):
 
 class GenerateScriptResponse(BaseModel):
     script: VideoScript
+    source: Optional[str] = Field(default=None, description="instant 模式下结果来源：precomputed / fallback / llm")
+    revision: Optional[str] = Field(default=None, description="instant 模式下的版本号，用于获取升级后的结果")
+    pending: bool = Field(default=False, description="后台是否仍在生成大模型结果")
+
+
+class RevisionResponse(BaseModel):
+    revision: str = Field(..., description="当前版本号，结果升级时递增")
+    kind: str = Field(..., description="analyze / script")
+    status: str = Field(..., description="pending 后台生成中 / done 已结束")
+    source: str = Field(..., description="当前结果来源：precomputed / cache / fallback / llm")
+    error: Optional[str] = Field(default=None, description="后台生成失败时的原因，结果保持上一版本")
+    cards: Optional[List[PainPointCard]] = None
+    script: Optional[VideoScript] = None
 
 
 class GenerateVideoRequest(BaseModel):
@@ -112,8 +157,68 @@ class GenerateVideoResponse(BaseModel):
     status: Optional[str] = None
 
 
+class VideoJobResponse(BaseModel):
+    job_id: str = Field(..., description="后台视频任务 ID（非 HeyGen video_id）")
+    status: str = Field(..., description="queued / running / succeeded / failed")
+    attempts: int = 0
+    error: Optional[str] = None
+    result: Optional[GenerateVideoResponse] = None
+    created_at: Optional[float] = None
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+
 class HeygenStatusResponse(BaseModel):
     job_id: str
     status: str
     video_url: Optional[str] = None
     raw: Optional[dict] = None
+
+
+class SaveCardRequest(BaseModel):
+    card: PainPointCard
+    product_name: str = Field(..., description="卡片所属产品，用于按产品筛选")
+
+
+class SavedCard(BaseModel):
+    card: PainPointCard
+    product_name: str
+    saved_at: float
+
+
+class SavedCardListResponse(BaseModel):
+    cards: List[SavedCard]
+    next_cursor: Optional[str] = Field(default=None, description="下一页游标，为空表示已是最后一页")
+
+
+class AvatarInfo(BaseModel):
+    avatar_id: str
+    avatar_name: str
+    gender: str
+    premium: bool = False
+    preview_image_url: Optional[str] = None
+    preview_video_url: Optional[str] = None
+    default_voice_id: Optional[str] = None
+
+
+class AvatarListResponse(BaseModel):
+    avatars: List[AvatarInfo]
+    total: int = Field(..., description="满足筛选条件的数字人总数")
+    next_cursor: Optional[str] = Field(default=None, description="下一页游标，为空表示已是最后一页")
+
+
+ModelT = TypeVar("ModelT", bound=BaseModel)
+
+
+def validate_model(model: Type[ModelT], data: dict) -> ModelT:
+    """整棵对象树一次校验构建，嵌套模型不必先逐个实例化。"""
+    if hasattr(model, "model_validate"):
+        return model.model_validate(data)
+    return model.parse_obj(data)  # pragma: no cover - pydantic v1 fallback
+
+
+def dump_model_json(model: BaseModel) -> str:
+    """按别名序列化为 JSON；pydantic v2 直接走 pydantic-core 的序列化器。"""
+    if hasattr(model, "model_dump_json"):
+        return model.model_dump_json(by_alias=True)
+    return model.json(by_alias=True, ensure_ascii=False)  # pragma: no cover - pydantic v1 fallback
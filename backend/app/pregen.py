@@ -0,0 +1,341 @@
+"""
+离线预生成：在低峰期遍历产品目录，为每个 产品 × 身份 组合预先生成分析卡片、口播脚本和小红书文案，
+写入预生成结果库（见 `services/pregen.py`）。线上接口优先读取这些结果，目录内的产品在高峰期不再调用大模型。
+
+    cd backend
+    python -m app.pregen [--catalog ../frontend/src/data/windows/models.ts] \\
+        [--persona 门窗厂老板 --persona 经销商] [--video-style 工厂实力展示] [--concurrency 2]
+    python -m app.pregen --status
+
+目录可以是前端的 `models.ts`（WINDOW_MODELS），也可以是与 `/api/analyze_batch` 相同格式的 CSV / JSONL。
+中断后重跑会从断点继续：已完成的组合直接跳过，未完成的组合只补缺少的结果。
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import json
+import re
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+from .models import (
+    AudienceType,
+    CacheMode,
+    GenerateScriptRequest,
+    GenerateXhsRequest,
+    PainPointCard,
+    ProductAnalysisRequest,
+    VoiceConfig,
+    validate_model,
+)
+from .services.ai import (
+    _analysis_cache_key,
+    _dump_card,
+    _script_cache_key,
+    _xhs_cache_key,
+    run_product_analysis,
+    run_video_script,
+    run_xhs_copies,
+)
+from .services.batch import parse_batch_rows
+from .services.llm import llm_client
+from .services.outbound import Priority, outbound_priority
+from .services.pregen import pregen_store
+
+
+DEFAULT_CATALOG = Path(__file__).resolve().parents[2] / "frontend" / "src" / "data" / "windows" / "models.ts"
+
+# 与前端 App.tsx 的默认表单一致，保证线上请求算出的键能命中
+DEFAULT_PERSONA = "门窗厂老板"
+DEFAULT_TARGET_CUSTOMER = "门窗渠道商 / 工程客户"
+DEFAULT_VIDEO_STYLE = "工厂实力展示"
+DEFAULT_VOICE = VoiceConfig(language="中文普通话", voice_style="女声", age_group="青年")
+
+_TS_OBJECT = re.compile(r"\{([^{}]*)\}")
+_TS_FIELD = re.compile(r'(\w+):\s*"((?:[^"\\]|\\.)*)"')
+_TS_KEYWORDS = re.compile(r"keywords:\s*\[([^\]]*)\]")
+_TS_STRING = re.compile(r'"((?:[^"\\]|\\.)*)"')
+
+# 与前端 buildWindowContext 的顺序一致
+_CONTEXT_LINES = [
+    ("窗型", "{windowType}"),
+    ("铝材", "{aluminum}"),
+    ("喷涂", "{coating}"),
+    ("开启方式", "{opening}"),
+    ("玻璃", "{glass}"),
+    ("五金", "{hardware}"),
+    ("执手", "{handle}"),
+    ("纱窗", "{screen}"),
+    ("密封", "{seal}"),
+    ("排水", "{drainage}"),
+    ("水密/气密/抗风压", "{waterTightness}/{airTightness}/{pressureResistance}"),
+    ("隔音/保温", "{soundInsulation}/{insulation}"),
+    ("可视面", "{visibleWidth}"),
+    ("颜色", "木{{{colorWood}}} 铝{{{colorAluminum}}}"),
+    ("玻璃护栏", "{glassRailing}"),
+    ("护角", "{cornerGuard}"),
+    ("水性漆", "{paint}"),
+]
+
+
+def load_window_models(text: str) -> List[Dict[str, Any]]:
+    """解析前端 `models.ts` 中 WINDOW_MODELS 数组的各个对象（字段都是字符串，keywords 为字符串数组）。"""
+    start = text.find("WINDOW_MODELS")
+    products: List[Dict[str, Any]] = []
+    for block in _TS_OBJECT.finditer(text, start if start >= 0 else 0):
+        fields: Dict[str, Any] = dict(_TS_FIELD.findall(block.group(1)))
+        if "name" not in fields:
+            continue
+        keywords = _TS_KEYWORDS.search(block.group(1))
+        fields["keywords"] = _TS_STRING.findall(keywords.group(1)) if keywords else []
+        products.append(fields)
+    return products
+
+
+def window_context(model: Dict[str, Any]) -> str:
+    values = defaultdict(str, model)
+    return "\n".join(f"{label}：{template.format_map(values)}" for label, template in _CONTEXT_LINES)
+
+
+def load_catalog(path: Path) -> List[Dict[str, Any]]:
+    """读取产品目录，返回 ProductAnalysisRequest 的部分字段（产品名、关键词、补充信息等）。"""
+    data = path.read_bytes()
+    if path.suffix in {".ts", ".js"}:
+        return [
+            {
+                "product_name": model["name"],
+                "product_keywords": model["keywords"],
+                "additional_context": window_context(model),
+            }
+            for model in load_window_models(data.decode("utf-8"))
+        ]
+    products = []
+    for row, fields, error in parse_batch_rows(data, path.name):
+        if error is not None or not fields or not fields.get("product_name"):
+            print(f"跳过目录第 {row} 行：{error or '缺少 product_name'}", file=sys.stderr)
+            continue
+        products.append(fields)
+    return products
+
+
+def catalog_requests(
+    products: Sequence[Dict[str, Any]],
+    personas: Sequence[str],
+    target_customers: Sequence[str],
+    audience_type: AudienceType,
+    providers: Sequence[Optional[str]],
+) -> List[ProductAnalysisRequest]:
+    """展开 产品 × 身份 × 目标客户 × provider 的全部组合；目录行里已写明的字段优先。"""
+    requests = []
+    for product in products:
+        for persona in personas:
+            for target in target_customers:
+                for provider in providers:
+                    fields = {
+                        "persona": persona,
+                        "target_customer": target,
+                        "audience_type": audience_type,
+                        "provider": provider,
+                        **product,
+                        # 离线任务总是重新生成，不读取已有的缓存与预生成结果
+                        "cache": CacheMode.refresh,
+                    }
+                    requests.append(validate_model(ProductAnalysisRequest, fields))
+    return requests
+
+
+class Pregenerator:
+    """
+    逐个组合生成并写入预生成结果库：
+
+    - 所有大模型调用共用 `concurrency` 个名额，并以 `priority` 排队，进程内不会抢在交互请求前面；
+    - 已有且生成时间在 `max_age` 秒内的结果直接复用，不重复调用；
+    - 某个组合全部结果写入后记为 done，重跑时整组跳过；大模型不可用（回退到模版）时记为 failed，模版结果不写入。
+    """
+
+    def __init__(
+        self,
+        video_styles: Sequence[str],
+        voice: VoiceConfig,
+        with_script: bool,
+        with_xhs: bool,
+        concurrency: int,
+        max_age: float,
+        force: bool = False,
+    ) -> None:
+        self.video_styles = list(video_styles)
+        self.voice = voice
+        self.with_script = with_script
+        self.with_xhs = with_xhs
+        self.max_age = max_age
+        self.force = force
+        self._semaphore = asyncio.Semaphore(max(concurrency, 1))
+        self.counters: Dict[str, int] = {"done": 0, "skipped": 0, "failed": 0, "generated": 0, "reused": 0}
+
+    def _fresh(self, updated_at: float) -> bool:
+        return not self.force and (self.max_age <= 0 or time.time() - updated_at <= self.max_age)
+
+    def _reusable(self, kind: str, key: str) -> Optional[Any]:
+        found = pregen_store.entry(kind, key)
+        return found[0] if found and self._fresh(found[1]) else None
+
+    def item_key(self, req: ProductAnalysisRequest) -> str:
+        canonical = [
+            _analysis_cache_key(req),
+            sorted(self.video_styles) if self.with_script else [],
+            [self.voice.language, self.voice.voice_style, self.voice.age_group] if self.with_script else [],
+            self.with_xhs,
+        ]
+        raw = json.dumps(canonical, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    async def _limited(self, fn, *args):
+        async with self._semaphore:
+            return await fn(*args)
+
+    async def _script(self, req: GenerateScriptRequest) -> None:
+        script, source = await self._limited(run_video_script, req)
+        if source != "llm":
+            raise RuntimeError("口播脚本回退到模版")
+        dumped = script.model_dump() if hasattr(script, "model_dump") else script.dict()
+        pregen_store.put("script", _script_cache_key(req), dumped)
+        self.counters["generated"] += 1
+
+    async def _xhs(self, req: GenerateXhsRequest) -> None:
+        copies, source = await self._limited(run_xhs_copies, req)
+        if source != "llm":
+            raise RuntimeError("小红书文案回退到模版")
+        pregen_store.put("xhs", _xhs_cache_key(req), copies)
+        self.counters["generated"] += 1
+
+    async def _cards(self, req: ProductAnalysisRequest) -> List[PainPointCard]:
+        key = _analysis_cache_key(req)
+        stored = self._reusable("analyze", key)
+        if stored:
+            self.counters["reused"] += 1
+            return [validate_model(PainPointCard, card) for card in stored]
+        cards, source, error = await self._limited(run_product_analysis, req)
+        if source == "fallback":
+            raise RuntimeError(error or "分析回退到模版")
+        pregen_store.put("analyze", key, [_dump_card(card) for card in cards])
+        self.counters["generated"] += 1
+        return cards
+
+    async def run_item(self, req: ProductAnalysisRequest) -> str:
+        """生成一个组合，返回 done / skipped / failed。"""
+        item = self.item_key(req)
+        label = f"{req.product_name} × {req.persona} × {req.target_customer}"
+        state = pregen_store.progress(item)
+        if state and state[0] == "done" and self._fresh(state[1]):
+            self.counters["skipped"] += 1
+            return "skipped"
+
+        pregen_store.mark(item, label, "running")
+        try:
+            cards = await self._cards(req)
+            jobs = []
+            for card in cards:
+                for style in self.video_styles if self.with_script else []:
+                    script_req = GenerateScriptRequest(
+                        selected_card=card, voice=self.voice, video_style=style, provider=req.provider, cache=CacheMode.refresh
+                    )
+                    if self._reusable("script", _script_cache_key(script_req)) is None:
+                        jobs.append(self._script(script_req))
+                    else:
+                        self.counters["reused"] += 1
+                if self.with_xhs:
+                    xhs_req = GenerateXhsRequest(selected_card=card, provider=req.provider, cache=CacheMode.refresh)
+                    if self._reusable("xhs", _xhs_cache_key(xhs_req)) is None:
+                        jobs.append(self._xhs(xhs_req))
+                    else:
+                        self.counters["reused"] += 1
+            errors = [result for result in await asyncio.gather(*jobs, return_exceptions=True) if result is not None]
+            if errors:
+                raise errors[0]
+        except Exception as exc:
+            # 已写入的部分结果保留，重跑时只补缺少的
+            pregen_store.mark(item, label, "failed", str(exc) or exc.__class__.__name__)
+            self.counters["failed"] += 1
+            return "failed"
+        pregen_store.mark(item, label, "done")
+        self.counters["done"] += 1
+        return "done"
+
+    async def run(self, requests: Sequence[ProductAnalysisRequest]) -> Dict[str, int]:
+        total = len(requests)
+        finished = 0
+
+        async def one(req: ProductAnalysisRequest) -> None:
+            nonlocal finished
+            status = await self.run_item(req)
+            finished += 1
+            print(f"[{finished}/{total}] {status:7} {req.product_name} × {req.persona}", file=sys.stderr)
+
+        await asyncio.gather(*(one(req) for req in requests))
+        return {"total": total, **self.counters}
+
+
+async def _main(args: argparse.Namespace) -> int:
+    products = load_catalog(Path(args.catalog))
+    requests = catalog_requests(
+        products,
+        args.persona or [DEFAULT_PERSONA],
+        args.target_customer or [DEFAULT_TARGET_CUSTOMER],
+        AudienceType(args.audience_type),
+        args.provider or [None],
+    )
+    pregenerator = Pregenerator(
+        video_styles=args.video_style or [DEFAULT_VIDEO_STYLE],
+        voice=VoiceConfig(language=args.voice_language, voice_style=args.voice_style, age_group=args.age_group),
+        with_script=not args.skip_script,
+        with_xhs=not args.skip_xhs,
+        concurrency=args.concurrency,
+        max_age=pregen_store.ttl / 2 if args.max_age is None else args.max_age,
+        force=args.force,
+    )
+    try:
+        with outbound_priority(Priority[args.priority]):
+            summary = await pregenerator.run(requests)
+    finally:
+        await llm_client.aclose()
+        pregen_store.close()
+    print(json.dumps(summary, ensure_ascii=False))
+    return 1 if summary["failed"] else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--catalog", default=str(DEFAULT_CATALOG), help="models.ts、CSV 或 JSONL")
+    parser.add_argument("--persona", action="append", help="可重复，默认与前端表单一致")
+    parser.add_argument("--target-customer", action="append", help="可重复，默认与前端表单一致")
+    parser.add_argument("--audience-type", default=AudienceType.b_end.value, choices=[t.value for t in AudienceType])
+    parser.add_argument("--provider", action="append", help="可重复，默认使用默认 provider")
+    parser.add_argument("--video-style", action="append", help="可重复，每种风格各生成一份脚本")
+    parser.add_argument("--voice-language", default=DEFAULT_VOICE.language)
+    parser.add_argument("--voice-style", default=DEFAULT_VOICE.voice_style)
+    parser.add_argument("--age-group", default=DEFAULT_VOICE.age_group)
+    parser.add_argument("--skip-script", action="store_true", help="不生成口播脚本")
+    parser.add_argument("--skip-xhs", action="store_true", help="不生成小红书文案")
+    parser.add_argument("--concurrency", type=int, default=2, help="同时进行的大模型调用数")
+    parser.add_argument("--priority", default=Priority.background.name, choices=[Priority.batch.name, Priority.background.name])
+    parser.add_argument("--max-age", type=float, default=None, help="已有结果超过该秒数才重新生成，默认为 PREGEN_TTL 的一半")
+    parser.add_argument("--force", action="store_true", help="忽略断点与已有结果，全部重新生成")
+    parser.add_argument("--status", action="store_true", help="只输出预生成结果库的统计")
+    args = parser.parse_args()
+
+    if args.status:
+        print(json.dumps(pregen_store.stats(), ensure_ascii=False, indent=2))
+        return 0
+    if not llm_client.is_configured():
+        print("未配置大模型（OPENAI_API_KEY 等），无法预生成", file=sys.stderr)
+        return 2
+    return asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,12 +1,19 @@
 from __future__ import annotations
 
+import asyncio
+import hashlib
 import json
+import os
 import random
 import textwrap
+import time
 import uuid
-from typing import List, Sequence
+from typing import AsyncIterator, List, Optional, Sequence, Tuple
+
+import httpx
 
 from ..models import (
+    CacheMode,
     GenerateScriptRequest,
     GenerateXhsRequest,
     GenerateXhsResponse,
@@ -16,8 +23,18 @@ from ..models import (
     ProductAnalysisResponse,
     Scene,
     VideoScript,
+    validate_model,
 )
-from .llm import extract_json_block, llm_client
+from .breaker import CircuitOpenError
+from .cache import analysis_cache
+from .deadline import DeadlineExceeded
+from .json_extract import TolerantJsonScanner, parse_json_payload
+from .llm import LLMResponse, llm_client
+from .metrics import DUPLICATES, FALLBACKS, PARSE_DURATION
+from .outbound import OutboundWaitTooLong
+from .pregen import pregen_store
+from .similarity import duplicate_indices, signature
+from .tokens import BUDGETS, select_prompt
 
 
 SYSTEM_PROMPT = """你是一名资深 ToB 品牌策略师，擅长拆解工厂、供应链、渠道的真实痛点，并生成结构化营销方案。需要保证输出内容可直接落在营销系统中。"""
@@ -25,19 +42,45 @@ SYSTEM_PROMPT = """你是一名资深 ToB 品牌策略师，擅长拆解工厂
 BRAND_DECLARATION = ""
 
 
+class EmptyResultError(ValueError):
+    """模型输出可以解析，但其中没有可用的业务内容。"""
+
+
+def _fallback_reason(exc: BaseException) -> str:
+    if isinstance(exc, OutboundWaitTooLong):
+        return "rate_limited"
+    if isinstance(exc, CircuitOpenError):
+        return "circuit_open"
+    if isinstance(exc, DeadlineExceeded):
+        return "deadline"
+    if isinstance(exc, httpx.HTTPError):
+        return "http_error"
+    if isinstance(exc, EmptyResultError):
+        return "empty_result"
+    if isinstance(exc, ValueError):
+        return "parse_error"
+    return "error"
+
+
+def _record_fallback(endpoint: str, reason: str) -> None:
+    FALLBACKS.inc(endpoint=endpoint, reason=reason)
+
+
+def _record_duplicates(endpoint: str, resolution: str, count: int) -> None:
+    if count > 0:
+        DUPLICATES.inc(count, endpoint=endpoint, resolution=resolution)
+
+
 def _wrap_brand_tag(text: str) -> str:
     if BRAND_DECLARATION in text:
         return text
     return f"{BRAND_DECLARATION}\n{text}\n{BRAND_DECLARATION}"
 
-ANALYSIS_PROMPT = """输入信息：
-- 产品名称：{product_name}
-- 用户身份：{persona}
-- 目标客户：{target_customer}
-- 受众人群：{audience_type}
-- 关键词：{keywords}
+# 所有 prompt 都是「静态指令在前、本次请求的字段在最后」，让同一场景的请求共享尽量长的前缀，
+# 命中 provider 侧的 prompt 前缀缓存（usage.prompt_tokens_details.cached_tokens）。
+# 修改模版时不要把 {占位符} 挪到静态部分之前。
 
-请输出 JSON，格式如下：
+ANALYSIS_PROMPT = """请根据文末的输入信息分析目标客户的真实痛点，输出 JSON，格式如下：
 {{
   "cards": [
     {{
@@ -53,25 +96,27 @@ ANALYSIS_PROMPT = """输入信息：
   ]
 }}
 
-请返回 3~4 条卡片，语言口语化且聚焦生意场景。"""
+请返回 3~4 条卡片，语言口语化且聚焦生意场景。
+
+输入信息：
+- 产品名称：{product_name}
+- 用户身份：{persona}
+- 目标客户：{target_customer}
+- 受众人群：{audience_type}
+- 关键词：{keywords}"""
+
+ANALYSIS_PROMPT_COMPACT = """根据文末信息输出 3~4 张痛点卡片，口语化、聚焦生意场景，只输出 JSON：
+{{"cards": [{{"title": "痛点标题", "scenario": "业务场景", "pain_point": "真实痛点", "solution": "我方方案", "recommended_copies": [{{"channel": "客户私聊/朋友圈/公众号/短视频", "copy": "营销文案"}}]}}]}}
+
+产品：{product_name}；用户身份：{persona}；目标客户：{target_customer}；受众：{audience_type}；关键词：{keywords}"""
 
 SCRIPT_PROMPT = """
 你是资深短视频编导 + 资深广告文案（擅长 50-60 秒口播转化）。
-请根据“已选卡片信息”和“视频/配音设定”，生成 3 条长文案的中文口播文案。
+请根据文末的“已选卡片信息”和“视频/配音设定”，生成 3 条长文案的中文口播文案。
 你的输出必须是严格可解析的 JSON（不要代码块，不要多余说明）。
 
-【已选卡片信息】
-- 标题：{title}
-- 场景：{scenario}
-- 痛点：{pain_point}
-- 解决方案：{solution}
-
-【视频设定】
-- 视频风格：{video_style}
-- 配音设定：{voice_language} · {voice_style} · {age_group}
-
 【受众假设】
-- 受众是谁：{audience}（如果未提供，默认“对该场景有明确需求的人”）
+- 受众是谁：见文末设定（如果未提供，默认“对该场景有明确需求的人”）
 - 他们最在意：省钱 / 省时间 / 更简单 / 更稳定 / 更体面（从 pain_point 推断优先级）
 
 【统一硬性要求】
@@ -93,7 +138,7 @@ SCRIPT_PROMPT = """
 【质量自检（生成前在脑内检查，不要输出检查过程）】
 - 是否够口语？读起来像人在说吗？
 - 是否具体？有没有“细节画面感”（场景里的小动作/小尴尬/小代价）？
-- 5条是否明显不同？是否没有重复句式和同一个开头套路？
+- 3条是否明显不同？是否没有重复句式和同一个开头套路？
 - 是否只输出 JSON？是否无多余文本？
 
 请输出 JSON：
@@ -104,16 +149,92 @@ SCRIPT_PROMPT = """
   "口播文案3" ] 
 }}
 
+【已选卡片信息】
+- 标题：{title}
+- 场景：{scenario}
+- 痛点：{pain_point}
+- 解决方案：{solution}
+
+【视频设定】
+- 视频风格：{video_style}
+- 配音设定：{voice_language} · {voice_style} · {age_group}
+- 受众：{audience}
 """
 
 
-XHS_PROMPT = """已选卡片信息：
+# 精简版：去掉自检、结构说明等重复指令，输入预算不够时使用（见 tokens.select_prompt）
+SCRIPT_PROMPT_COMPACT = """你是短视频编导兼广告文案。根据文末的卡片与设定写 3 条中文口播文案，只输出 JSON。
+
+要求：每条 200-240 字；前 1-2 句强钩子；口语短句；不写镜头/画面等制作提示；不夸张承诺；结尾轻量 CTA（评论/私信/收藏）。
+三条依次为：1 痛点共鸣型（说透痛点）；2 对比反差型（传统做法 vs 本方案）；3 故事真实型（前后变化的小故事）。
+结构：钩子→场景→痛点细节→方案→好处（不超过 3 点）→CTA。
+
+输出：{{"headline": "文案标题", "copies": ["文案1", "文案2", "文案3"]}}
+
+卡片：标题 {title}；场景 {scenario}；痛点 {pain_point}；方案 {solution}
+设定：{video_style}；配音 {voice_language} · {voice_style} · {age_group}；受众 {audience}"""
+
+SCRIPT_VARIANT_PROMPT_COMPACT = """你是短视频编导兼广告文案。根据文末的卡片与设定写 1 条中文口播文案，只输出 JSON。
+
+要求：200-240 字；前 1-2 句强钩子；口语短句；不写制作提示；不夸张承诺；结尾轻量 CTA。
+
+输出：{{"headline": "文案标题", "voice_over": "口播文案"}}
+
+卡片：标题 {title}；场景 {scenario}；痛点 {pain_point}；方案 {solution}
+设定：{video_style}；配音 {voice_language} · {voice_style} · {age_group}；受众 {audience}
+类型：{variant_name}（{variant_rule}）"""
+
+# 并发模式：每条文案单独一次补全，风格由 SCRIPT_VARIANTS 逐条指定
+SCRIPT_VARIANT_PROMPT = """
+你是资深短视频编导 + 资深广告文案（擅长 50-60 秒口播转化）。
+请根据文末的“已选卡片信息”和“视频/配音设定”，按指定的文案类型生成 1 条中文口播文案。
+你的输出必须是严格可解析的 JSON（不要代码块，不要多余说明）。
+
+【硬性要求】
+1) 时长约 50-60 秒（约 200-240 个中文字符）。
+2) 开头前 1-2 句必须是强钩子：反常识/戳痛点/提问/数字/对比/真实小尴尬，任选其一。
+3) 全程像聊天：短句、口语连接词；不要出现“Scene/镜头/画面/旁白提示”等制作提示词。
+4) 不能夸张承诺，避免绝对化用语。
+5) 结尾带轻量 CTA：引导评论关键词/私信/点链接/收藏/试一次，不要硬广腔。
+
+请输出 JSON：
+{{ "headline": "文案标题", "voice_over": "口播文案" }}
+
+【已选卡片信息】
 - 标题：{title}
 - 场景：{scenario}
 - 痛点：{pain_point}
 - 解决方案：{solution}
 
-请生成适合小红书发布的文案，输出 JSON：
+【视频设定】
+- 视频风格：{video_style}
+- 配音设定：{voice_language} · {voice_style} · {age_group}
+- 受众：{audience}
+
+【文案类型】{variant_name}：{variant_rule}
+"""
+
+SCRIPT_VARIANTS = [
+    ("痛点共鸣型", "把痛点说透，说到“我就是这样”"),
+    ("对比反差型", "用“传统做法 vs 这个方案”的对比"),
+    ("故事真实型", "一个小故事：我/朋友/客户，前后变化"),
+]
+
+SCRIPT_PARALLEL_VARIANTS = os.getenv("SCRIPT_PARALLEL_VARIANTS", "0").lower() in {"1", "true", "yes", "on"}
+
+# 检出近似重复的卡片 / 文案后，只为重复的那几条再请求一次模型；关闭时直接丢弃或用模版补位
+DEDUP_REGENERATE = os.getenv("DEDUP_REGENERATE", "1").lower() in {"1", "true", "yes", "on"}
+
+
+# 重新生成时追加在 prompt 末尾，不影响前缀缓存
+AVOID_HINT = """
+
+【补充要求】{count_rule}下列内容已经用过，新内容的开头、角度和句式都要与它们明显不同：
+{items}"""
+
+XHS_COUNT = 5
+
+XHS_PROMPT = """请根据文末的已选卡片信息生成适合小红书发布的文案，输出 JSON：
 {{
   "copies": [
     "文案1",
@@ -124,7 +245,13 @@ XHS_PROMPT = """已选卡片信息：
   ]
 }}
 
-要求：必须输出 5 条，每条 80-160 字，带 3-5 个话题标签（#），语气真实、口语化，避免夸大。"""
+要求：必须输出 5 条，每条 80-160 字，带 3-5 个话题标签（#），语气真实、口语化，避免夸大。
+
+已选卡片信息：
+- 标题：{title}
+- 场景：{scenario}
+- 痛点：{pain_point}
+- 解决方案：{solution}"""
 
 
 PAIN_POINT_PATTERNS = [
@@ -203,27 +330,27 @@ def _parse_llm_cards(raw_cards: Sequence[dict]) -> List[PainPointCard]:
         if not isinstance(copies_raw, list):
             copies_raw = []
 
-        copies: List[MarketingCopy] = []
+        # 品牌标签在组装字段时就加上，整张卡片只校验构建一次
+        copies: List[dict] = []
         for copy in copies_raw:
-            channel = copy.get("channel") or "客户私聊"
+            if not isinstance(copy, dict):
+                continue
             copy_text = copy.get("copy") or copy.get("content")
             if not copy_text:
                 continue
-            copies.append(MarketingCopy(channel=channel, ad_copy=copy_text))
-
-        if not copies:
-            copies = _build_marketing_copies(title, scenario, pain_point, solution)
+            copies.append({"channel": copy.get("channel") or "客户私聊", "copy": _wrap_brand_tag(copy_text)})
 
         cards.append(
-            PainPointCard(
-                id=entry.get("id") or str(uuid.uuid4()),
-                title=title,
-                scenario=scenario,
-                pain_point=pain_point,
-                solution=solution,
-                recommended_copies=[
-                    MarketingCopy(channel=c.channel, ad_copy=_wrap_brand_tag(c.ad_copy)) for c in copies
-                ],
+            validate_model(
+                PainPointCard,
+                {
+                    "id": entry.get("id") or str(uuid.uuid4()),
+                    "title": title,
+                    "scenario": scenario,
+                    "pain_point": pain_point,
+                    "solution": solution,
+                    "recommended_copies": copies or _build_marketing_copies(title, scenario, pain_point, solution),
+                },
             )
         )
     return cards
@@ -255,104 +382,368 @@ def _fallback_cards(req: ProductAnalysisRequest) -> List[PainPointCard]:
     return cards
 
 
-def analyze_product(req: ProductAnalysisRequest) -> ProductAnalysisResponse:
-    if llm_client.is_configured():
-        prompt = ANALYSIS_PROMPT.format(
-            product_name=req.product_name,
-            persona=req.persona,
-            target_customer=req.target_customer,
-            audience_type=req.audience_type,
-            keywords=", ".join(req.product_keywords) if req.product_keywords else "用户未提供",
+def _normalize_text(value: str) -> str:
+    return " ".join(str(value).split()).casefold()
+
+
+def _analysis_cache_key(req: ProductAnalysisRequest) -> str:
+    provider = llm_client.resolve_provider(req.provider)
+    keywords = sorted({_normalize_text(k) for k in req.product_keywords if str(k).strip()})
+    canonical = [
+        _normalize_text(req.product_name),
+        _normalize_text(req.persona),
+        _normalize_text(req.target_customer),
+        req.audience_type.value,
+        keywords,
+        provider.name,
+        provider.model,
+    ]
+    raw = json.dumps(canonical, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _card_cache_fields(card: PainPointCard) -> List[str]:
+    # 只看卡片内容，不看 id：同一批预生成卡片无论被哪个请求返回都能命中
+    return [_normalize_text(value) for value in (card.title, card.scenario, card.pain_point, card.solution)]
+
+
+def _script_cache_key(req: GenerateScriptRequest) -> str:
+    provider = llm_client.resolve_provider(req.provider)
+    canonical = [
+        _card_cache_fields(req.selected_card),
+        _normalize_text(req.video_style),
+        [_normalize_text(req.voice.language), _normalize_text(req.voice.voice_style), _normalize_text(req.voice.age_group)],
+        provider.name,
+        provider.model,
+    ]
+    raw = json.dumps(canonical, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _xhs_cache_key(req: GenerateXhsRequest) -> str:
+    provider = llm_client.resolve_provider(req.provider)
+    canonical = [_card_cache_fields(req.selected_card), provider.name, provider.model]
+    raw = json.dumps(canonical, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def precomputed_cards(req: ProductAnalysisRequest) -> Optional[List[dict]]:
+    """离线预生成的卡片；请求带 cache（bypass / refresh）时不读取。"""
+    if req.cache is not None:
+        return None
+    return pregen_store.get("analyze", _analysis_cache_key(req))
+
+
+def precomputed_script(req: GenerateScriptRequest) -> Optional[VideoScript]:
+    if req.cache is not None:
+        return None
+    stored = pregen_store.get("script", _script_cache_key(req))
+    return validate_model(VideoScript, stored) if stored else None
+
+
+def _dump_card(card: PainPointCard) -> dict:
+    if hasattr(card, "model_dump"):
+        return card.model_dump(by_alias=True)
+    return card.dict(by_alias=True)  # pragma: no cover - pydantic v1 fallback
+
+
+def _chat_messages(prompt: str) -> List[dict]:
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def _analysis_messages(req: ProductAnalysisRequest) -> List[dict]:
+    fields = {
+        "product_name": req.product_name,
+        "persona": req.persona,
+        "target_customer": req.target_customer,
+        "audience_type": req.audience_type,
+        "keywords": ", ".join(req.product_keywords) if req.product_keywords else "用户未提供",
+    }
+    return select_prompt(
+        BUDGETS["analyze"],
+        _chat_messages(ANALYSIS_PROMPT.format(**fields)),
+        _chat_messages(ANALYSIS_PROMPT_COMPACT.format(**fields)),
+    )
+
+
+def _cards_from_response(response: LLMResponse) -> List[PainPointCard]:
+    with PARSE_DURATION.time(endpoint="analyze", stage="extract"):
+        parsed = parse_json_payload(response.content, expect=("cards",))
+    with PARSE_DURATION.time(endpoint="analyze", stage="build"):
+        cards_data = parsed.get("cards", []) if isinstance(parsed, dict) else parsed
+        cards = _parse_llm_cards(cards_data) if isinstance(cards_data, list) else []
+    if not cards:
+        raise EmptyResultError("模型输出中没有有效卡片")
+    return cards
+
+
+def _with_avoid_hint(messages: List[dict], used: Sequence[str], count_rule: str = "") -> List[dict]:
+    """在最后一条 user 消息末尾追加「避开已有内容」的要求，已有内容只取开头部分。"""
+    items = "\n".join(f"- {text[:60]}…" if len(text) > 60 else f"- {text}" for text in (" ".join(t.split()) for t in used))
+    last = messages[-1]
+    return messages[:-1] + [{**last, "content": last["content"] + AVOID_HINT.format(count_rule=count_rule, items=items)}]
+
+
+def _card_text(card: PainPointCard) -> str:
+    return f"{card.title} {card.pain_point} {card.scenario}"
+
+
+async def _replacement_cards(req: ProductAnalysisRequest, kept: Sequence[PainPointCard], count: int) -> List[PainPointCard]:
+    """为重复卡片补请求 count 张与已有卡片不同的新卡片；模型出错或仍然重复时少补或不补。"""
+    used = [_card_text(card) for card in kept]
+    messages = _with_avoid_hint(_analysis_messages(req), used, f"只需输出 {count} 张卡片。")
+    try:
+        fresh = await llm_client.chat_routed(
+            messages,
+            _cards_from_response,
+            temperature=0.95,
+            provider=req.provider,
+            budget=BUDGETS["analyze"],
         )
+    except Exception:
+        return []
+    duplicates = set(duplicate_indices([_card_text(card) for card in fresh], keep=[signature(text) for text in used]))
+    return [card for idx, card in enumerate(fresh) if idx not in duplicates][:count]
+
+
+async def _dedupe_cards(req: ProductAnalysisRequest, cards: List[PainPointCard], endpoint: str) -> List[PainPointCard]:
+    """去掉近似重复的卡片；剩余不足 3 张时只为缺的几张重新请求一次。"""
+    duplicates = set(duplicate_indices([_card_text(card) for card in cards]))
+    if not duplicates:
+        return cards
+    kept = [card for idx, card in enumerate(cards) if idx not in duplicates]
+    missing = min(len(duplicates), 3 - len(kept))
+    fresh = await _replacement_cards(req, kept, missing) if missing > 0 and DEDUP_REGENERATE else []
+    _record_duplicates(endpoint, "regenerated", len(fresh))
+    _record_duplicates(endpoint, "dropped", len(duplicates) - len(fresh))
+    return kept + fresh
+
+
+async def run_product_analysis(req: ProductAnalysisRequest) -> Tuple[List[PainPointCard], str, Optional[str]]:
+    """
+    返回 (cards, source, error)：source 为 cache / llm / fallback，
+    回退到模版卡片时 error 记录原因（未配置 LLM 时为 None）。
+    目录内的产品优先返回离线预生成的结果（source 为 precomputed），不占用大模型配额。
+    """
+    precomputed = precomputed_cards(req)
+    if precomputed:
+        return [validate_model(PainPointCard, card) for card in precomputed], "precomputed", None
+
+    error: Optional[str] = None
+    if llm_client.is_configured():
+        cache_key = _analysis_cache_key(req)
+        if req.cache is None:
+            cached = await analysis_cache.get(cache_key)
+            if cached:
+                return [validate_model(PainPointCard, card) for card in cached], "cache", None
+        elif req.cache == CacheMode.bypass:
+            analysis_cache.record_bypass()
+
         try:
-            response = llm_client.chat(
-                [
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": prompt},
-                ],
+            cards = await llm_client.chat_routed(
+                _analysis_messages(req),
+                _cards_from_response,
                 temperature=0.85,
                 provider=req.provider,
+                budget=BUDGETS["analyze"],
             )
-            parsed = json.loads(extract_json_block(response.content))
-            cards_data = parsed.get("cards", [])
-            if isinstance(cards_data, list):
-                cards = _parse_llm_cards(cards_data)
-                if cards:
-                    return ProductAnalysisResponse(cards=cards)
-        except Exception:
-            pass
+            cards = await _dedupe_cards(req, cards, "analyze")
+            if req.cache != CacheMode.bypass:
+                await analysis_cache.set(cache_key, [_dump_card(card) for card in cards])
+            return cards, "llm", None
+        except OutboundWaitTooLong:
+            # 配额排队超过截止时间：把预计等待交给调用方，而不是悄悄降级成模版
+            raise
+        except Exception as exc:
+            error = str(exc) or exc.__class__.__name__
+            _record_fallback("analyze", _fallback_reason(exc))
+    else:
+        _record_fallback("analyze", "unconfigured")
 
-    return ProductAnalysisResponse(cards=_fallback_cards(req))
+    return _fallback_cards(req), "fallback", error
 
 
-def _parse_llm_script(data: dict) -> VideoScript | None:
+async def analyze_product(req: ProductAnalysisRequest) -> ProductAnalysisResponse:
+    cards, _, _ = await run_product_analysis(req)
+    return ProductAnalysisResponse(cards=cards)
+
+
+async def stream_product_analysis(req: ProductAnalysisRequest) -> AsyncIterator[Tuple[str, dict]]:
+    """
+    流式分析：每张卡片的 JSON 对象一闭合就校验并产出 ("card", card)，与已产出卡片近似重复的直接跳过，
+    流结束后再为跳过的卡片补请求一次。流中断或没有有效卡片时，用模版卡片补齐到 3 张；最后产出 ("done", 摘要)。
+    """
+    cards: List[PainPointCard] = []
+    source = "fallback"
+    skipped = 0
+
+    precomputed = precomputed_cards(req)
+    if precomputed:
+        for card in precomputed:
+            yield "card", card
+        yield "done", {"source": "precomputed", "count": len(precomputed)}
+        return
+
+    if llm_client.is_configured():
+        cache_key = _analysis_cache_key(req)
+        cached = await analysis_cache.get(cache_key) if req.cache is None else None
+        if req.cache == CacheMode.bypass:
+            analysis_cache.record_bypass()
+        if cached:
+            for card in cached:
+                yield "card", card
+            yield "done", {"source": "cache", "count": len(cached)}
+            return
+
+        scanner = TolerantJsonScanner()
+        extract_time = build_time = 0.0
+        fresh: List[PainPointCard] = []
+        try:
+            async for delta in llm_client.stream_chat(
+                _analysis_messages(req),
+                temperature=0.85,
+                provider=req.provider,
+                budget=BUDGETS["analyze"],
+            ):
+                started = time.perf_counter()
+                entries = []
+                for raw in scanner.feed(delta):
+                    try:
+                        entry = json.loads(raw, strict=False)
+                    except ValueError:
+                        continue
+                    if isinstance(entry, dict):
+                        entries.append(entry)
+                extract_time += time.perf_counter() - started
+                for entry in entries:
+                    started = time.perf_counter()
+                    parsed_cards = _parse_llm_cards([entry])
+                    build_time += time.perf_counter() - started
+                    for card in parsed_cards:
+                        if duplicate_indices([_card_text(card)], keep=[signature(_card_text(c)) for c in cards]):
+                            skipped += 1
+                            continue
+                        cards.append(card)
+                        yield "card", _dump_card(card)
+            if cards:
+                source = "llm"
+                missing = min(skipped, 3 - len(cards))
+                if missing > 0 and DEDUP_REGENERATE:
+                    fresh = await _replacement_cards(req, cards, missing)
+                for card in fresh:
+                    cards.append(card)
+                    yield "card", _dump_card(card)
+                if req.cache != CacheMode.bypass:
+                    await analysis_cache.set(cache_key, [_dump_card(card) for card in cards])
+            else:
+                _record_fallback("analyze_stream", "empty_result")
+        except Exception as exc:
+            source = "partial" if cards else "fallback"
+            _record_fallback("analyze_stream", _fallback_reason(exc))
+        finally:
+            PARSE_DURATION.observe(extract_time, endpoint="analyze_stream", stage="extract")
+            PARSE_DURATION.observe(build_time, endpoint="analyze_stream", stage="build")
+            _record_duplicates("analyze_stream", "regenerated", len(fresh))
+            _record_duplicates("analyze_stream", "dropped", skipped - len(fresh))
+    else:
+        _record_fallback("analyze_stream", "unconfigured")
+
+    if len(cards) < 3 and source != "llm":
+        for card in _fallback_cards(req)[len(cards):]:
+            cards.append(card)
+            yield "card", _dump_card(card)
+
+    yield "done", {"source": source, "count": len(cards)}
+
+
+def _parse_llm_script(data: dict, wrap_brand: bool = False) -> VideoScript | None:
+    """wrap_brand 为真时口播直接带上品牌标签，调用方不必再逐条重建 Scene。"""
     headline = data.get("headline") or "视频口播文案"
 
+    def voice(text: str) -> str:
+        cleaned = text.replace("Scene", "").replace("镜头", "").strip("：: ").strip()
+        return _wrap_brand_tag(cleaned) if wrap_brand else cleaned
+
+    def script(scenes: List[dict]) -> VideoScript:
+        return validate_model(VideoScript, {"headline": headline, "scenes": scenes})
+
     # 优先支持单段口播文案
     full_voice = data.get("voice_over") or data.get("voiceOver")
     if isinstance(full_voice, str) and full_voice.strip():
-        cleaned = full_voice.replace("Scene", "").replace("镜头", "").strip("：: ").strip()
-        return VideoScript(
-            headline=headline,
-            scenes=[
-                Scene(
-                    id=1,
-                    title="口播文案",
-                    visuals="口播视频",
-                    voice_over=cleaned,
-                    screen_text=textwrap.shorten(headline, 32),
-                )
-            ],
+        return script(
+            [
+                {
+                    "id": 1,
+                    "title": "口播文案",
+                    "visuals": "口播视频",
+                    "voice_over": voice(full_voice),
+                    "screen_text": textwrap.shorten(headline, 32),
+                }
+            ]
         )
 
     copies_raw = data.get("copies")
     if isinstance(copies_raw, list) and copies_raw:
-        scenes: List[Scene] = []
+        scenes: List[dict] = []
         for idx, item in enumerate(copies_raw, start=1):
             text = str(item).strip()
             if not text:
                 continue
-            cleaned = text.replace("Scene", "").replace("镜头", "").strip("：: ").strip()
             scenes.append(
-                Scene(
-                    id=idx,
-                    title=f"文案 {idx}",
-                    visuals="口播视频",
-                    voice_over=cleaned,
-                    screen_text=textwrap.shorten(headline, 32),
-                )
+                {
+                    "id": idx,
+                    "title": f"文案 {idx}",
+                    "visuals": "口播视频",
+                    "voice_over": voice(text),
+                    "screen_text": textwrap.shorten(headline, 32),
+                }
             )
         if scenes:
-            return VideoScript(headline=headline, scenes=scenes[:3])
+            return script(scenes[:3])
 
     scenes_raw = data.get("scenes")
     if not isinstance(scenes_raw, list):
         return None
 
-    scenes: List[Scene] = []
+    scenes = []
     for idx, scene in enumerate(scenes_raw, start=1):
         visuals = scene.get("visuals")
         voice_over = scene.get("voice_over") or scene.get("voiceOver")
         if isinstance(voice_over, str):
-            voice_over = voice_over.replace("Scene", "").replace("镜头", "").strip("：: ").strip()
+            voice_over = voice(voice_over)
         screen_text = scene.get("screen_text") or scene.get("screenText")
         title = scene.get("title") or f"Scene {idx}"
         if not (visuals and voice_over):
             continue
         scenes.append(
-            Scene(
-                id=idx,
-                title=title,
-                visuals=visuals,
-                voice_over=voice_over,
-                screen_text=screen_text or textwrap.shorten(visuals, 32),
-            )
+            {
+                "id": idx,
+                "title": title,
+                "visuals": visuals,
+                "voice_over": voice_over,
+                "screen_text": screen_text or textwrap.shorten(visuals, 32),
+            }
         )
 
     if not scenes:
         return None
 
-    return VideoScript(headline=headline, scenes=scenes)
+    return script(scenes)
+
+
+def _script_from_response(response: LLMResponse) -> VideoScript:
+    with PARSE_DURATION.time(endpoint="script", stage="extract"):
+        parsed = parse_json_payload(response.content, expect=("copies", "scenes", "voice_over", "headline"))
+    if isinstance(parsed, list):
+        parsed = {"copies": parsed}
+    with PARSE_DURATION.time(endpoint="script", stage="build"):
+        script = _parse_llm_script(parsed, wrap_brand=True)
+    if script is None:
+        raise EmptyResultError("模型输出中没有有效脚本")
+    return script
 
 
 def _fallback_script(req: GenerateScriptRequest) -> VideoScript:
@@ -393,53 +784,237 @@ def _fallback_script(req: GenerateScriptRequest) -> VideoScript:
     return VideoScript(headline=headline, scenes=scenes)
 
 
-def generate_video_script(req: GenerateScriptRequest) -> VideoScript:
+def _script_prompt_fields(req: GenerateScriptRequest) -> dict:
+    return {
+        "title": req.selected_card.title,
+        "scenario": req.selected_card.scenario,
+        "pain_point": req.selected_card.pain_point,
+        "solution": req.selected_card.solution,
+        "video_style": req.video_style,
+        "voice_language": req.voice.language,
+        "voice_style": req.voice.voice_style,
+        "age_group": req.voice.age_group,
+        "audience": "对该场景有明确需求的人",
+    }
+
+
+def _variant_from_response(response: LLMResponse) -> Tuple[Optional[str], str]:
+    with PARSE_DURATION.time(endpoint="script_variant", stage="extract"):
+        parsed = parse_json_payload(response.content, expect=("voice_over", "copies", "headline"))
+    if isinstance(parsed, list):
+        parsed = {"copies": parsed}
+    voice_over = parsed.get("voice_over") or parsed.get("voiceOver")
+    if not voice_over and isinstance(parsed.get("copies"), list) and parsed["copies"]:
+        voice_over = parsed["copies"][0]
+    cleaned = str(voice_over or "").replace("Scene", "").replace("镜头", "").strip("：: ").strip()
+    if not cleaned:
+        raise EmptyResultError("模型输出中没有口播文案")
+    return parsed.get("headline"), cleaned
+
+
+def _variant_scene(idx: int, headline: str, voice_over: str) -> Scene:
+    return Scene(
+        id=idx + 1,
+        title=f"文案 {idx + 1}",
+        visuals="口播视频",
+        voice_over=_wrap_brand_tag(voice_over),
+        screen_text=textwrap.shorten(headline, 32),
+    )
+
+
+async def _script_variant(
+    req: GenerateScriptRequest, idx: int, used: Sequence[str] = (), temperature: float = 0.8
+) -> Tuple[Optional[str], str]:
+    """按 SCRIPT_VARIANTS 中第 idx 种风格单独生成一条口播；`used` 非空时要求避开这些已有文案。"""
+    name, rule = SCRIPT_VARIANTS[idx % len(SCRIPT_VARIANTS)]
+    fields = _script_prompt_fields(req)
+    budget = BUDGETS["script_variant"]
+    messages = select_prompt(
+        budget,
+        _chat_messages(SCRIPT_VARIANT_PROMPT.format(variant_name=name, variant_rule=rule, **fields)),
+        _chat_messages(SCRIPT_VARIANT_PROMPT_COMPACT.format(variant_name=name, variant_rule=rule, **fields)),
+    )
+    if used:
+        messages = _with_avoid_hint(messages, used)
+    return await llm_client.chat_routed(
+        messages,
+        _variant_from_response,
+        temperature=temperature,
+        provider=req.provider,
+        budget=budget,
+    )
+
+
+async def _dedupe_script(req: GenerateScriptRequest, script: VideoScript, endpoint: str) -> VideoScript:
+    """
+    检查口播之间是否近似重复：只把重复的几条按原位置的风格并发重新生成，
+    重新生成失败或仍然重复时换成模版中同位置的文案。
+    """
+    texts = [scene.voice_over for scene in script.scenes]
+    duplicates = duplicate_indices(texts)
+    if not duplicates:
+        return script
+    used = [text for idx, text in enumerate(texts) if idx not in duplicates]
+    results: List[object] = [None] * len(duplicates)
+    if DEDUP_REGENERATE:
+        results = await asyncio.gather(
+            *(_script_variant(req, idx, used, temperature=0.95) for idx in duplicates), return_exceptions=True
+        )
+    keep = [signature(text) for text in used]
+    fallback = _fallback_script(req).scenes
+    scenes = list(script.scenes)
+    regenerated = 0
+    for idx, result in zip(duplicates, results):
+        if isinstance(result, tuple) and not duplicate_indices([result[1]], keep=keep):
+            keep.append(signature(result[1]))
+            scenes[idx] = _variant_scene(idx, script.headline, result[1])
+            regenerated += 1
+        else:
+            scenes[idx] = fallback[idx % len(fallback)]
+    _record_duplicates(endpoint, "regenerated", regenerated)
+    _record_duplicates(endpoint, "template", len(duplicates) - regenerated)
+    return VideoScript(headline=script.headline, scenes=scenes)
+
+
+async def _generate_script_variants(req: GenerateScriptRequest) -> Tuple[VideoScript, str]:
+    """
+    三种文案风格各发一次补全并发执行，总耗时约等于最慢的一条；
+    某条失败时用 `_fallback_script` 中同位置的文案补上，三条全部失败时 source 为 fallback。
+    """
+    results = await asyncio.gather(
+        *(_script_variant(req, idx) for idx in range(len(SCRIPT_VARIANTS))), return_exceptions=True
+    )
+    waits = [result for result in results if isinstance(result, OutboundWaitTooLong)]
+    if len(waits) == len(results):
+        raise max(waits, key=lambda exc: exc.estimated_wait)
+    fallback = _fallback_script(req)
+    headline = next(
+        (result[0] for result in results if not isinstance(result, BaseException) and result[0]),
+        fallback.headline,
+    )
+    scenes: List[Scene] = []
+    for idx, result in enumerate(results):
+        if isinstance(result, BaseException):
+            _record_fallback("script_variant", _fallback_reason(result))
+            scenes.append(fallback.scenes[idx])
+            continue
+        scenes.append(_variant_scene(idx, headline, result[1]))
+    if not any(not isinstance(result, BaseException) for result in results):
+        return VideoScript(headline=headline, scenes=scenes), "fallback"
+    # 三条分别生成，互相看不到对方，撞车的概率比一次生成三条更高
+    return await _dedupe_script(req, VideoScript(headline=headline, scenes=scenes), "script_variant"), "llm"
+
+
+async def run_video_script(req: GenerateScriptRequest) -> Tuple[VideoScript, str]:
+    """返回 (script, source)：source 为 precomputed / llm / fallback。"""
+    precomputed = precomputed_script(req)
+    if precomputed is not None:
+        return precomputed, "precomputed"
+
     if llm_client.is_configured():
-        prompt = SCRIPT_PROMPT.format(
-            title=req.selected_card.title,
-            scenario=req.selected_card.scenario,
-            pain_point=req.selected_card.pain_point,
-            solution=req.selected_card.solution,
-            video_style=req.video_style,
-            voice_language=req.voice.language,
-            voice_style=req.voice.voice_style,
-            age_group=req.voice.age_group,
-            audience="对该场景有明确需求的人",
+        parallel = SCRIPT_PARALLEL_VARIANTS if req.parallel_variants is None else req.parallel_variants
+        if parallel:
+            return await _generate_script_variants(req)
+
+        fields = _script_prompt_fields(req)
+        messages = select_prompt(
+            BUDGETS["script"],
+            _chat_messages(SCRIPT_PROMPT.format(**fields)),
+            _chat_messages(SCRIPT_PROMPT_COMPACT.format(**fields)),
         )
         try:
-            response = llm_client.chat(
-                [
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": prompt},
-                ],
+            script = await llm_client.chat_routed(
+                messages,
+                _script_from_response,
                 temperature=0.8,
                 provider=req.provider,
+                budget=BUDGETS["script"],
             )
-            parsed = json.loads(extract_json_block(response.content))
-            script = _parse_llm_script(parsed)
-            if script:
+            # 模版固定 3 条口播，模型给的不足 3 条时用模版同位置的文案补齐
+            if len(script.scenes) < 3:
                 fallback_scenes = _fallback_script(req).scenes
-                scenes = script.scenes
-                if len(scenes) < 5:
-                    scenes = scenes + fallback_scenes[len(scenes):5]
-                wrapped = [
-                    Scene(
-                        id=s.id,
-                        title=s.title,
-                        visuals=s.visuals,
-                        voice_over=_wrap_brand_tag(s.voice_over),
-                        screen_text=s.screen_text,
-                    )
-                    for s in scenes
-                ]
-                return VideoScript(headline=script.headline, scenes=wrapped)
+                script = VideoScript(
+                    headline=script.headline, scenes=script.scenes + fallback_scenes[len(script.scenes):]
+                )
+            return await _dedupe_script(req, script, "script"), "llm"
+        except OutboundWaitTooLong:
+            raise
+        except Exception as exc:
+            _record_fallback("script", _fallback_reason(exc))
+    else:
+        _record_fallback("script", "unconfigured")
+
+    return _fallback_script(req), "fallback"
+
+
+async def generate_video_script(req: GenerateScriptRequest) -> VideoScript:
+    script, _ = await run_video_script(req)
+    return script
+
+
+def _xhs_copies_from_response(response: LLMResponse) -> List[str]:
+    with PARSE_DURATION.time(endpoint="xhs", stage="extract"):
+        parsed = parse_json_payload(response.content, expect=("copies",))
+    copies = parsed.get("copies", []) if isinstance(parsed, dict) else parsed
+    if not isinstance(copies, list) or not copies:
+        raise EmptyResultError("模型输出中没有小红书文案")
+    return copies
+
+
+def _xhs_templates(card: PainPointCard) -> List[str]:
+    """模版文案，条数与 XHS_COUNT 一致且互不重复，模型条数不足时按顺序补位。"""
+    return [
+        f"{card.title}：不少合作方都在意{card.pain_point}，我们用{card.solution}解决关键卡点。#门窗 #工程渠道 #品质交付",
+        f"{card.scenario}正是很多渠道商的真实场景。配置{card.solution}后，交付更稳、反馈更快。#门窗厂家 #系统窗 #靠谱供应",
+        f"如果你也在寻找更稳定的门窗合作伙伴，{card.title}这件事我们已经跑通。欢迎交流对标。#门窗品牌 #工程项目 #合作共赢",
+        f"{card.title}：{card.solution}已在多个项目验证，欢迎交流适配场景。#门窗 #系统窗 #工程渠道",
+        f"做工程渠道最怕什么？{card.pain_point}。我们的做法是{card.solution}，细节可以私信聊。#门窗源头工厂 #渠道合作 #交付保障",
+    ]
+
+
+def _fill_xhs_copies(copies: List[str], templates: Sequence[str]) -> List[str]:
+    """用与已有文案不重复的模版补足 XHS_COUNT 条。"""
+    repeated = set(duplicate_indices(templates, keep=[signature(text) for text in copies]))
+    spare = [text for idx, text in enumerate(templates) if idx not in repeated]
+    return (copies + spare + list(templates))[:XHS_COUNT]
+
+
+async def _dedupe_xhs_copies(req: GenerateXhsRequest, messages: List[dict], raw: List[str]) -> List[str]:
+    """
+    去掉近似重复的文案，只为因重复被去掉的几条重新请求一次，仍不足时用模版补位。
+    模型本身返回不足 XHS_COUNT 条不触发重新请求，直接用模版补齐。
+    """
+    copies = [str(item).strip() for item in raw if str(item).strip()]
+    duplicates = set(duplicate_indices(copies))
+    kept = [text for idx, text in enumerate(copies) if idx not in duplicates][:XHS_COUNT]
+    missing = min(len(duplicates), XHS_COUNT - len(kept))
+    fresh: List[str] = []
+    if missing > 0 and DEDUP_REGENERATE:
+        try:
+            regenerated = await llm_client.chat_routed(
+                _with_avoid_hint(messages, kept, f"只需输出 {missing} 条文案。"),
+                _xhs_copies_from_response,
+                temperature=0.9,
+                provider=req.provider,
+                budget=BUDGETS["xhs"],
+            )
         except Exception:
-            pass
+            regenerated = []
+        candidates = [str(item).strip() for item in regenerated if str(item).strip()]
+        repeated = set(duplicate_indices(candidates, keep=[signature(text) for text in kept]))
+        fresh = [text for idx, text in enumerate(candidates) if idx not in repeated][:missing]
+    _record_duplicates("xhs", "regenerated", min(len(duplicates), len(fresh)))
+    _record_duplicates("xhs", "template", len(duplicates) - min(len(duplicates), len(fresh)))
+    return _fill_xhs_copies(kept + fresh, _xhs_templates(req.selected_card))
 
-    return _fallback_script(req)
 
+async def run_xhs_copies(req: GenerateXhsRequest) -> Tuple[List[str], str]:
+    """返回 (copies, source)：source 为 precomputed / llm / fallback。"""
+    if req.cache is None:
+        stored = pregen_store.get("xhs", _xhs_cache_key(req))
+        if stored:
+            return list(stored), "precomputed"
 
-def generate_xhs_copies(req: GenerateXhsRequest) -> GenerateXhsResponse:
     prompt = XHS_PROMPT.format(
         title=req.selected_card.title,
         scenario=req.selected_card.scenario,
@@ -447,47 +1022,29 @@ def generate_xhs_copies(req: GenerateXhsRequest) -> GenerateXhsResponse:
         solution=req.selected_card.solution,
     )
 
-    def normalize_copies(raw: List[str]) -> List[str]:
-        cleaned = [_wrap_brand_tag(str(item)) for item in raw if str(item).strip()]
-        while len(cleaned) < 5:
-            cleaned.append(
-                _wrap_brand_tag(
-                    f"{req.selected_card.title}：{req.selected_card.solution}已在多个项目验证，"
-                    f"欢迎交流适配场景。#门窗 #系统窗 #工程渠道"
-                )
-            )
-        return cleaned[:5]
-
     if llm_client.is_configured():
         try:
-            response = llm_client.chat(
-                [
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": prompt},
-                ],
+            # XHS_PROMPT 本身已足够精简，不再单独维护精简版
+            messages = _chat_messages(prompt)
+            copies = await llm_client.chat_routed(
+                messages,
+                _xhs_copies_from_response,
                 temperature=0.7,
                 provider=req.provider,
+                budget=BUDGETS["xhs"],
             )
-            parsed = json.loads(extract_json_block(response.content))
-            copies = parsed.get("copies", [])
-            if isinstance(copies, list) and copies:
-                normalized = normalize_copies(copies)
-                return GenerateXhsResponse(copies=normalized)
-        except Exception:
-            pass
-
-    fallback = normalize_copies([
-        _wrap_brand_tag(
-            f"{req.selected_card.title}：不少合作方都在意{req.selected_card.pain_point}，"
-            f"我们用{req.selected_card.solution}解决关键卡点。#门窗 #工程渠道 #品质交付"
-        ),
-        _wrap_brand_tag(
-            f"{req.selected_card.scenario}正是很多渠道商的真实场景。"
-            f"配置{req.selected_card.solution}后，交付更稳、反馈更快。#门窗厂家 #系统窗 #靠谱供应"
-        ),
-        _wrap_brand_tag(
-            f"如果你也在寻找更稳定的门窗合作伙伴，{req.selected_card.title}这件事我们已经跑通。"
-            f"欢迎交流对标。#门窗品牌 #工程项目 #合作共赢"
-        ),
-    ])
-    return GenerateXhsResponse(copies=fallback)
+            copies = await _dedupe_xhs_copies(req, messages, copies)
+            return [_wrap_brand_tag(text) for text in copies], "llm"
+        except OutboundWaitTooLong:
+            raise
+        except Exception as exc:
+            _record_fallback("xhs", _fallback_reason(exc))
+    else:
+        _record_fallback("xhs", "unconfigured")
+
+    return [_wrap_brand_tag(text) for text in _xhs_templates(req.selected_card)], "fallback"
+
+
+async def generate_xhs_copies(req: GenerateXhsRequest) -> GenerateXhsResponse:
+    copies, _ = await run_xhs_copies(req)
+    return GenerateXhsResponse(copies=copies)
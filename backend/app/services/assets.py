@@ -0,0 +1,276 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from .metrics import FILE_WRITE_DURATION, registry
+
+
+DEFAULT_ROOT = Path(__file__).resolve().parent.parent / "generated"
+
+# 内容寻址 blob：<root>/ab/cd/<sha256>.<ext>
+_BLOB_NAME = re.compile(r"^[0-9a-f]{64}\.[A-Za-z0-9]+$")
+_SHARD = re.compile(r"^[0-9a-f]{2}$")
+# 改造前平铺在根目录下的文件，同样纳入保留期清理
+_LEGACY_NAME = re.compile(r"^(demo_video|demo_voice|heygen_debug)_.+\.(txt|json)$")
+_TMP_SUFFIX = ".tmp"
+_TMP_MAX_AGE = 3600
+
+
+@dataclass(frozen=True)
+class StoredAsset:
+    digest: str
+    relative_path: str
+    size: int
+
+    @property
+    def url(self) -> str:
+        return f"/generated/{self.relative_path}"
+
+
+class AssetStore:
+    """
+    生成文件的内容寻址存储，挂在 `/generated/` 下由 StaticFiles 直接提供下载。
+
+    - 文件名是内容的 sha256，相同脚本生成的占位文件只存一份；
+    - 按哈希前两段分两级子目录（256 × 256），避免单个目录堆积几十万个文件；
+    - 先写同目录下的临时文件再 `os.replace`，读者不会看到写了一半的文件；
+    - 写盘交给后台线程池，`put` 立即返回地址和 Future；
+    - 后台线程按保留期和总量上限清理（最久未写入的先删），重复写入同一内容会刷新其 mtime。
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        max_bytes: int,
+        max_age: float,
+        gc_interval: float,
+        write_workers: int = 2,
+    ) -> None:
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.gc_interval = gc_interval
+        self.write_workers = max(write_workers, 1)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._gc_thread: Optional[threading.Thread] = None
+        self.counters: Dict[str, int] = {
+            "writes": 0,
+            "dedup_hits": 0,
+            "bytes_written": 0,
+            "write_errors": 0,
+            "gc_runs": 0,
+            "gc_deleted": 0,
+            "gc_freed_bytes": 0,
+        }
+        self.last_gc: Dict[str, Any] = {}
+
+    # ---- 写入 ----
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.write_workers, thread_name_prefix="asset-writer")
+            return self._executor
+
+    def path_for(self, digest: str, ext: str) -> Path:
+        return self.root / digest[:2] / digest[2:4] / f"{digest}.{ext}"
+
+    def put(self, data: bytes, ext: str, kind: str = "asset") -> Tuple[StoredAsset, Future]:
+        """计算地址并提交后台写入；需要确认落盘时对返回的 Future 调用 `result()`。"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path_for(digest, ext)
+        asset = StoredAsset(digest=digest, relative_path=path.relative_to(self.root).as_posix(), size=len(data))
+        with self._lock:
+            # 同一内容正在写入时共享同一个 Future
+            future = self._pending.get(asset.relative_path)
+            if future is None:
+                future = self._pool().submit(self._write, path, data, kind)
+                self._pending[asset.relative_path] = future
+                future.add_done_callback(lambda _: self._forget(asset.relative_path))
+        return asset, future
+
+    def put_text(self, text: str, ext: str = "txt", kind: str = "asset") -> Tuple[StoredAsset, Future]:
+        return self.put(text.encode("utf-8"), ext, kind)
+
+    def _forget(self, relative_path: str) -> None:
+        with self._lock:
+            self._pending.pop(relative_path, None)
+
+    def _write(self, path: Path, data: bytes, kind: str) -> Path:
+        try:
+            # 已有相同内容：刷新 mtime，保留期从最近一次写入算起
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        else:
+            with self._lock:
+                self.counters["dedup_hits"] += 1
+            return path
+        with FILE_WRITE_DURATION.time(kind=kind):
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}{_TMP_SUFFIX}")
+            try:
+                with open(tmp, "wb") as fh:
+                    fh.write(data)
+                    fh.flush()
+                    os.fsync(fh.fileno())
+                os.replace(tmp, path)
+            except BaseException:
+                with self._lock:
+                    self.counters["write_errors"] += 1
+                tmp.unlink(missing_ok=True)
+                raise
+        with self._lock:
+            self.counters["writes"] += 1
+            self.counters["bytes_written"] += len(data)
+        return path
+
+    # ---- 保留期清理 ----
+
+    def _scan(self) -> Tuple[List[Tuple[float, int, Path]], List[Path]]:
+        """返回 (受管文件 [(mtime, size, path)], 过期的临时文件)。"""
+        files: List[Tuple[float, int, Path]] = []
+        stale_tmp: List[Path] = []
+        now = time.time()
+
+        def visit(entry: os.DirEntry) -> None:
+            stat = entry.stat(follow_symlinks=False)
+            if entry.name.endswith(_TMP_SUFFIX):
+                if now - stat.st_mtime > _TMP_MAX_AGE:
+                    stale_tmp.append(Path(entry.path))
+            else:
+                files.append((stat.st_mtime, stat.st_size, Path(entry.path)))
+
+        with os.scandir(self.root) as top:
+            for entry in top:
+                if entry.is_file(follow_symlinks=False) and _LEGACY_NAME.match(entry.name):
+                    visit(entry)
+                elif entry.is_dir(follow_symlinks=False) and _SHARD.match(entry.name):
+                    with os.scandir(entry.path) as level1:
+                        for sub in level1:
+                            if not (sub.is_dir(follow_symlinks=False) and _SHARD.match(sub.name)):
+                                continue
+                            with os.scandir(sub.path) as level2:
+                                for blob in level2:
+                                    if blob.is_file(follow_symlinks=False) and (
+                                        _BLOB_NAME.match(blob.name) or blob.name.endswith(_TMP_SUFFIX)
+                                    ):
+                                        visit(blob)
+        return files, stale_tmp
+
+    def gc(self) -> Dict[str, Any]:
+        started = time.perf_counter()
+        files, stale_tmp = self._scan()
+        now = time.time()
+        files.sort()  # 最久未写入的在前
+        total = sum(size for _, size, _ in files)
+        doomed: List[Tuple[float, int, Path]] = []
+        kept_bytes = total
+        for mtime, size, path in files:
+            expired = self.max_age > 0 and now - mtime > self.max_age
+            over_quota = self.max_bytes > 0 and kept_bytes > self.max_bytes
+            if not (expired or over_quota):
+                break
+            doomed.append((mtime, size, path))
+            kept_bytes -= size
+
+        deleted = freed = 0
+        for mtime, size, path in doomed:
+            try:
+                # 扫描之后又被重复写入（mtime 已刷新）的文件留到下一轮再判断
+                if path.stat().st_mtime > mtime:
+                    continue
+                path.unlink()
+            except OSError:
+                continue
+            deleted += 1
+            freed += size
+        for path in stale_tmp:
+            path.unlink(missing_ok=True)
+
+        result = {
+            "at": int(now),
+            "scanned": len(files),
+            "deleted": deleted,
+            "freed_bytes": freed,
+            "stale_tmp": len(stale_tmp),
+            "files": len(files) - deleted,
+            "bytes": total - freed,
+            "seconds": round(time.perf_counter() - started, 3),
+        }
+        with self._lock:
+            self.counters["gc_runs"] += 1
+            self.counters["gc_deleted"] += deleted
+            self.counters["gc_freed_bytes"] += freed
+            self.last_gc = result
+        return result
+
+    def _run_gc(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                self.gc()
+            except Exception:  # pragma: no cover - 清理失败不影响服务，下个周期重试
+                with self._lock:
+                    self.counters["gc_runs"] += 1
+            self._stopping.wait(self.gc_interval)
+
+    def start(self) -> None:
+        if self._gc_thread is not None or self.gc_interval <= 0:
+            return
+        self._stopping.clear()
+        self._gc_thread = threading.Thread(target=self._run_gc, name="asset-gc", daemon=True)
+        self._gc_thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stopping.set()
+        if self._gc_thread is not None:
+            self._gc_thread.join(timeout)
+            self._gc_thread = None
+        with self._executor_lock:
+            if self._executor is not None:
+                # 已提交的写入要写完，避免返回过的地址指向不存在的文件
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self.counters,
+                "pending_writes": len(self._pending),
+                "max_bytes": self.max_bytes,
+                "max_age": self.max_age,
+                "last_gc": dict(self.last_gc),
+            }
+
+
+asset_store = AssetStore(
+    root=Path(os.getenv("GENERATED_ASSETS_DIR") or DEFAULT_ROOT),
+    max_bytes=int(float(os.getenv("ASSET_MAX_MB", "2048")) * 1024 * 1024),
+    max_age=float(os.getenv("ASSET_MAX_AGE_DAYS", "30")) * 86400,
+    gc_interval=float(os.getenv("ASSET_GC_INTERVAL", "3600")),
+    write_workers=int(os.getenv("ASSET_WRITE_WORKERS", "2")),
+)
+
+
+def _store_gauge() -> dict:
+    last = asset_store.stats()["last_gc"]
+    if not last:
+        return {}
+    return {("files",): float(last["files"]), ("bytes",): float(last["bytes"])}
+
+
+registry.gauge("aipromo_generated_assets", "生成文件目录的文件数 / 总字节（最近一次清理时统计）", ("unit",)).set_function(_store_gauge)
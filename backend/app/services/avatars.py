@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import base64
+import bisect
+import hashlib
+import json
+import os
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+
+DEFAULT_CATALOG = Path(__file__).resolve().parents[3] / "docs" / "avatarlist.txt"
+
+
+@dataclass(frozen=True)
+class Avatar:
+    __slots__ = ("avatar_id", "avatar_name", "gender", "premium", "preview_image_url", "preview_video_url", "default_voice_id")
+
+    avatar_id: str
+    avatar_name: str
+    gender: str
+    premium: bool
+    preview_image_url: Optional[str]
+    preview_video_url: Optional[str]
+    default_voice_id: Optional[str]
+
+
+def encode_cursor(avatar_id: str) -> str:
+    return base64.urlsafe_b64encode(avatar_id.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> str:
+    padded = cursor + "=" * (-len(cursor) % 4)
+    return base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8")
+
+
+class AvatarCatalog:
+    """
+    HeyGen 数字人目录（docs/avatarlist.txt），启动时解析一次并建立索引。
+
+    - 按 avatar_id 排序存储，id 查询走字典；
+    - gender / premium 维护倒排的下标列表，名称前缀用排序后的小写名称做二分；
+    - 游标为上一页最后一个 avatar_id 的 base64，翻页时二分定位起点；
+    - `version` 为文件内容哈希，用于生成 ETag。
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.version = ""
+        self._avatars: List[Avatar] = []
+        self._ids: List[str] = []
+        self._by_id: Dict[str, int] = {}
+        self._by_gender: Dict[str, List[int]] = {}
+        self._by_premium: Dict[bool, List[int]] = {}
+        self._names: List[Tuple[str, int]] = []
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def load(self) -> None:
+        with self._lock:
+            if self._loaded:
+                return
+            if not self.path.exists():
+                self._loaded = True
+                return
+            raw = self.path.read_bytes()
+            data = json.loads(raw)
+            entries = (data.get("data") or {}).get("avatars") or []
+            avatars = sorted(
+                (
+                    Avatar(
+                        avatar_id=item["avatar_id"],
+                        avatar_name=item.get("avatar_name") or item["avatar_id"],
+                        gender=(item.get("gender") or "unknown").lower(),
+                        premium=bool(item.get("premium")),
+                        preview_image_url=item.get("preview_image_url"),
+                        preview_video_url=item.get("preview_video_url"),
+                        default_voice_id=item.get("default_voice_id"),
+                    )
+                    for item in entries
+                    if item.get("avatar_id")
+                ),
+                key=lambda avatar: avatar.avatar_id,
+            )
+            self._avatars = avatars
+            self._ids = [avatar.avatar_id for avatar in avatars]
+            self._by_id = {avatar_id: idx for idx, avatar_id in enumerate(self._ids)}
+            for idx, avatar in enumerate(avatars):
+                self._by_gender.setdefault(avatar.gender, []).append(idx)
+                self._by_premium.setdefault(avatar.premium, []).append(idx)
+            self._names = sorted((avatar.avatar_name.casefold(), idx) for idx, avatar in enumerate(avatars))
+            self.version = hashlib.sha256(raw).hexdigest()[:16]
+            self._loaded = True
+
+    @property
+    def available(self) -> bool:
+        self.load()
+        return bool(self._avatars)
+
+    def __len__(self) -> int:
+        self.load()
+        return len(self._avatars)
+
+    def get(self, avatar_id: str) -> Optional[Avatar]:
+        self.load()
+        idx = self._by_id.get(avatar_id)
+        return self._avatars[idx] if idx is not None else None
+
+    def __contains__(self, avatar_id: str) -> bool:
+        self.load()
+        return avatar_id in self._by_id
+
+    def _prefix_indices(self, prefix: str) -> List[int]:
+        key = prefix.casefold()
+        start = bisect.bisect_left(self._names, (key,))
+        indices: List[int] = []
+        for name, idx in self._names[start:]:
+            if not name.startswith(key):
+                break
+            indices.append(idx)
+        indices.sort()
+        return indices
+
+    def query(
+        self,
+        gender: Optional[str] = None,
+        premium: Optional[bool] = None,
+        name_prefix: Optional[str] = None,
+        cursor: Optional[str] = None,
+        limit: int = 50,
+    ) -> Tuple[List[Avatar], Optional[str], int]:
+        """Return (page, next_cursor, total_matches) ordered by avatar_id."""
+        self.load()
+        candidates: List[Sequence[int]] = []
+        if gender:
+            candidates.append(self._by_gender.get(gender.lower(), []))
+        if premium is not None:
+            candidates.append(self._by_premium.get(premium, []))
+        if name_prefix:
+            candidates.append(self._prefix_indices(name_prefix))
+
+        if candidates:
+            candidates.sort(key=len)
+            matches: Sequence[int] = candidates[0]
+            for other in candidates[1:]:
+                allowed = set(other)
+                matches = [idx for idx in matches if idx in allowed]
+        else:
+            matches = range(len(self._avatars))
+
+        start = 0
+        if cursor:
+            after = bisect.bisect_right(self._ids, decode_cursor(cursor))
+            start = bisect.bisect_left(matches, after)
+        page_indices = matches[start : start + limit]
+        page = [self._avatars[idx] for idx in page_indices]
+        has_more = start + limit < len(matches)
+        next_cursor = encode_cursor(page[-1].avatar_id) if page and has_more else None
+        return page, next_cursor, len(matches)
+
+
+avatar_catalog = AvatarCatalog(Path(os.getenv("HEYGEN_AVATAR_CATALOG") or DEFAULT_CATALOG))
@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+import asyncio
+import csv
+import io
+import json
+import os
+import re
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from pydantic import ValidationError
+
+from ..models import ProductAnalysisRequest
+from .ai import _dump_card, run_product_analysis
+from .llm import ProviderGate, provider_gate
+from .outbound import Priority, outbound_priority
+
+
+MAX_ROWS = int(os.getenv("ANALYZE_BATCH_MAX_ROWS", "1000"))
+DEFAULT_CONCURRENCY = int(os.getenv("ANALYZE_BATCH_CONCURRENCY", "8"))
+
+_KEYWORD_SPLIT = re.compile(r"[,，;；|\n]")
+
+BatchRow = Tuple[int, Optional[Dict[str, Any]], Optional[str]]
+
+
+def provider_concurrency(name: str) -> int:
+    """每个 provider 的并发上限：ANALYZE_BATCH_CONCURRENCY_<NAME> 优先，否则取全局默认值。"""
+    value = os.getenv(f"ANALYZE_BATCH_CONCURRENCY_{name.upper()}")
+    return max(int(value), 1) if value else max(DEFAULT_CONCURRENCY, 1)
+
+
+class ProviderLimiter:
+    """
+    按 provider 划分的并发闸门，进程内所有批量请求共享：
+    两个批次同时跑时，落到同一 provider 的补全加起来也不会超过上限。
+    通过 `provider_gate` 挂在每次路由尝试上，对冲和故障切换发往其他 provider 时也按实际 provider 占位。
+    """
+
+    def __init__(self) -> None:
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self.in_flight: Dict[str, int] = {}
+
+    def semaphore(self, name: str) -> asyncio.Semaphore:
+        if name not in self._semaphores:
+            self._semaphores[name] = asyncio.Semaphore(provider_concurrency(name))
+        return self._semaphores[name]
+
+    @asynccontextmanager
+    async def slot(self, name: str) -> AsyncIterator[None]:
+        async with self.semaphore(name):
+            self.in_flight[name] = self.in_flight.get(name, 0) + 1
+            try:
+                yield
+            finally:
+                self.in_flight[name] -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            name: {"limit": provider_concurrency(name), "in_flight": self.in_flight.get(name, 0)}
+            for name in self._semaphores
+        }
+
+
+batch_limiter = ProviderLimiter()
+
+
+def _detect_format(filename: str, content_type: str, text: str) -> str:
+    lowered = (filename or "").lower()
+    if lowered.endswith((".jsonl", ".ndjson", ".json")) or "json" in (content_type or ""):
+        return "jsonl"
+    if lowered.endswith(".csv") or "csv" in (content_type or ""):
+        return "csv"
+    return "jsonl" if text.lstrip().startswith("{") else "csv"
+
+
+def _csv_row(row: Dict[str, Optional[str]]) -> Dict[str, Any]:
+    data: Dict[str, Any] = {}
+    for key, value in row.items():
+        if key is None:
+            continue
+        key = key.strip()
+        value = (value or "").strip()
+        if not key or not value:
+            continue
+        if key == "product_keywords":
+            data[key] = [item.strip() for item in _KEYWORD_SPLIT.split(value) if item.strip()]
+        else:
+            data[key] = value
+    return data
+
+
+def parse_batch_rows(data: bytes, filename: str = "", content_type: str = "") -> List[BatchRow]:
+    """
+    把上传文件解析成 (行号, 字段, 错误)。行号从 1 开始，CSV 不计表头；
+    单行解析失败只记错误，不影响其他行。
+    """
+    text = data.decode("utf-8-sig")
+    rows: List[BatchRow] = []
+    if _detect_format(filename, content_type, text) == "jsonl":
+        lines = [line for line in text.splitlines() if line.strip()]
+        for idx, line in enumerate(lines, start=1):
+            try:
+                entry = json.loads(line)
+            except ValueError as exc:
+                rows.append((idx, None, f"JSON 解析失败: {exc}"))
+                continue
+            if not isinstance(entry, dict):
+                rows.append((idx, None, "每行必须是 JSON 对象"))
+                continue
+            rows.append((idx, entry, None))
+    else:
+        for idx, row in enumerate(csv.DictReader(io.StringIO(text)), start=1):
+            rows.append((idx, _csv_row(row), None))
+    return rows
+
+
+def _row_gate(served: List[str]) -> ProviderGate:
+    """占用 `batch_limiter` 的名额，并记下成功返回的 provider（缓存命中或回退模版时为空）。"""
+
+    @asynccontextmanager
+    async def gate(name: str) -> AsyncIterator[None]:
+        async with batch_limiter.slot(name):
+            yield
+        served.append(name)
+
+    return gate
+
+
+async def _analyze_row(row: int, fields: Dict[str, Any]) -> Dict[str, Any]:
+    try:
+        req = ProductAnalysisRequest(**fields)
+    except ValidationError as exc:
+        errors = "; ".join(f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in exc.errors())
+        return {"row": row, "status": "error", "error": errors}
+
+    served: List[str] = []
+    try:
+        # 每行是独立的 task，优先级与闸门只在该行的上下文内生效；与交互请求争配额时排在后面
+        with outbound_priority(Priority.batch), provider_gate(_row_gate(served)):
+            cards, source, error = await run_product_analysis(req)
+    except Exception as exc:  # 除配额排队超时外，run_product_analysis 自身已兜底
+        return {"row": row, "status": "error", "error": str(exc), "product_name": req.product_name}
+    return {
+        "row": row,
+        "status": "fallback" if source == "fallback" else "ok",
+        "source": source,
+        "product_name": req.product_name,
+        "provider": served[0] if served else None,
+        "error": error,
+        "cards": [_dump_card(card) for card in cards],
+    }
+
+
+async def run_batch(rows: List[BatchRow], defaults: Optional[Dict[str, Any]] = None) -> AsyncIterator[Dict[str, Any]]:
+    """
+    并发执行所有行，按完成顺序逐条产出结果，最后产出一条 summary。
+    并发度由 provider 闸门控制，总耗时约为 行数 / 并发上限 × 单次补全耗时。
+    """
+    counts = {"ok": 0, "fallback": 0, "error": 0}
+    tasks: List[asyncio.Task] = []
+    for row, fields, error in rows:
+        if error is not None:
+            counts["error"] += 1
+            yield {"row": row, "status": "error", "error": error}
+            continue
+        merged = {**(defaults or {}), **(fields or {})}
+        tasks.append(asyncio.create_task(_analyze_row(row, merged)))
+
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            result = await next_done
+            counts[result["status"]] += 1
+            yield result
+    finally:
+        # 客户端断开时取消尚未完成的行，避免继续消耗配额
+        for task in tasks:
+            task.cancel()
+
+    yield {"summary": {"total": len(rows), **counts}}
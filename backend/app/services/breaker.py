@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator
+
+
+# record() 的结论：success 关闭熔断，failure 计入连续失败，ignore 不改变状态（取消、截止时间等与上游健康无关）
+SUCCESS, FAILURE, IGNORE = "success", "failure", "ignore"
+
+STATE_VALUES = {"closed": 0.0, "half_open": 1.0, "open": 2.0}
+
+
+class CircuitOpenError(RuntimeError):
+    """熔断打开期间直接拒绝调用，调用方立即走兜底。"""
+
+    def __init__(self, name: str, retry_in: float) -> None:
+        super().__init__(f"{name} 已熔断，{retry_in:.0f}s 后探测恢复")
+        self.name = name
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    单个上游（provider + 模型）的熔断器：
+
+    - closed：正常放行，连续失败 `failure_threshold` 次后打开；
+    - open：直接抛 CircuitOpenError，冷却 `cooldown` 秒后进入 half_open；
+    - half_open：只放行一个探测请求，成功则关闭，失败则重新打开且冷却时间翻倍（上限 `max_cooldown`）。
+
+    `failure_threshold <= 0` 时不熔断。
+    """
+
+    def __init__(self, name: str, failure_threshold: int, cooldown: float, max_cooldown: float) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max(max_cooldown, cooldown)
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = {"opened": 0, "short_circuited": 0, "probes": 0, "recovered": 0}
+
+    def acquire(self) -> bool:
+        """放行时返回是否为探测请求；熔断打开时抛 CircuitOpenError。"""
+        with self._lock:
+            if self.state == "closed":
+                return False
+            if self.state == "open":
+                retry_in = self.opened_at + self.cooldown - time.monotonic()
+                if retry_in > 0:
+                    self.counters["short_circuited"] += 1
+                    raise CircuitOpenError(self.name, retry_in)
+                self.state = "half_open"
+            if self._probing:
+                self.counters["short_circuited"] += 1
+                raise CircuitOpenError(self.name, 0.0)
+            self._probing = True
+            self.counters["probes"] += 1
+            return True
+
+    def _open(self) -> None:
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        self.counters["opened"] += 1
+
+    def record(self, probe: bool, verdict: str) -> None:
+        with self._lock:
+            if probe:
+                self._probing = False
+            if verdict == SUCCESS:
+                self.failures = 0
+                if self.state != "closed":
+                    self.state = "closed"
+                    self.cooldown = self.base_cooldown
+                    self.counters["recovered"] += 1
+            elif verdict == FAILURE:
+                self.failures += 1
+                if probe and self.state == "half_open":
+                    self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+                    self._open()
+                elif self.state == "closed" and 0 < self.failure_threshold <= self.failures:
+                    self._open()
+
+    @contextmanager
+    def guard(self, classify: Callable[[BaseException], str]) -> Iterator[bool]:
+        """包住一次上游调用：异常交给 `classify` 判定是否计入失败，正常结束记为成功。"""
+        probe = self.acquire()
+        try:
+            yield probe
+        except BaseException as exc:
+            self.record(probe, classify(exc))
+            raise
+        self.record(probe, SUCCESS)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            retry_in = self.opened_at + self.cooldown - time.monotonic() if self.state == "open" else 0.0
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "cooldown": self.cooldown,
+                "retry_in": round(max(retry_in, 0.0), 1),
+                **self.counters,
+            }
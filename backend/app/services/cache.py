@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+
+class ResultCache:
+    """Two-tier result cache: in-memory LRU with TTL, plus an optional SQLite tier.
+
+    值需可 JSON 序列化；SQLite 层用于进程重启后保留结果，未配置路径时只使用内存层。
+    SQLite 读写放到线程池执行，不阻塞事件循环；过期行在写入时每隔 `purge_interval` 秒批量清理一次。
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        max_entries: int,
+        ttl: float,
+        db_path: Optional[str] = None,
+        purge_interval: float = 3600.0,
+    ) -> None:
+        self.namespace = namespace
+        self.max_entries = max(max_entries, 0)
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # 内存层与 SQLite 连接分开加锁，内存命中不用等磁盘读写
+        self._db_lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._last_purge = 0.0
+        self.counters: Dict[str, int] = {
+            "hits_memory": 0,
+            "hits_disk": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "bypasses": 0,
+            "purged": 0,
+        }
+        if db_path:
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS result_cache ("
+                " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL NOT NULL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+            self._db.commit()
+
+    def _remember(self, key: str, expires_at: float, value: Any) -> None:
+        if self.max_entries == 0:
+            return
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    async def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.counters["hits_memory"] += 1
+                    return value
+                del self._entries[key]
+            if self._db is None:
+                self.counters["misses"] += 1
+                return None
+
+        found = await asyncio.to_thread(self._load, key, now)
+        with self._lock:
+            if found is None:
+                self.counters["misses"] += 1
+                return None
+            expires_at, value = found
+            self._remember(key, expires_at, value)
+            self.counters["hits_disk"] += 1
+            return value
+
+    async def set(self, key: str, value: Any) -> None:
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, expires_at, value)
+            self.counters["stores"] += 1
+        if self._db is not None:
+            await asyncio.to_thread(self._store, key, json.dumps(value, ensure_ascii=False), expires_at)
+
+    def _load(self, key: str, now: float) -> Optional[Tuple[float, Any]]:
+        assert self._db is not None
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT value, expires_at FROM result_cache WHERE namespace = ? AND key = ?",
+                (self.namespace, key),
+            ).fetchone()
+        # 过期行不在读取时逐条删除，交给写入时的批量清理
+        if row is None or row[1] <= now:
+            return None
+        return row[1], json.loads(row[0])
+
+    def _store(self, key: str, payload: str, expires_at: float) -> None:
+        assert self._db is not None
+        now = time.time()
+        purged = 0
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO result_cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (self.namespace, key, payload, expires_at),
+            )
+            if now - self._last_purge >= self.purge_interval:
+                self._last_purge = now
+                purged = self._db.execute(
+                    "DELETE FROM result_cache WHERE namespace = ? AND expires_at <= ?", (self.namespace, now)
+                ).rowcount
+            self._db.commit()
+        if purged:
+            with self._lock:
+                self.counters["purged"] += purged
+
+    def record_bypass(self) -> None:
+        with self._lock:
+            self.counters["bypasses"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self.counters)
+            size = len(self._entries)
+        lookups = counters["hits_memory"] + counters["hits_disk"] + counters["misses"]
+        hits = counters["hits_memory"] + counters["hits_disk"]
+        return {
+            **counters,
+            "namespace": self.namespace,
+            "size": size,
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "persistent": self._db is not None,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+analysis_cache = ResultCache(
+    "analyze",
+    max_entries=int(os.getenv("ANALYZE_CACHE_SIZE", "512")),
+    ttl=float(os.getenv("ANALYZE_CACHE_TTL", "21600")),
+    db_path=os.getenv("ANALYZE_CACHE_DB") or None,
+    purge_interval=float(os.getenv("ANALYZE_CACHE_PURGE_INTERVAL", "3600")),
+)
@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from typing import Any, Awaitable, Callable, Iterator, Optional, TypeVar
+
+
+T = TypeVar("T")
+
+# 请求头给出本次请求剩余的总预算（毫秒），所有上游调用（排队 + 请求）都不会超过它
+DEADLINE_HEADER = "X-Deadline-Ms"
+# 请求未带头时的默认预算（毫秒），0 表示不设
+DEFAULT_DEADLINE_MS = float(os.getenv("REQUEST_DEADLINE_MS", "0"))
+
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(RuntimeError):
+    """本次请求的上游预算已用完。"""
+
+
+def parse_deadline_header(value: Optional[str]) -> Optional[float]:
+    """把请求头换算成秒；未带头时取默认预算。非正数或无法解析时抛 ValueError。"""
+    if value is None or not value.strip():
+        return DEFAULT_DEADLINE_MS / 1000 if DEFAULT_DEADLINE_MS > 0 else None
+    millis = float(value)
+    if not millis > 0:
+        raise ValueError(value)
+    return millis / 1000
+
+
+def current_deadline() -> Optional[float]:
+    """当前请求的截止时刻（time.monotonic()），没有时为 None。"""
+    return _deadline.get()
+
+
+def remaining() -> Optional[float]:
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def check() -> None:
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded("请求的上游预算已用完")
+
+
+@contextmanager
+def deadline_scope(seconds: Optional[float]) -> Iterator[None]:
+    """在该上下文内设置截止时间；已有更早的截止时间时保留更早的那个。"""
+    if seconds is None:
+        yield
+        return
+    deadline = time.monotonic() + seconds
+    outer = _deadline.get()
+    token = _deadline.set(deadline if outer is None else min(outer, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def run_detached(fn: Callable[..., T], *args: Any) -> T:
+    """在清除了截止时间的上下文副本里调用 fn，用于请求返回后仍要继续的后台任务。"""
+    context = copy_context()
+    context.run(_deadline.set, None)
+    return context.run(fn, *args)
+
+
+async def within_deadline(awaitable: Awaitable[T]) -> T:
+    """等待 awaitable，超过当前截止时间时取消它并抛 DeadlineExceeded。"""
+    left = remaining()
+    if left is None:
+        return await awaitable
+    check()
+    try:
+        return await asyncio.wait_for(awaitable, left)
+    except asyncio.TimeoutError as exc:
+        raise DeadlineExceeded("请求的上游预算已用完") from exc
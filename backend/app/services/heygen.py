@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import os
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .metrics import HEYGEN_DURATION, HEYGEN_IN_FLIGHT
+from .outbound import OutboundLane, Priority, outbound, parse_retry_after
+
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+def _env_float(name: str, default: float) -> float:
+    raw = os.getenv(name)
+    return float(raw) if raw else default
+
+
+@dataclass(frozen=True)
+class HeygenConfig:
+    """HeyGen 相关配置，启动时从环境变量解析一次。"""
+
+    api_key: Optional[str]
+    api_url: str
+    status_url: str
+    avatar_id: str
+    avatar_style: str
+    voice_id: str
+    background_music_id: Optional[str]
+    brand_logo_url: Optional[str]
+    callback_url: Optional[str]
+    webhook_secret: Optional[str]
+    submit_timeout: float
+    status_timeout: float
+    submit_rate_per_min: float
+    submit_burst: float
+    status_rate_per_min: float
+    status_burst: float
+    max_retries: int
+    backoff_base: float
+    backoff_max: float
+    pool_size: int
+
+    @classmethod
+    def from_env(cls) -> "HeygenConfig":
+        return cls(
+            api_key=os.getenv("HEYGEN_API_KEY"),
+            # 默认使用官方示例的 v2 生成接口，可通过 HEYGEN_API_URL 覆盖
+            api_url=os.getenv("HEYGEN_API_URL", "https://api.heygen.com/v2/video/generate"),
+            status_url=os.getenv("HEYGEN_STATUS_URL", "https://api.heygen.com/v1/video_status.get?video_id="),
+            avatar_id=os.getenv("HEYGEN_AVATAR_ID", "Miyu_standing_office_front"),
+            avatar_style=os.getenv("HEYGEN_AVATAR_STYLE", "normal"),
+            voice_id=os.getenv("HEYGEN_VOICE_ID", "119caed25533477ba63822d5d1552d25"),
+            background_music_id=os.getenv("HEYGEN_BACKGROUND_MUSIC_ID") or None,
+            brand_logo_url=os.getenv("HEYGEN_BRAND_LOGO_URL") or None,
+            callback_url=os.getenv("HEYGEN_CALLBACK_URL") or None,
+            webhook_secret=os.getenv("HEYGEN_WEBHOOK_SECRET") or None,
+            submit_timeout=_env_float("HEYGEN_SUBMIT_TIMEOUT", 120),
+            status_timeout=_env_float("HEYGEN_STATUS_TIMEOUT", 60),
+            submit_rate_per_min=_env_float("HEYGEN_SUBMIT_RATE_PER_MIN", 10),
+            submit_burst=_env_float("HEYGEN_SUBMIT_BURST", 3),
+            status_rate_per_min=_env_float("HEYGEN_STATUS_RATE_PER_MIN", 120),
+            status_burst=_env_float("HEYGEN_STATUS_BURST", 20),
+            max_retries=int(os.getenv("HEYGEN_MAX_RETRIES", "3")),
+            backoff_base=_env_float("HEYGEN_BACKOFF_BASE", 1.0),
+            backoff_max=_env_float("HEYGEN_BACKOFF_MAX", 30.0),
+            pool_size=int(os.getenv("HEYGEN_POOL_SIZE", "20")),
+        )
+
+    def status_url_for(self, video_id: str) -> str:
+        base = self.status_url
+        return base.format(video_id=video_id) if "{video_id}" in base else f"{base}{video_id}"
+
+
+class HeygenClient:
+    """HeyGen API 客户端：keep-alive 会话 + 提交/查询两条限流通道（共用 outbound 调度）+ 状态查询的 429/5xx 重试。"""
+
+    def __init__(self, config: HeygenConfig) -> None:
+        self.config = config
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=config.pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.submit_lane = outbound.configure("heygen_submit", config.submit_rate_per_min, rpm_burst=config.submit_burst)
+        self.status_lane = outbound.configure("heygen_status", config.status_rate_per_min, rpm_burst=config.status_burst)
+
+    def is_configured(self) -> bool:
+        return bool(self.config.api_key)
+
+    def _headers(self, with_body: bool) -> Dict[str, str]:
+        headers = {"x-api-key": self.config.api_key or "", "accept": "application/json"}
+        if with_body:
+            headers["Content-Type"] = "application/json"
+        return headers
+
+    def _backoff(self, attempt: int) -> float:
+        # equal jitter：在 [ceiling/2, ceiling] 内随机，避免多个线程同时重试
+        ceiling = min(self.config.backoff_max, self.config.backoff_base * (2 ** attempt))
+        return random.uniform(ceiling / 2, ceiling)
+
+    def _request(
+        self,
+        method: str,
+        url: str,
+        lane: OutboundLane,
+        timeout: float,
+        priority: Optional[Priority] = None,
+        retries: Optional[int] = None,
+        **kwargs: Any,
+    ) -> requests.Response:
+        max_retries = self.config.max_retries if retries is None else retries
+        attempt = 0
+        while True:
+            lane.acquire(priority=priority)
+            try:
+                resp = self.session.request(method, url, timeout=timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= max_retries:
+                    raise
+                time.sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+
+            if resp.status_code not in RETRYABLE_STATUS or attempt >= max_retries:
+                resp.raise_for_status()
+                return resp
+
+            retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+            if retry_after is not None:
+                # 让同一通道上的所有调用方都遵守 Retry-After，下一次 acquire 会等待剩余时间
+                lane.penalize(retry_after)
+                time.sleep(random.uniform(0, self.config.backoff_base))
+            else:
+                time.sleep(self._backoff(attempt))
+            attempt += 1
+
+    def _timed(self, operation: str, method: str, url: str, lane: OutboundLane, timeout: float, **kwargs: Any) -> dict:
+        outcome = "error"
+        started = time.perf_counter()
+        try:
+            with HEYGEN_IN_FLIGHT.track_inprogress(operation=operation):
+                data = self._request(method, url, lane, timeout, **kwargs).json()
+            outcome = "ok"
+            return data
+        finally:
+            HEYGEN_DURATION.observe(time.perf_counter() - started, operation=operation, outcome=outcome)
+
+    def submit(self, payload: dict, priority: Optional[Priority] = None) -> dict:
+        """提交不在客户端重试：超时时 HeyGen 可能已经开始渲染，重试交给任务队列判断。"""
+        return self._timed(
+            "submit",
+            "POST",
+            self.config.api_url,
+            self.submit_lane,
+            self.config.submit_timeout,
+            priority=priority,
+            retries=0,
+            headers=self._headers(with_body=True),
+            json=payload,
+        )
+
+    def status(self, video_id: str, priority: Optional[Priority] = None) -> dict:
+        return self._timed(
+            "status",
+            "GET",
+            self.config.status_url_for(video_id),
+            self.status_lane,
+            self.config.status_timeout,
+            priority=priority,
+            headers=self._headers(with_body=False),
+        )
+
+    def close(self) -> None:
+        self.session.close()
+
+
+heygen_client = HeygenClient(HeygenConfig.from_env())
@@ -0,0 +1,243 @@
+from __future__ import annotations
+
+import json
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+
+TERMINAL_STATUSES = {"succeeded", "failed"}
+
+
+class RetryableJobError(Exception):
+    """Raised by a job handler to ask for another attempt after a backoff."""
+
+
+class JobCheckpoint:
+    """handler 的持久化进度：`data` 为上次执行（含进程中断前）记录的内容，`save` 立即写库。"""
+
+    def __init__(self, queue: "JobQueue", job_id: str, data: Dict[str, Any]) -> None:
+        self.queue = queue
+        self.job_id = job_id
+        self.data = data
+
+    def save(self, **values: Any) -> None:
+        self.data.update(values)
+        self.queue._execute(
+            "UPDATE jobs SET checkpoint = ? WHERE id = ?", (json.dumps(self.data, ensure_ascii=False), self.job_id)
+        )
+
+
+JobHandler = Callable[[Dict[str, Any], int, bool, JobCheckpoint], Dict[str, Any]]
+
+
+class JobQueue:
+    """
+    SQLite（WAL）持久化的后台任务队列 + 线程池。
+
+    - `enqueue` 只写一行记录并立即返回 job_id；
+    - worker 线程按创建时间领取任务，调用 `handler(payload, attempt, final_attempt, checkpoint)`；
+      handler 抛出 RetryableJobError 时按 jitter 指数退避重新排队，超过次数则标记失败；
+    - 进程重启后，上次处于 running 的任务会被重新放回队列，handler 会再执行一次。
+      有外部副作用的 handler（例如提交付费渲染）要在副作用前后用 `checkpoint.save` 记录进度，
+      重新执行时据 `checkpoint.data` 跳过已完成的步骤，或在无法确认时放弃而不是重做。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        db_path: Path,
+        handler: JobHandler,
+        workers: int = 2,
+        max_attempts: int = 3,
+        retry_base: float = 5.0,
+        poll_interval: float = 1.0,
+    ) -> None:
+        self.name = name
+        self.db_path = Path(db_path)
+        self.handler = handler
+        self.workers = max(workers, 1)
+        self.max_attempts = max(max_attempts, 1)
+        self.retry_base = retry_base
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._db: Optional[sqlite3.Connection] = None
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(str(self.db_path), check_same_thread=False, timeout=30)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY, queue TEXT NOT NULL, status TEXT NOT NULL, payload TEXT NOT NULL,"
+                " result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0,"
+                " created_at REAL NOT NULL, not_before REAL NOT NULL, first_started_at REAL,"
+                " started_at REAL, finished_at REAL, checkpoint TEXT)"
+            )
+            # 早期版本建的表没有 checkpoint 列
+            if "checkpoint" not in {row["name"] for row in db.execute("PRAGMA table_info(jobs)")}:
+                db.execute("ALTER TABLE jobs ADD COLUMN checkpoint TEXT")
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (queue, status, not_before, created_at)")
+            db.commit()
+            self._db = db
+        return self._db
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        with self._lock:
+            db = self._conn()
+            cursor = db.execute(sql, params)
+            db.commit()
+            return cursor
+
+    def enqueue(self, payload: Dict[str, Any]) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._execute(
+            "INSERT INTO jobs (id, queue, status, payload, created_at, not_before) VALUES (?, ?, 'queued', ?, ?, ?)",
+            (job_id, self.name, json.dumps(payload, ensure_ascii=False), now, now),
+        )
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._execute(
+            "SELECT id, status, result, error, attempts, created_at, first_started_at, finished_at"
+            " FROM jobs WHERE id = ? AND queue = ?",
+            (job_id, self.name),
+        ).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def recent_results(self, since: float) -> List[Tuple[Dict[str, Any], float]]:
+        """`since` 之后成功结束的任务，返回 (result, finished_at)。"""
+        rows = self._execute(
+            "SELECT result, finished_at FROM jobs WHERE queue = ? AND status = 'succeeded' AND finished_at >= ?",
+            (self.name, since),
+        ).fetchall()
+        return [(json.loads(row["result"]), row["finished_at"]) for row in rows if row["result"]]
+
+    def _claim(self) -> Optional[sqlite3.Row]:
+        now = time.time()
+        with self._lock:
+            db = self._conn()
+            row = db.execute(
+                "SELECT id, payload, attempts, checkpoint FROM jobs WHERE queue = ? AND status = 'queued' AND not_before <= ?"
+                " ORDER BY created_at LIMIT 1",
+                (self.name, now),
+            ).fetchone()
+            if row is None:
+                return None
+            # status 条件保证多进程共享同一个库时也只会有一个 worker 领到
+            claimed = db.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?,"
+                " first_started_at = COALESCE(first_started_at, ?) WHERE id = ? AND status = 'queued'",
+                (now, now, row["id"]),
+            ).rowcount
+            db.commit()
+        return row if claimed else None
+
+    def _run_one(self, row: sqlite3.Row) -> None:
+        attempt = row["attempts"] + 1
+        final = attempt >= self.max_attempts
+        checkpoint = JobCheckpoint(self, row["id"], json.loads(row["checkpoint"]) if row["checkpoint"] else {})
+        try:
+            result = self.handler(json.loads(row["payload"]), attempt, final, checkpoint)
+        except RetryableJobError as exc:
+            if not final:
+                delay = self.retry_base * (2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+                self._execute(
+                    "UPDATE jobs SET status = 'queued', error = ?, not_before = ? WHERE id = ?",
+                    (str(exc), time.time() + delay, row["id"]),
+                )
+                return
+            self._finish(row["id"], "failed", None, str(exc))
+        except Exception as exc:  # pragma: no cover - handler bug, keep worker alive
+            self._finish(row["id"], "failed", None, str(exc))
+        else:
+            self._finish(row["id"], "succeeded", result, None)
+
+    def _finish(self, job_id: str, status: str, result: Optional[Dict[str, Any]], error: Optional[str]) -> None:
+        self._execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+            (status, json.dumps(result, ensure_ascii=False) if result is not None else None, error, time.time(), job_id),
+        )
+
+    def _worker(self) -> None:
+        while not self._stopping.is_set():
+            row = self._claim()
+            if row is None:
+                with self._wakeup:
+                    self._wakeup.wait(self.poll_interval)
+                continue
+            self._run_one(row)
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        self._stopping.clear()
+        # 上次进程退出时仍在执行的任务重新排队，是否重做副作用由 handler 按 checkpoint 判断
+        self._execute(
+            "UPDATE jobs SET status = 'queued', not_before = ? WHERE queue = ? AND status = 'running'",
+            (time.time(), self.name),
+        )
+        for idx in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"{self.name}-worker-{idx}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stopping.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            db = self._conn()
+            counts = {
+                row["status"]: row["n"]
+                for row in db.execute(
+                    "SELECT status, COUNT(*) AS n FROM jobs WHERE queue = ? GROUP BY status", (self.name,)
+                )
+            }
+            oldest = db.execute(
+                "SELECT MIN(created_at) FROM jobs WHERE queue = ? AND status = 'queued'", (self.name,)
+            ).fetchone()[0]
+            waits = db.execute(
+                "SELECT AVG(first_started_at - created_at), MAX(first_started_at - created_at),"
+                " AVG(finished_at - first_started_at) FROM ("
+                "  SELECT created_at, first_started_at, finished_at FROM jobs"
+                "  WHERE queue = ? AND first_started_at IS NOT NULL ORDER BY created_at DESC LIMIT 100)",
+                (self.name,),
+            ).fetchone()
+        return {
+            "queue": self.name,
+            "workers": self.workers,
+            "depth": counts.get("queued", 0),
+            "running": counts.get("running", 0),
+            "succeeded": counts.get("succeeded", 0),
+            "failed": counts.get("failed", 0),
+            "oldest_queued_age": round(now - oldest, 3) if oldest else 0.0,
+            "recent_wait_avg": round(waits[0], 3) if waits[0] is not None else None,
+            "recent_wait_max": round(waits[1], 3) if waits[1] is not None else None,
+            "recent_run_avg": round(waits[2], 3) if waits[2] is not None else None,
+        }
@@ -0,0 +1,279 @@
+from __future__ import annotations
+
+import json
+import re
+from typing import Any, List, Optional, Sequence, Tuple
+
+
+# 字符串内部只需关心引号与反斜杠，其余字符整段拷贝
+_STRING_STOP = re.compile(r'["\\“”]')
+# 结构位置上的空白与字面量（数字、true/false/null）同样整段拷贝
+_PLAIN_RUN = re.compile(r'[^"“”{}\[\],，:：]+')
+_START = re.compile(r"[{\[]")
+# 快速路径：闭合引号后紧跟结构字符的规范字符串，一次匹配整段拷贝
+_CLEAN_STRING = re.compile(r'"[^"\\“”]*(?:\\.[^"\\“”]*)*"(?=[ \t\r\n]*[,:}\]：])')
+_FULLWIDTH_STRUCTURAL = {"，": ",", "：": ":"}
+_WHITESPACE = " \t\r\n"
+# 候选闭合引号之后出现这些字符才确认字符串结束，否则视为正文里未转义的引号
+_CLOSE_CONFIRM = ",:}]："
+_MAX_CANDIDATES = 8
+
+
+class TolerantJsonScanner:
+    """Linear, incremental scanner that repairs the first JSON value in LLM output.
+
+    - 跳过 JSON 之前的说明文字/代码块标记，顶层值闭合后忽略后续内容；
+    - 字符串感知：正文中的括号不影响深度，未转义的内部引号会被转义；
+    - 修复常见瑕疵：尾逗号、结构位置的全角引号/逗号/冒号、数组元素间缺失的逗号；
+    - 输出被截断时回退到最后一个完整值并补齐括号，例如 3 张卡片只保留前 2 张。
+
+    `feed` 可逐段调用，返回本段内闭合的“首个数组中的对象元素”（已修复的原文），
+    供流式接口提前解析；`finish` 返回修复后的完整文本。
+    """
+
+    def __init__(self) -> None:
+        self._out: List[str] = []
+        self._stack: List[str] = []
+        self._started = False
+        self.closed = False
+        self.start_index: Optional[int] = None
+        self._consumed = 0
+        self._in_string = False
+        self._string_fullwidth = False
+        self._escaped = False
+        self._pending_close: Optional[str] = None
+        self._pending_quote = '"'
+        self._pending_comma: Optional[int] = None
+        self._last_sig = ""
+        self._cut: Tuple[int, int] = (0, 0)
+        self._array_depth: Optional[int] = None
+        self._element_start: Optional[int] = None
+
+    def _open(self, char: str) -> None:
+        self._stack.append(char)
+        depth = len(self._stack)
+        if char == "[" and self._array_depth is None:
+            self._array_depth = depth
+        elif (
+            char == "{"
+            and self._array_depth is not None
+            and depth == self._array_depth + 1
+            and self._stack[-2] == "["
+        ):
+            self._element_start = len(self._out)
+        self._out.append(char)
+        self._pending_comma = None
+        self._last_sig = char
+        if self._element_start != len(self._out) - 1:
+            # 数组里的对象元素刚开头时不设截断点，截断后宁可丢弃该元素也不留空对象
+            self._cut = (len(self._out), depth)
+
+    def _close(self, items: List[str]) -> None:
+        opener = self._stack.pop()
+        if self._pending_comma is not None:
+            self._out[self._pending_comma] = ""
+            self._pending_comma = None
+        closer = "}" if opener == "{" else "]"
+        self._out.append(closer)
+        self._last_sig = closer
+        depth = len(self._stack)
+        if closer == "}" and self._element_start is not None and depth == self._array_depth:
+            items.append("".join(self._out[self._element_start :]))
+            self._element_start = None
+        self._cut = (len(self._out), depth)
+        if not self._stack:
+            self.closed = True
+
+    def _needs_comma(self) -> bool:
+        return bool(self._stack) and self._last_sig in '}]"' and self._pending_comma is None
+
+    def _confirm_close(self) -> None:
+        self._out.append('"')
+        self._out.append(self._pending_close or "")
+        self._pending_close = None
+        self._in_string = False
+        self._last_sig = '"'
+
+    def feed(self, chunk: str) -> List[str]:
+        items: List[str] = []
+        i, n = 0, len(chunk)
+        base = self._consumed
+        self._consumed += n
+
+        while i < n and not self.closed:
+            char = chunk[i]
+
+            if self._pending_close is not None:
+                if char in _WHITESPACE:
+                    self._pending_close += char
+                    i += 1
+                    continue
+                if char in _CLOSE_CONFIRM or (self._string_fullwidth and char == "，"):
+                    self._confirm_close()
+                else:
+                    self._out.append('\\"' if self._pending_quote == '"' else self._pending_quote)
+                    self._out.append(self._pending_close)
+                    self._pending_close = None
+                    continue
+
+            if self._in_string:
+                if self._escaped:
+                    self._out.append(char)
+                    self._escaped = False
+                    i += 1
+                elif char == "\\":
+                    self._out.append(char)
+                    self._escaped = True
+                    i += 1
+                elif char == '"' or (self._string_fullwidth and char in "“”"):
+                    self._pending_close = ""
+                    self._pending_quote = char
+                    i += 1
+                elif char in "“”":
+                    self._out.append(char)
+                    i += 1
+                else:
+                    match = _STRING_STOP.search(chunk, i)
+                    end = match.start() if match else n
+                    self._out.append(chunk[i:end])
+                    i = end
+                continue
+
+            if not self._started:
+                match = _START.search(chunk, i)
+                if match is None:
+                    break
+                i = match.start()
+                char = chunk[i]
+                self._started = True
+                self.start_index = base + i
+
+            char = _FULLWIDTH_STRUCTURAL.get(char, char)
+            if char == '"' or char in "“”":
+                if self._needs_comma():
+                    self._out.append(",")
+                match = _CLEAN_STRING.match(chunk, i) if char == '"' else None
+                if match is not None:
+                    self._out.append(match.group(0))
+                    self._pending_comma = None
+                    self._last_sig = '"'
+                    i = match.end()
+                    continue
+                self._in_string = True
+                self._string_fullwidth = char != '"'
+                self._out.append('"')
+                self._pending_comma = None
+            elif char in "{[":
+                if self._needs_comma() and self._stack[-1] == "[":
+                    self._out.append(",")
+                self._open(char)
+            elif char in "}]":
+                opener = "{" if char == "}" else "["
+                if opener in self._stack:
+                    # 括号不匹配时先补齐内层容器
+                    while self._stack and not self.closed:
+                        top = self._stack[-1]
+                        self._close(items)
+                        if top == opener:
+                            break
+            elif char == ",":
+                if self._pending_comma is None:
+                    self._cut = (len(self._out), len(self._stack))
+                    self._pending_comma = len(self._out)
+                    self._out.append(",")
+                    self._last_sig = ","
+            else:
+                match = _PLAIN_RUN.match(chunk, i)
+                end = match.end() if match else i + 1
+                run = chunk[i:end] if match else char
+                stripped = run.rstrip(_WHITESPACE)
+                if stripped:
+                    self._pending_comma = None
+                    self._last_sig = stripped[-1]
+                self._out.append(run)
+                i = end
+                continue
+            i += 1
+
+        return items
+
+    def finish(self) -> Optional[str]:
+        if self._pending_close is not None:
+            self._confirm_close()
+        if not self._started:
+            return None
+        if self.closed:
+            return "".join(self._out)
+        length, depth = self._cut
+        text = "".join(self._out[:length]).rstrip()
+        if text.endswith(","):
+            text = text[:-1]
+        closers = "".join("}" if c == "{" else "]" for c in reversed(self._stack[:depth]))
+        return text + closers
+
+
+def _accepts(value: Any, expect: Sequence[str]) -> bool:
+    if not expect or isinstance(value, list):
+        return True
+    return isinstance(value, dict) and any(key in value for key in expect)
+
+
+def _preferred(value: Any, expect: Sequence[str]) -> bool:
+    # 期望键对应的是列表时才算“真实输出”，避免命中提示词里 {"cards": "..."} 这类示例
+    if not expect:
+        return True
+    if not isinstance(value, dict):
+        return False
+    return any(isinstance(value.get(key), list) and value.get(key) for key in expect)
+
+
+def parse_json_payload(text: str, expect: Sequence[str] = ()) -> Any:
+    """
+    Parse the first usable JSON value from an LLM response.
+
+    `expect` 为期望的顶层键（如 ``("cards",)``）；若首个候选不含这些键或其值不是非空列表，
+    会继续尝试后续的 JSON 片段。全部失败时抛出 ValueError。
+    """
+    fallback: Any = None
+    stripped = text.strip()
+    if stripped[:1] in ("{", "["):
+        # 快速路径：输出本身就是合法 JSON 时直接交给 C 实现解析
+        try:
+            value = json.loads(stripped, strict=False)
+        except ValueError:
+            value = None
+        if value is not None and _accepts(value, expect):
+            if _preferred(value, expect):
+                return value
+            fallback = value
+
+    offset = 0
+    for _ in range(_MAX_CANDIDATES):
+        scanner = TolerantJsonScanner()
+        scanner.feed(text[offset:])
+        candidate = scanner.finish()
+        if candidate is None or scanner.start_index is None:
+            break
+        try:
+            value = json.loads(candidate, strict=False)
+        except ValueError:
+            value = None
+        if value is not None and _accepts(value, expect):
+            if _preferred(value, expect):
+                return value
+            if fallback is None:
+                fallback = value
+        offset += scanner.start_index + 1
+    if fallback is not None:
+        return fallback
+    raise ValueError("未能从模型输出中解析出 JSON")
+
+
+def extract_json_block(text: str) -> str:
+    """Return first JSON object found in the response text, repaired where possible."""
+    scanner = TolerantJsonScanner()
+    scanner.feed(text)
+    candidate = scanner.finish()
+    if candidate is not None:
+        return candidate
+    return text.strip()
@@ -0,0 +1,216 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .avatars import decode_cursor, encode_cursor
+from .jobs import DATA_DIR
+
+
+# 汉字连续片段切成重叠的二元组（外加片段末字），字母数字按词切分并转小写；
+# FTS5 的 unicode61 分词器再按空格切开，中文检索不依赖 ICU / jieba 等扩展
+_PIECES = re.compile(r"(?P<cjk>[㐀-䶿一-鿿豈-﫿]+)|(?P<word>[0-9A-Za-z]+)")
+
+
+def ngram_text(text: str) -> str:
+    tokens: List[str] = []
+    for match in _PIECES.finditer(text.casefold()):
+        piece = match.group(0)
+        if match.lastgroup == "cjk" and len(piece) > 1:
+            tokens.extend(piece[i : i + 2] for i in range(len(piece) - 1))
+        tokens.append(piece[-1] if match.lastgroup == "cjk" else piece)
+    return " ".join(tokens)
+
+
+def build_match(query: str) -> Optional[str]:
+    """
+    把用户输入转成 body 列上的 FTS5 查询：每一段都必须命中（AND）。
+    两字以上的汉字片段为二元组短语（要求连续出现），单个汉字按前缀匹配（有 1 字前缀索引），
+    字母数字按整词匹配（型号、参数等一般整词输入，前缀查询在高频词上要合并整条倒排表）。
+    """
+    clauses: List[str] = []
+    for match in _PIECES.finditer(query.casefold()):
+        piece = match.group(0)
+        if match.lastgroup == "word":
+            clauses.append(f'"{piece}"')
+        elif len(piece) > 1:
+            clauses.append('"' + " ".join(piece[i : i + 2] for i in range(len(piece) - 1)) + '"')
+        else:
+            clauses.append(f'"{piece}"*')
+    return " AND ".join(f"body : {clause}" for clause in clauses) or None
+
+
+def _normalize(value: str) -> str:
+    return " ".join(str(value).split()).casefold()
+
+
+def _tag(kind: str, value: str) -> str:
+    """产品、渠道写成 tags 列里的单个哈希词，筛选和关键词在 FTS 内一起求交集，不必回表逐行过滤。"""
+    return kind + hashlib.blake2b(_normalize(value).encode("utf-8"), digest_size=8).hexdigest()
+
+
+class CardLibrary:
+    """
+    已保存卡片库（SQLite，WAL）：
+
+    - `saved_cards` 存卡片 JSON，seq 自增且与保存时间同序，列表与检索都按 seq 倒序做 keyset 分页；
+    - `card_search` 为 FTS5 全文索引（rowid = seq）：body 列为产品名、卡片字段与推荐文案的字符二元组，
+      tags 列为产品 / 渠道的哈希词，带筛选条件时整条查询都在倒排表上完成，选择性高的条件不会退化成全表扫描；
+    - 日期筛选先用 saved_at 索引换算成 seq 区间，不会打乱倒序扫描。
+
+    同一张卡片（id 相同）再次保存会删除旧记录后重新插入，排到最前。
+    """
+
+    def __init__(self, db_path: Path) -> None:
+        self.db_path = Path(db_path)
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._last_saved_at = 0.0
+        self.counters: Dict[str, int] = {"saves": 0, "deletes": 0, "lists": 0, "searches": 0}
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(str(self.db_path), check_same_thread=False, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS saved_cards ("
+                " seq INTEGER PRIMARY KEY AUTOINCREMENT, card_id TEXT NOT NULL UNIQUE,"
+                " product TEXT NOT NULL, card TEXT NOT NULL, saved_at REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS saved_cards_saved_at ON saved_cards (saved_at)")
+            # prefix='1'：单字查询走前缀索引
+            db.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS card_search USING fts5(body, tags, tokenize='unicode61', prefix='1')"
+            )
+            db.commit()
+            row = db.execute("SELECT MAX(saved_at) FROM saved_cards").fetchone()
+            self._last_saved_at = row[0] or 0.0
+            self._db = db
+        return self._db
+
+    def _delete(self, db: sqlite3.Connection, card_id: str) -> bool:
+        row = db.execute("SELECT seq FROM saved_cards WHERE card_id = ?", (card_id,)).fetchone()
+        if row is None:
+            return False
+        db.execute("DELETE FROM saved_cards WHERE seq = ?", row)
+        db.execute("DELETE FROM card_search WHERE rowid = ?", row)
+        return True
+
+    def _insert(self, db: sqlite3.Connection, card: Dict[str, Any], product: str) -> Dict[str, Any]:
+        copies = card.get("recommended_copies") or []
+        tags = {_tag("p", product)} | {_tag("c", str(copy["channel"])) for copy in copies if copy.get("channel")}
+        body = " ".join(
+            [product, card.get("title", ""), card.get("scenario", ""), card.get("pain_point", ""), card.get("solution", "")]
+            + [str(copy.get("copy") or copy.get("ad_copy") or "") for copy in copies]
+        )
+        stored = {**card, "saved": True}
+        # 保证 saved_at 单调不减，seq 顺序与保存时间一致
+        saved_at = self._last_saved_at = max(time.time(), self._last_saved_at)
+        self._delete(db, card["id"])
+        seq = db.execute(
+            "INSERT INTO saved_cards (card_id, product, card, saved_at) VALUES (?, ?, ?, ?)",
+            (card["id"], product, json.dumps(stored, ensure_ascii=False), saved_at),
+        ).lastrowid
+        db.execute(
+            "INSERT INTO card_search (rowid, body, tags) VALUES (?, ?, ?)", (seq, ngram_text(body), " ".join(sorted(tags)))
+        )
+        return {"card": stored, "product_name": product, "saved_at": saved_at}
+
+    def save(self, card: Dict[str, Any], product: str) -> Dict[str, Any]:
+        return self.save_many([(card, product)])[0]
+
+    def save_many(self, items: Sequence[Tuple[Dict[str, Any], str]]) -> List[Dict[str, Any]]:
+        """在同一个事务里保存多张卡片。"""
+        with self._lock:
+            db = self._conn()
+            with db:
+                saved = [self._insert(db, card, product) for card, product in items]
+            self.counters["saves"] += len(saved)
+        return saved
+
+    def delete(self, card_id: str) -> bool:
+        with self._lock:
+            db = self._conn()
+            with db:
+                deleted = self._delete(db, card_id)
+            self.counters["deletes"] += int(deleted)
+        return deleted
+
+    def _seq_range(self, db: sqlite3.Connection, since: Optional[float], until: Optional[float]) -> Tuple[int, int]:
+        low, high = 0, 2**62
+        if since is not None:
+            row = db.execute(
+                "SELECT seq FROM saved_cards WHERE saved_at >= ? ORDER BY saved_at LIMIT 1", (since,)
+            ).fetchone()
+            low = row[0] if row else high
+        if until is not None:
+            row = db.execute(
+                "SELECT seq FROM saved_cards WHERE saved_at < ? ORDER BY saved_at DESC LIMIT 1", (until,)
+            ).fetchone()
+            high = row[0] if row else -1
+        return low, high
+
+    def query(
+        self,
+        q: Optional[str] = None,
+        product: Optional[str] = None,
+        channel: Optional[str] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        cursor: Optional[str] = None,
+        limit: int = 20,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """按保存时间倒序返回 (page, next_cursor)；cursor 无效时抛 ValueError。"""
+        before = int(decode_cursor(cursor)) if cursor else None
+        clauses = [build_match(q) if q else None]
+        if product:
+            clauses.append(f"tags : {_tag('p', product)}")
+        if channel:
+            clauses.append(f"tags : {_tag('c', channel)}")
+        match = " AND ".join(clause for clause in clauses if clause)
+        with self._lock:
+            db = self._conn()
+            low, high = self._seq_range(db, since, until)
+            if before is not None:
+                high = min(high, before - 1)
+            if match:
+                rows = db.execute(
+                    "SELECT c.seq, c.product, c.card, c.saved_at FROM card_search s"
+                    " JOIN saved_cards c ON c.seq = s.rowid"
+                    " WHERE card_search MATCH ? AND s.rowid BETWEEN ? AND ? ORDER BY s.rowid DESC LIMIT ?",
+                    (match, low, high, limit + 1),
+                ).fetchall()
+            else:
+                rows = db.execute(
+                    "SELECT seq, product, card, saved_at FROM saved_cards WHERE seq BETWEEN ? AND ?"
+                    " ORDER BY seq DESC LIMIT ?",
+                    (low, high, limit + 1),
+                ).fetchall()
+            self.counters["searches" if q else "lists"] += 1
+        page = [{"card": json.loads(card), "product_name": name, "saved_at": saved_at} for _, name, card, saved_at in rows[:limit]]
+        next_cursor = encode_cursor(str(rows[limit - 1][0])) if len(rows) > limit else None
+        return page, next_cursor
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            db = self._conn()
+            total = db.execute("SELECT COUNT(*) FROM saved_cards").fetchone()[0]
+            return {**self.counters, "cards": total}
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+card_library = CardLibrary(db_path=Path(os.getenv("CARD_LIBRARY_DB") or DATA_DIR / "cards.sqlite3"))
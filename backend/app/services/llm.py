@@ -1,70 +1,511 @@
 from __future__ import annotations
 
+import asyncio
 import json
 import os
 import re
-from dataclasses import dataclass
-from typing import Any, Dict, List, Optional
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, AsyncContextManager, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
 
-import requests
+import httpx
+
+from .json_extract import extract_json_block  # noqa: F401  兼容旧的导入路径
+from .breaker import FAILURE, IGNORE, STATE_VALUES, CircuitBreaker
+from .deadline import (
+    DeadlineExceeded,
+    check as check_deadline,
+    remaining as deadline_remaining,
+    run_detached,
+    within_deadline,
+)
+from .metrics import LLM_DURATION, LLM_IN_FLIGHT, registry
+from .outbound import Grant, OutboundLane, current_priority, outbound, parse_retry_after
+from .routing import router_from_env
+from .tokens import TokenBudget, count_message_tokens, count_tokens, token_meter
+
+
+T = TypeVar("T")
+
+PROVIDERS = ("openai", "deepseek")
+
+# o 系列 / gpt-5 只接受 max_completion_tokens，且不支持 stop；其输出预算还要覆盖推理 token
+REASONING_MODEL = re.compile(r"^(o\d|gpt-5)")
+
+ProviderGate = Callable[[str], AsyncContextManager[None]]
+_provider_gate: ContextVar[Optional[ProviderGate]] = ContextVar("llm_provider_gate", default=None)
+
+
+@contextmanager
+def provider_gate(gate: ProviderGate) -> Iterator[None]:
+    """
+    该上下文内的 `chat_routed` 每次尝试前先进入 `gate(provider)`：对冲与故障切换都在路由选定 provider
+    之后按实际 provider 占位，调用方（如批量分析）的按 provider 并发上限不会被绕过。
+    """
+    token = _provider_gate.set(gate)
+    try:
+        yield
+    finally:
+        _provider_gate.reset(token)
+
+
+def _breaker_verdict(exc: BaseException) -> str:
+    """超时、连接失败、5xx 与无法识别的响应结构计入熔断；取消、请求预算用完、限流排队与 4xx 不计。"""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return FAILURE if exc.response.status_code >= 500 else IGNORE
+    if isinstance(exc, (httpx.TransportError, ValueError, KeyError, IndexError, TypeError)):
+        return FAILURE
+    return IGNORE
 
 
 @dataclass
 class LLMResponse:
     content: str
     raw: Dict[str, Any]
+    usage: Dict[str, int] = field(default_factory=dict)
+
+
+@dataclass
+class ProviderConfig:
+    name: str
+    api_key: Optional[str]
+    base_url: str
+    model: str
 
 
 class LLMClient:
-    """Lightweight wrapper around OpenAI-compatible chat completion API."""
+    """Lightweight async wrapper around OpenAI-compatible chat completion API.
+
+    每个 provider 的 base_url 复用一个 httpx.AsyncClient（keep-alive 连接池），
+    避免每次补全都重新做 TCP + TLS 握手。
+    """
 
     def __init__(self) -> None:
         self.api_key = os.getenv("OPENAI_API_KEY")
         self.base_url = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
         self.model = os.getenv("OPENAI_MODEL", "gpt-5.2")
         self.timeout = float(os.getenv("OPENAI_TIMEOUT", "45"))
+        self.reasoning_allowance = int(os.getenv("LLM_REASONING_TOKEN_ALLOWANCE", "4096"))
+        self.limits = httpx.Limits(
+            max_connections=int(os.getenv("LLM_POOL_MAX_CONNECTIONS", "200")),
+            max_keepalive_connections=int(os.getenv("LLM_POOL_MAX_KEEPALIVE", "50")),
+            keepalive_expiry=float(os.getenv("LLM_POOL_KEEPALIVE_EXPIRY", "60")),
+        )
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        # single-flight：相同 provider/model/messages/temperature 的并发调用共享同一次上游补全
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._flight_waiters: Dict[str, int] = {}
+        self._flight_refs: Dict[str, int] = {}
+        self.singleflight_counters: Dict[str, int] = {
+            "upstream_calls": 0,
+            "coalesced_waiters": 0,
+            "max_waiters": 0,
+        }
+        # 多 provider 路由与对冲；LLM_ROUTING=off 时只调用请求指定（或默认）的 provider
+        self.routing_enabled = os.getenv("LLM_ROUTING", "hedge").lower() not in {"off", "0", "false"}
+        self.router = router_from_env()
+        # 按 provider + 模型熔断：连续失败后直接走模版兜底，冷却后放行一个探测请求
+        self.breaker_failures = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+        self.breaker_cooldown = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+        self.breaker_max_cooldown = float(os.getenv("LLM_BREAKER_MAX_COOLDOWN", "300"))
+        self.probe_timeout = float(os.getenv("LLM_BREAKER_PROBE_TIMEOUT", "10"))
+        self.breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
 
     def is_configured(self) -> bool:
-        return bool(self.api_key)
+        return bool(self.configured_providers())
+
+    def configured_providers(self) -> List[str]:
+        return [name for name in PROVIDERS if self.resolve_provider(name).api_key]
+
+    def pick_provider(self, provider: Optional[str] = None) -> str:
+        """请求指定且已配置的 provider 优先，否则取路由权重最高的已配置 provider。"""
+        name = self.resolve_provider(provider).name
+        names = self.configured_providers()
+        if name in names or not names:
+            return name
+        return max(names, key=self.router.weight)
 
-    def chat(
+    def resolve_provider(self, provider: Optional[str] = None) -> ProviderConfig:
+        if provider and provider.lower() == "deepseek":
+            return ProviderConfig(
+                name="deepseek",
+                api_key=os.getenv("DEEPSEEK_API_KEY"),
+                base_url=os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com/v1"),
+                model=os.getenv("DEEPSEEK_MODEL", "deepseek-chat"),
+            )
+        return ProviderConfig(name="openai", api_key=self.api_key, base_url=self.base_url, model=self.model)
+
+    def breaker_for(self, config: ProviderConfig) -> CircuitBreaker:
+        key = (config.name, config.model)
+        breaker = self.breakers.get(key)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                f"{config.name}/{config.model}", self.breaker_failures, self.breaker_cooldown, self.breaker_max_cooldown
+            )
+            self.breakers[key] = breaker
+        return breaker
+
+    def breaker_stats(self) -> Dict[str, Any]:
+        return {breaker.name: breaker.stats() for breaker in self.breakers.values()}
+
+    def _timeout_for(self, probe: bool) -> Tuple[float, bool]:
+        """返回 (超时秒数, 是否被请求预算截短)；探测请求用更短的超时，尽快确认上游是否恢复。"""
+        timeout = min(self.timeout, self.probe_timeout) if probe else self.timeout
+        left = deadline_remaining()
+        if left is not None and left < timeout:
+            return max(left, 0.001), True
+        return timeout, False
+
+    def _client_for(self, base_url: str) -> httpx.AsyncClient:
+        key = base_url.rstrip("/")
+        client = self._clients.get(key)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(base_url=key, limits=self.limits, timeout=self.timeout)
+            self._clients[key] = client
+        return client
+
+    @staticmethod
+    def _flight_key(
+        config: ProviderConfig,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        budget: Optional[TokenBudget],
+    ) -> str:
+        limits = [budget.max_output, list(budget.stop)] if budget else None
+        # 共享请求按发起方的优先级排队，不同优先级分开合并，交互请求不会被批量请求拖进低优先级队列
+        return json.dumps(
+            [config.name, config.base_url, config.model, messages, temperature, limits, current_priority().name],
+            ensure_ascii=False,
+            sort_keys=True,
+            separators=(",", ":"),
+        )
+
+    async def chat(
         self,
         messages: List[Dict[str, str]],
         temperature: float = 0.7,
         provider: Optional[str] = None,
+        budget: Optional[TokenBudget] = None,
     ) -> LLMResponse:
-        if provider and provider.lower() == "deepseek":
-            api_key = os.getenv("DEEPSEEK_API_KEY")
-            base_url = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com/v1")
-            model = os.getenv("DEEPSEEK_MODEL", "deepseek-chat")
+        config = self.resolve_provider(provider)
+        if not config.api_key:
+            raise RuntimeError("LLM API Key 未配置，无法调用真实模型。")
+
+        key = self._flight_key(config, messages, temperature, budget)
+        task = self._inflight.get(key)
+        if task is None:
+            # 共享请求不带任何调用方的截止时间，各调用方只在等待时按自己的截止时间放弃；
+            # 发起方的截止时间只用于提前判断排队是否来得及
+            check_deadline()
+            outbound.lane(config.name).check(self._token_estimate(messages, budget))
+            task = run_detached(asyncio.ensure_future, self._complete(config, messages, temperature, budget))
+            self._inflight[key] = task
+            self._flight_waiters[key] = 0
+            self.singleflight_counters["upstream_calls"] += 1
+            task.add_done_callback(lambda t, k=key: self._finish_flight(k, t))
         else:
-            api_key = self.api_key
-            base_url = self.base_url
-            model = self.model
+            waiters = self._flight_waiters[key] + 1
+            self._flight_waiters[key] = waiters
+            self.singleflight_counters["coalesced_waiters"] += 1
+            if waiters > self.singleflight_counters["max_waiters"]:
+                self.singleflight_counters["max_waiters"] = waiters
+        self._flight_refs[key] = self._flight_refs.get(key, 0) + 1
+        try:
+            # shield：某个调用方断开或超时不取消其他调用方共享的上游请求
+            return await within_deadline(asyncio.shield(task))
+        except (asyncio.CancelledError, DeadlineExceeded):
+            # 最后一个调用方也放弃了（例如对冲请求落败、截止时间已到），上游请求随之取消
+            if self._flight_refs.get(key) == 1 and not task.done():
+                task.cancel()
+            raise
+        finally:
+            if self._inflight.get(key) is task:
+                self._flight_refs[key] -= 1
 
-        if not api_key:
-            raise RuntimeError("LLM API Key 未配置，无法调用真实模型。")
+    async def chat_routed(
+        self,
+        messages: List[Dict[str, str]],
+        parse: Callable[[LLMResponse], T],
+        temperature: float = 0.7,
+        provider: Optional[str] = None,
+        budget: Optional[TokenBudget] = None,
+    ) -> T:
+        """
+        在已配置的 provider 之间路由并对冲，返回第一个通过 `parse` 的结果。
+        `parse` 抛异常视为该 provider 失败（例如输出无法解析），会触发切换到备选 provider。
+        """
+        preferred = self.resolve_provider(provider).name
+        names = self.configured_providers()
+        if not self.routing_enabled:
+            names = [preferred] if preferred in names else names[:1]
+
+        gate = _provider_gate.get()
 
-        url = f"{base_url.rstrip('/')}/chat/completions"
+        async def attempt(name: str) -> T:
+            if gate is None:
+                return parse(await self.chat(messages, temperature=temperature, provider=name, budget=budget))
+            async with gate(name):
+                return parse(await self.chat(messages, temperature=temperature, provider=name, budget=budget))
+
+        return await self.router.run(self.router.order(names, preferred if provider else None), attempt)
+
+    def routing_stats(self) -> Dict[str, Any]:
+        return {"enabled": self.routing_enabled, "configured": self.configured_providers(), **self.router.stats()}
+
+    def _finish_flight(self, key: str, task: asyncio.Task) -> None:
+        self._inflight.pop(key, None)
+        self._flight_waiters.pop(key, None)
+        self._flight_refs.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # 标记异常已读取，避免所有调用方都已断开时打印告警
+
+    def singleflight_stats(self) -> Dict[str, int]:
+        return {**self.singleflight_counters, "in_flight": len(self._inflight)}
+
+    def _limit_params(self, config: ProviderConfig, budget: Optional[TokenBudget]) -> Dict[str, Any]:
+        if budget is None:
+            return {}
+        if REASONING_MODEL.match(config.model):
+            return {"max_completion_tokens": budget.max_output + self.reasoning_allowance}
+        params: Dict[str, Any] = {"max_tokens": budget.max_output}
+        if budget.stop:
+            params["stop"] = list(budget.stop)
+        return params
+
+    @staticmethod
+    def _token_estimate(messages: List[Dict[str, str]], budget: Optional[TokenBudget]) -> int:
+        return count_message_tokens(messages) + (budget.max_output if budget else 0)
+
+    @classmethod
+    async def _acquire(
+        cls, config: ProviderConfig, messages: List[Dict[str, str]], budget: Optional[TokenBudget]
+    ) -> Tuple[OutboundLane, Grant]:
+        """按 provider 的 RPM / TPM 排队；TPM 先按 prompt + 输出上限预扣，拿到 usage 后再修正。"""
+        lane = outbound.lane(config.name)
+        return lane, await lane.acquire_async(cls._token_estimate(messages, budget))
+
+    @staticmethod
+    def _unsent_tokens(exc: BaseException, estimate: int) -> int:
+        """
+        出错或被取消（对冲落败、截止时间已到）时没有 usage，预扣的 TPM 按 prompt 估算结算；
+        连接都没建立的请求上游没有处理，按 0 结算。
+        """
+        return 0 if isinstance(exc, (httpx.ConnectError, httpx.ConnectTimeout)) else estimate
+
+    @staticmethod
+    def _check_rate_limited(lane: OutboundLane, response: httpx.Response) -> None:
+        if response.status_code == 429:
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            if retry_after is not None:
+                lane.penalize(retry_after)
+
+    @staticmethod
+    def _cached_tokens(usage: Dict[str, Any]) -> int:
+        # OpenAI：usage.prompt_tokens_details.cached_tokens；DeepSeek：usage.prompt_cache_hit_tokens
+        details = usage.get("prompt_tokens_details") or {}
+        return int(details.get("cached_tokens") or usage.get("prompt_cache_hit_tokens") or 0)
+
+    def _record_usage(
+        self,
+        budget: Optional[TokenBudget],
+        messages: List[Dict[str, str]],
+        content: str,
+        usage: Optional[Dict[str, Any]],
+        finish_reason: Optional[str],
+        latency: float,
+    ) -> Dict[str, int]:
+        if usage and usage.get("prompt_tokens") is not None:
+            counts = {
+                "prompt_tokens": int(usage.get("prompt_tokens") or 0),
+                "completion_tokens": int(usage.get("completion_tokens") or 0),
+                "cached_tokens": self._cached_tokens(usage),
+            }
+            estimated = False
+        else:
+            counts = {
+                "prompt_tokens": count_message_tokens(messages),
+                "completion_tokens": count_tokens(content),
+                "cached_tokens": 0,
+            }
+            estimated = True
+        token_meter.record(
+            budget.name if budget else "default",
+            counts["prompt_tokens"],
+            counts["completion_tokens"],
+            estimated,
+            finish_reason,
+            cached_tokens=counts["cached_tokens"],
+            latency=latency,
+        )
+        return counts
+
+    async def _complete(
+        self,
+        config: ProviderConfig,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        budget: Optional[TokenBudget] = None,
+    ) -> LLMResponse:
         headers = {
-            "Authorization": f"Bearer {api_key}",
+            "Authorization": f"Bearer {config.api_key}",
             "Content-Type": "application/json",
         }
-        payload = {"model": model, "messages": messages, "temperature": temperature}
+        payload = {
+            "model": config.model,
+            "messages": messages,
+            "temperature": temperature,
+            **self._limit_params(config, budget),
+        }
 
-        response = requests.post(url, json=payload, headers=headers, timeout=self.timeout)
-        response.raise_for_status()
-        data = response.json()
-        content = data["choices"][0]["message"]["content"]
-        return LLMResponse(content=content, raw=data)
+        check_deadline()
+        with self.breaker_for(config).guard(_breaker_verdict) as probe:
+            client = self._client_for(config.base_url)
+            lane, grant = await self._acquire(config, messages, budget)
+            timeout, clipped = self._timeout_for(probe)
+            started = time.perf_counter()
+            outcome = "error"
+            spent = count_message_tokens(messages)
+            try:
+                with LLM_IN_FLIGHT.track_inprogress(provider=config.name):
+                    response = await within_deadline(
+                        client.post("/chat/completions", json=payload, headers=headers, timeout=timeout)
+                    )
+                self._check_rate_limited(lane, response)
+                response.raise_for_status()
+                data = response.json()
+                choice = data["choices"][0]
+                content = choice["message"]["content"]
+                outcome = "ok"
+            except asyncio.CancelledError:
+                outcome = "cancelled"
+                raise
+            except httpx.TimeoutException as exc:
+                spent = self._unsent_tokens(exc, spent)
+                if clipped:
+                    # 超时是被请求预算截短的，不算上游故障
+                    raise DeadlineExceeded("请求的上游预算已用完") from exc
+                raise
+            except httpx.ConnectError as exc:
+                spent = self._unsent_tokens(exc, spent)
+                raise
+            finally:
+                LLM_DURATION.observe(
+                    time.perf_counter() - started, provider=config.name, model=config.model, outcome=outcome
+                )
+                if outcome != "ok":
+                    lane.settle(grant, spent)
+            usage = self._record_usage(
+                budget, messages, content, data.get("usage"), choice.get("finish_reason"), time.perf_counter() - started
+            )
+            lane.settle(grant, usage["prompt_tokens"] + usage["completion_tokens"])
+            return LLMResponse(content=content, raw=data, usage=usage)
 
+    async def stream_chat(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.7,
+        provider: Optional[str] = None,
+        budget: Optional[TokenBudget] = None,
+    ) -> AsyncIterator[str]:
+        """Yield content deltas from a `stream: true` chat completion."""
+        # 流式输出一旦开始就无法对冲，这里只按路由权重挑一个 provider
+        config = self.resolve_provider(self.pick_provider(provider))
+        if not config.api_key:
+            raise RuntimeError("LLM API Key 未配置，无法调用真实模型。")
 
-def extract_json_block(text: str) -> str:
-    """Return first JSON object found in the response text."""
-    match = re.search(r"\{.*\}", text, re.DOTALL)
-    if match:
-        return match.group(0)
-    return text.strip()
+        headers = {
+            "Authorization": f"Bearer {config.api_key}",
+            "Content-Type": "application/json",
+            "Accept": "text/event-stream",
+        }
+        payload = {
+            "model": config.model,
+            "messages": messages,
+            "temperature": temperature,
+            "stream": True,
+            # 最后一个 chunk 附带 usage
+            "stream_options": {"include_usage": True},
+            **self._limit_params(config, budget),
+        }
+
+        check_deadline()
+        with self.breaker_for(config).guard(_breaker_verdict) as probe:
+            parts: List[str] = []
+            usage: Optional[Dict[str, Any]] = None
+            finish_reason: Optional[str] = None
+            opened = False
+            client = self._client_for(config.base_url)
+            lane, grant = await self._acquire(config, messages, budget)
+            timeout, clipped = self._timeout_for(probe)
+            started = time.perf_counter()
+            outcome = "error"
+            spent = count_message_tokens(messages)
+            LLM_IN_FLIGHT.inc(provider=config.name)
+            try:
+                async with client.stream(
+                    "POST", "/chat/completions", json=payload, headers=headers, timeout=timeout
+                ) as response:
+                    self._check_rate_limited(lane, response)
+                    response.raise_for_status()
+                    opened = True
+                    async for line in response.aiter_lines():
+                        check_deadline()
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[5:].strip()
+                        if data == "[DONE]":
+                            outcome = "ok"
+                            return
+                        if not data:
+                            continue
+                        chunk = json.loads(data)
+                        usage = chunk.get("usage") or usage
+                        for choice in chunk.get("choices") or []:
+                            finish_reason = choice.get("finish_reason") or finish_reason
+                            delta = (choice.get("delta") or {}).get("content")
+                            if delta:
+                                parts.append(delta)
+                                yield delta
+                outcome = "ok"
+            except (asyncio.CancelledError, GeneratorExit):
+                outcome = "cancelled"
+                raise
+            except httpx.TimeoutException as exc:
+                spent = self._unsent_tokens(exc, spent)
+                if clipped:
+                    # 超时是被请求预算截短的，不算上游故障
+                    raise DeadlineExceeded("请求的上游预算已用完") from exc
+                raise
+            except httpx.ConnectError as exc:
+                spent = self._unsent_tokens(exc, spent)
+                raise
+            finally:
+                LLM_IN_FLIGHT.dec(provider=config.name)
+                LLM_DURATION.observe(
+                    time.perf_counter() - started, provider=config.name, model=config.model, outcome=outcome
+                )
+                if opened:
+                    counts = self._record_usage(
+                        budget, messages, "".join(parts), usage, finish_reason, time.perf_counter() - started
+                    )
+                    spent = counts["prompt_tokens"] + counts["completion_tokens"]
+                lane.settle(grant, spent)
+
+    async def aclose(self) -> None:
+        clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            await client.aclose()
 
 
 llm_client = LLMClient()
+
+
+def _breaker_gauge() -> dict:
+    return {key: STATE_VALUES[breaker.state] for key, breaker in list(llm_client.breakers.items())}
+
+
+registry.gauge(
+    "aipromo_llm_circuit_state", "LLM 熔断状态：0 关闭 / 1 半开 / 2 打开", ("provider", "model")
+).set_function(_breaker_gauge)
@@ -0,0 +1,408 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from enum import IntEnum
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from .deadline import current_deadline
+from .metrics import OUTBOUND_WAIT, registry
+
+
+class Priority(IntEnum):
+    """数值越小越先放行。"""
+
+    interactive = 0
+    batch = 1
+    background = 2
+
+
+# 各优先级默认最多排队多久（秒），0 表示不设上限；可用 OUTBOUND_MAX_WAIT_<PRIORITY> 覆盖
+DEFAULT_MAX_WAIT = {Priority.interactive: 20.0, Priority.batch: 600.0, Priority.background: 0.0}
+
+# 排在别人后面的调用方由前一个放行者唤醒，这里只是兜底的复查间隔
+_IDLE_RECHECK = 1.0
+
+_priority: ContextVar[Priority] = ContextVar("outbound_priority", default=Priority.interactive)
+
+
+def current_priority() -> Priority:
+    return _priority.get()
+
+
+@contextmanager
+def outbound_priority(priority: Priority) -> Iterator[None]:
+    """在该上下文内发起的上游调用按 `priority` 排队；asyncio 子任务会继承，新线程需要自行设置。"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def max_wait_for(priority: Priority) -> Optional[float]:
+    raw = os.getenv(f"OUTBOUND_MAX_WAIT_{priority.name.upper()}")
+    value = float(raw) if raw else DEFAULT_MAX_WAIT[priority]
+    return value if value > 0 else None
+
+
+class OutboundWaitTooLong(RuntimeError):
+    """预计排队时间超过截止时间：请求不会发出，`estimated_wait` 为预计还需等待的秒数。"""
+
+    def __init__(self, lane: str, estimated_wait: float) -> None:
+        super().__init__(f"{lane} 配额已用满，预计需排队 {estimated_wait:.1f}s，超过截止时间")
+        self.lane = lane
+        self.estimated_wait = estimated_wait
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max((when - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class _Bucket:
+    """按分钟配额折算的令牌桶，由所属 lane 的锁保护。单次需求超过容量时，桶满即可放行并记欠账。"""
+
+    def __init__(self, per_minute: float, burst: Optional[float]) -> None:
+        self.per_minute = per_minute
+        self.rate = per_minute / 60.0
+        self.capacity = max(burst or per_minute / 6, 1.0)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def eta(self, amount: float, ahead: float = 0.0) -> float:
+        """排在 `ahead` 的需求之后，再攒够 `amount` 需要的秒数。"""
+        need = ahead + min(amount, self.capacity) - self.level
+        return need / self.rate if need > 0 else 0.0
+
+
+@dataclass
+class Grant:
+    lane: str
+    tokens: int
+    waited: float
+
+
+class _Waiter:
+    __slots__ = ("key", "tokens", "wake")
+
+    def __init__(self, key: Tuple[int, int], tokens: int, wake: Callable[[], None]) -> None:
+        self.key = key
+        self.tokens = tokens
+        self.wake = wake
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return self.key < other.key
+
+
+def _async_wake(loop: asyncio.AbstractEventLoop, event: asyncio.Event) -> Callable[[], None]:
+    def wake() -> None:
+        try:
+            loop.call_soon_threadsafe(event.set)
+        except RuntimeError:  # pragma: no cover - 事件循环已关闭
+            pass
+
+    return wake
+
+
+class OutboundLane:
+    """
+    单个上游配额的调度：RPM / TPM 两个令牌桶 + 按优先级排队，异步调用和线程调用共用一条队列。
+
+    - 队列为空且桶里有余量时直接放行；
+    - 否则按 (优先级, 到达顺序) 排队，只有队首可以取令牌，交互请求会排到批量 / 预生成请求前面；
+    - 按前面的排队需求估算等待时间，超过截止时间抛 OutboundWaitTooLong（入队时和排队中都会检查）；
+    - TPM 按预估 token 数预扣，调用结束后 `settle` 多退少补（出错或被取消时调用方按 prompt 估算结算）；
+    - 上游返回 429 时 `penalize` 让整条通道暂停 Retry-After 秒。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rpm: float,
+        tpm: float = 0.0,
+        rpm_burst: Optional[float] = None,
+        tpm_burst: Optional[float] = None,
+    ) -> None:
+        self.name = name
+        self.rpm = _Bucket(rpm, rpm_burst) if rpm > 0 else None
+        self.tpm = _Bucket(tpm, tpm_burst) if tpm > 0 else None
+        self._lock = threading.Lock()
+        self._queue: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._blocked_until = 0.0
+        self.counters: Dict[str, int] = {"granted": 0, "queued": 0, "rejected": 0, "penalties": 0}
+        self._waits: Dict[Priority, List[float]] = {}  # priority -> [次数, 总等待, 最大等待]
+
+    # ---- 以下方法需持有 self._lock ----
+
+    def _eta(self, now: float, tokens: int, ahead: List[_Waiter]) -> float:
+        wait = self._blocked_until - now
+        if self.rpm is not None:
+            self.rpm.refill(now)
+            wait = max(wait, self.rpm.eta(1, len(ahead)))
+        if self.tpm is not None:
+            self.tpm.refill(now)
+            wait = max(wait, self.tpm.eta(tokens, sum(w.tokens for w in ahead)))
+        return max(wait, 0.0)
+
+    def _take(self, tokens: int) -> None:
+        if self.rpm is not None:
+            self.rpm.level -= 1
+        if self.tpm is not None:
+            self.tpm.level -= tokens
+
+    def _remove(self, waiter: _Waiter) -> None:
+        if waiter not in self._queue:
+            return
+        was_head = self._queue[0] is waiter
+        self._queue.remove(waiter)
+        heapq.heapify(self._queue)
+        if was_head and self._queue:
+            self._queue[0].wake()
+
+    # ---- 排队 ----
+
+    def _enter(self, tokens: int, priority: Priority, deadline: Optional[float], wake: Callable[[], None]) -> Optional[_Waiter]:
+        """可以立即放行时返回 None，否则返回已入队的 waiter。"""
+        now = time.monotonic()
+        with self._lock:
+            if not self._queue and self._eta(now, tokens, []) <= 0:
+                self._take(tokens)
+                return None
+            key = (int(priority), next(self._seq))
+            ahead = [w for w in self._queue if w.key < key]
+            estimate = self._eta(now, tokens, ahead)
+            if deadline is not None and now + estimate > deadline:
+                self.counters["rejected"] += 1
+                raise OutboundWaitTooLong(self.name, estimate)
+            waiter = _Waiter(key, tokens, wake)
+            heapq.heappush(self._queue, waiter)
+            self.counters["queued"] += 1
+            return waiter
+
+    def _poll(self, waiter: _Waiter, deadline: Optional[float]) -> Optional[float]:
+        """轮到且令牌足够时放行并返回 None，否则返回下次复查前应等待的秒数。"""
+        now = time.monotonic()
+        with self._lock:
+            head = self._queue[0] is waiter
+            ahead = [] if head else [w for w in self._queue if w.key < waiter.key]
+            estimate = self._eta(now, waiter.tokens, ahead)
+            if head and estimate <= 0:
+                heapq.heappop(self._queue)
+                self._take(waiter.tokens)
+                if self._queue:
+                    self._queue[0].wake()
+                return None
+            if deadline is not None and now + estimate > deadline:
+                self.counters["rejected"] += 1
+                self._remove(waiter)
+                raise OutboundWaitTooLong(self.name, estimate)
+        return estimate if head else _IDLE_RECHECK
+
+    def _leave(self, waiter: Optional[_Waiter]) -> None:
+        if waiter is not None:
+            with self._lock:
+                self._remove(waiter)
+
+    def _deadline(self, priority: Priority, started: float, deadline: Optional[float]) -> Optional[float]:
+        if deadline is not None:
+            return deadline
+        # 优先级的最长等待与请求自带的截止时间（X-Deadline-Ms）取更早者
+        max_wait = max_wait_for(priority)
+        limits = [d for d in (current_deadline(), started + max_wait if max_wait is not None else None) if d is not None]
+        return min(limits) if limits else None
+
+    def check(self, tokens: int = 0, priority: Optional[Priority] = None, deadline: Optional[float] = None) -> None:
+        """不入队，只估算现在排队要等多久；超过 `deadline`（默认为请求截止时间）时抛 OutboundWaitTooLong。"""
+        priority = current_priority() if priority is None else priority
+        deadline = current_deadline() if deadline is None else deadline
+        if deadline is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            ahead = [w for w in self._queue if w.key[0] <= int(priority)]
+            estimate = self._eta(now, tokens, ahead)
+            if now + estimate > deadline:
+                self.counters["rejected"] += 1
+                raise OutboundWaitTooLong(self.name, estimate)
+
+    def _granted(self, tokens: int, priority: Priority, started: float) -> Grant:
+        waited = time.monotonic() - started
+        with self._lock:
+            self.counters["granted"] += 1
+            totals = self._waits.setdefault(priority, [0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += waited
+            totals[2] = max(totals[2], waited)
+        OUTBOUND_WAIT.observe(waited, lane=self.name, priority=priority.name)
+        return Grant(lane=self.name, tokens=tokens, waited=waited)
+
+    def acquire(self, tokens: int = 0, priority: Optional[Priority] = None, deadline: Optional[float] = None) -> Grant:
+        """线程调用方：阻塞到放行。`deadline` 为 time.monotonic() 时刻，默认按优先级的最长等待与请求截止时间。"""
+        priority = current_priority() if priority is None else priority
+        started = time.monotonic()
+        deadline = self._deadline(priority, started, deadline)
+        event = threading.Event()
+        waiter = self._enter(tokens, priority, deadline, event.set)
+        try:
+            while waiter is not None:
+                event.clear()
+                delay = self._poll(waiter, deadline)
+                if delay is None:
+                    break
+                event.wait(delay)
+        except BaseException:
+            self._leave(waiter)
+            raise
+        return self._granted(tokens, priority, started)
+
+    async def acquire_async(
+        self, tokens: int = 0, priority: Optional[Priority] = None, deadline: Optional[float] = None
+    ) -> Grant:
+        """协程调用方：排队期间让出事件循环，取消时自动出队。"""
+        priority = current_priority() if priority is None else priority
+        started = time.monotonic()
+        deadline = self._deadline(priority, started, deadline)
+        event = asyncio.Event()
+        waiter = self._enter(tokens, priority, deadline, _async_wake(asyncio.get_running_loop(), event))
+        try:
+            while waiter is not None:
+                event.clear()
+                delay = self._poll(waiter, deadline)
+                if delay is None:
+                    break
+                try:
+                    await asyncio.wait_for(event.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            self._leave(waiter)
+            raise
+        return self._granted(tokens, priority, started)
+
+    def settle(self, grant: Grant, actual_tokens: int) -> None:
+        """按实际 token 用量修正预扣的 TPM。"""
+        if self.tpm is None or actual_tokens == grant.tokens:
+            return
+        with self._lock:
+            self.tpm.refill(time.monotonic())
+            self.tpm.level = min(self.tpm.capacity, self.tpm.level + grant.tokens - actual_tokens)
+
+    def penalize(self, seconds: float) -> None:
+        """上游要求退避（429 + Retry-After）：整条通道暂停 `seconds` 秒。"""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self.counters["penalties"] += 1
+
+    def depth(self) -> Dict[Priority, int]:
+        with self._lock:
+            depth: Dict[Priority, int] = {}
+            for waiter in self._queue:
+                priority = Priority(waiter.key[0])
+                depth[priority] = depth.get(priority, 0) + 1
+            return depth
+
+    def stats(self) -> Dict[str, Any]:
+        depth = self.depth()
+        with self._lock:
+            return {
+                "rpm": self.rpm.per_minute if self.rpm else None,
+                "tpm": self.tpm.per_minute if self.tpm else None,
+                "waiting": {p.name: depth.get(p, 0) for p in Priority},
+                "blocked_for": round(max(self._blocked_until - time.monotonic(), 0.0), 3),
+                **self.counters,
+                "wait": {
+                    p.name: {"count": int(n), "avg": round(total / n, 4), "max": round(peak, 4)}
+                    for p, (n, total, peak) in sorted(self._waits.items())
+                    if n
+                },
+            }
+
+
+def _env_number(name: str) -> float:
+    raw = os.getenv(name)
+    return float(raw) if raw else 0.0
+
+
+class OutboundScheduler:
+    """进程内所有上游调用共用的配额调度，按通道（provider / HeyGen 接口）各自一条队列。"""
+
+    def __init__(self) -> None:
+        self._lanes: Dict[str, OutboundLane] = {}
+        self._lock = threading.Lock()
+
+    def configure(
+        self,
+        name: str,
+        rpm: float,
+        tpm: float = 0.0,
+        rpm_burst: Optional[float] = None,
+        tpm_burst: Optional[float] = None,
+    ) -> OutboundLane:
+        lane = OutboundLane(name, rpm, tpm, rpm_burst, tpm_burst)
+        with self._lock:
+            self._lanes[name] = lane
+        return lane
+
+    def lane(self, name: str) -> OutboundLane:
+        """未显式配置的通道从环境变量读取：<NAME>_RPM / <NAME>_TPM / <NAME>_RPM_BURST / <NAME>_TPM_BURST，0 表示不限。"""
+        with self._lock:
+            lane = self._lanes.get(name)
+        if lane is not None:
+            return lane
+        prefix = name.upper()
+        lane = OutboundLane(
+            name,
+            rpm=_env_number(f"{prefix}_RPM"),
+            tpm=_env_number(f"{prefix}_TPM"),
+            rpm_burst=_env_number(f"{prefix}_RPM_BURST") or None,
+            tpm_burst=_env_number(f"{prefix}_TPM_BURST") or None,
+        )
+        with self._lock:
+            return self._lanes.setdefault(name, lane)
+
+    def lanes(self) -> List[OutboundLane]:
+        with self._lock:
+            return sorted(self._lanes.values(), key=lambda lane: lane.name)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_wait": {p.name: max_wait_for(p) for p in Priority},
+            "lanes": {lane.name: lane.stats() for lane in self.lanes()},
+        }
+
+
+outbound = OutboundScheduler()
+
+
+def _queue_gauge() -> dict:
+    return {(lane.name, p.name): float(n) for lane in outbound.lanes() for p, n in lane.depth().items()}
+
+
+registry.gauge("aipromo_outbound_queued", "在限流队列中等待的上游调用数", ("lane", "priority")).set_function(_queue_gauge)
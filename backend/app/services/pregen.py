@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from .jobs import DATA_DIR
+from .metrics import PRECOMPUTED
+
+
+KINDS = ("analyze", "script", "xhs")
+
+
+class PregenStore:
+    """
+    离线预生成结果（SQLite，WAL），由 `python -m app.pregen` 在低峰期写入，线上接口优先读取：
+
+    - `pregen_results`：(kind, key) → JSON 结果，kind 为 analyze / script / xhs，key 与线上请求算出的键相同；
+    - `pregen_progress`：目录中每个 产品 × 身份 组合的完成情况，作为断点，中断后重跑跳过已完成的组合。
+
+    线上进程与离线任务共用同一个文件，WAL 模式下读写互不阻塞；超过 `ttl` 秒的结果线上不再使用（0 表示不过期）。
+    """
+
+    def __init__(self, db_path: Path, ttl: float, enabled: bool = True) -> None:
+        self.db_path = Path(db_path)
+        self.ttl = ttl
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self.counters: Dict[str, Dict[str, int]] = {kind: {"hits": 0, "misses": 0} for kind in KINDS}
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(str(self.db_path), check_same_thread=False, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS pregen_results ("
+                " kind TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, created_at REAL NOT NULL,"
+                " PRIMARY KEY (kind, key))"
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS pregen_progress ("
+                " item TEXT PRIMARY KEY, label TEXT NOT NULL, status TEXT NOT NULL, error TEXT, updated_at REAL NOT NULL)"
+            )
+            db.commit()
+            self._db = db
+        return self._db
+
+    def entry(self, kind: str, key: str) -> Optional[Tuple[Any, float]]:
+        """返回 (结果, 生成时间)，不计命中、不看 ttl；离线任务用来判断是否需要重新生成。"""
+        with self._lock:
+            row = self._conn().execute(
+                "SELECT value, created_at FROM pregen_results WHERE kind = ? AND key = ?", (kind, key)
+            ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def get(self, kind: str, key: str) -> Optional[Any]:
+        """线上读取：未启用、不存在或已过期时返回 None。"""
+        if not self.enabled:
+            return None
+        found = self.entry(kind, key)
+        hit = found is not None and (self.ttl <= 0 or time.time() - found[1] <= self.ttl)
+        with self._lock:
+            self.counters[kind]["hits" if hit else "misses"] += 1
+        PRECOMPUTED.inc(kind=kind, outcome="hit" if hit else "miss")
+        return found[0] if hit else None
+
+    def put(self, kind: str, key: str, value: Any) -> None:
+        with self._lock:
+            db = self._conn()
+            with db:
+                db.execute(
+                    "INSERT OR REPLACE INTO pregen_results (kind, key, value, created_at) VALUES (?, ?, ?, ?)",
+                    (kind, key, json.dumps(value, ensure_ascii=False), time.time()),
+                )
+
+    def progress(self, item: str) -> Optional[Tuple[str, float]]:
+        """返回某个组合的 (状态, 更新时间)。"""
+        with self._lock:
+            row = self._conn().execute(
+                "SELECT status, updated_at FROM pregen_progress WHERE item = ?", (item,)
+            ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def mark(self, item: str, label: str, status: str, error: Optional[str] = None) -> None:
+        with self._lock:
+            db = self._conn()
+            with db:
+                db.execute(
+                    "INSERT OR REPLACE INTO pregen_progress (item, label, status, error, updated_at) VALUES (?, ?, ?, ?, ?)",
+                    (item, label, status, error, time.time()),
+                )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            db = self._conn()
+            stored = dict(db.execute("SELECT kind, COUNT(*) FROM pregen_results GROUP BY kind").fetchall())
+            progress = dict(db.execute("SELECT status, COUNT(*) FROM pregen_progress GROUP BY status").fetchall())
+            counters = {kind: dict(values) for kind, values in self.counters.items()}
+        return {
+            "enabled": self.enabled,
+            "ttl": self.ttl,
+            "stored": {kind: stored.get(kind, 0) for kind in KINDS},
+            "progress": progress,
+            "lookups": counters,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+pregen_store = PregenStore(
+    db_path=Path(os.getenv("PREGEN_DB") or DATA_DIR / "pregen.sqlite3"),
+    ttl=float(os.getenv("PREGEN_TTL", "604800")),
+    enabled=os.getenv("PREGEN_ENABLED", "1").lower() in {"1", "true", "yes", "on"},
+)
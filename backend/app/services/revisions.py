@@ -0,0 +1,246 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Dict, Optional, Set
+
+from ..models import (
+    CacheMode,
+    GenerateScriptRequest,
+    GenerateScriptResponse,
+    PainPointCard,
+    ProductAnalysisRequest,
+    ProductAnalysisResponse,
+    RevisionResponse,
+    validate_model,
+)
+from .ai import (
+    _analysis_cache_key,
+    _dump_card,
+    _fallback_cards,
+    _fallback_script,
+    precomputed_cards,
+    precomputed_script,
+    run_product_analysis,
+    run_video_script,
+)
+from .cache import analysis_cache
+from .deadline import run_detached
+from .llm import llm_client
+from .metrics import INSTANT_UPGRADES
+from .video_status import StatusBroadcaster
+
+
+@dataclass
+class Revision:
+    id: str
+    kind: str
+    number: int
+    status: str
+    source: str
+    result: Dict[str, Any]
+    error: Optional[str] = None
+    updated_at: float = field(default_factory=time.time)
+
+    @property
+    def token(self) -> str:
+        return f"{self.id}.{self.number}"
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "revision": self.token,
+            "kind": self.kind,
+            "status": self.status,
+            "source": self.source,
+            "error": self.error,
+            **self.result,
+        }
+
+
+class RevisionStore:
+    """
+    instant 模式的结果版本（stale-while-revalidate）：
+
+    - 接口先登记立即可用的缓存 / 模版结果（第 1 版）并返回版本号；
+    - 大模型结果在后台生成，成功后发布第 2 版，通过 `broadcaster` 推送给订阅者；
+    - 后台生成失败时版本号不变，只把状态置为 done 并记录原因。
+
+    条目只保存在内存中，保留 `ttl` 秒、最多 `max_entries` 条。
+    """
+
+    def __init__(self, ttl: float, max_entries: int) -> None:
+        self.ttl = ttl
+        self.max_entries = max(max_entries, 1)
+        self.broadcaster = StatusBroadcaster()
+        self._entries: "OrderedDict[str, Revision]" = OrderedDict()
+        self._tasks: Set[asyncio.Task] = set()
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = {"created": 0, "upgraded": 0, "failed": 0, "reads": 0}
+
+    def _evict(self, now: float) -> None:
+        while self._entries:
+            oldest = next(iter(self._entries.values()))
+            if len(self._entries) <= self.max_entries and now - oldest.updated_at <= self.ttl:
+                break
+            self._entries.popitem(last=False)
+
+    def create(self, kind: str, result: Dict[str, Any], source: str, pending: bool) -> Revision:
+        revision = Revision(
+            id=uuid.uuid4().hex,
+            kind=kind,
+            number=1,
+            status="pending" if pending else "done",
+            source=source,
+            result=result,
+        )
+        with self._lock:
+            self._evict(revision.updated_at)
+            self._entries[revision.id] = revision
+            self.counters["created"] += 1
+        return revision
+
+    def get(self, revision_id: str) -> Optional[Revision]:
+        # 兼容直接传完整版本号（<id>.<n>）
+        revision_id = revision_id.split(".", 1)[0]
+        with self._lock:
+            self.counters["reads"] += 1
+            revision = self._entries.get(revision_id)
+            if revision is not None and time.time() - revision.updated_at > self.ttl:
+                del self._entries[revision_id]
+                return None
+            return revision
+
+    def finish(
+        self,
+        revision_id: str,
+        result: Optional[Dict[str, Any]] = None,
+        source: Optional[str] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        """后台生成结束：有新结果时发布下一版，否则保留当前版本并记录原因。"""
+        with self._lock:
+            revision = self._entries.get(revision_id)
+            if revision is None:
+                return
+            if result is not None:
+                revision.number += 1
+                revision.result = result
+                revision.source = source or revision.source
+                self.counters["upgraded"] += 1
+            else:
+                self.counters["failed"] += 1
+            revision.status = "done"
+            revision.error = error
+            revision.updated_at = time.time()
+            # 刷新保留期，升级后的结果从此刻起再保留 ttl 秒
+            self._entries.move_to_end(revision_id)
+            payload = revision.snapshot()
+        INSTANT_UPGRADES.inc(kind=revision.kind, outcome="upgraded" if result is not None else "failed")
+        self.broadcaster.publish(revision_id, payload)
+
+    def spawn(self, coro: Awaitable[None]) -> None:
+        """后台执行升级任务：不受请求的 X-Deadline-Ms 限制，客户端断开也继续。"""
+        task = run_detached(asyncio.ensure_future, coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def stop(self) -> None:
+        tasks, self._tasks = list(self._tasks), set()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self.counters,
+                "entries": len(self._entries),
+                "in_progress": len(self._tasks),
+                "ttl": self.ttl,
+                "subscribers": self.broadcaster.subscriber_count(),
+            }
+
+
+revision_store = RevisionStore(
+    ttl=float(os.getenv("REVISION_TTL", "900")),
+    max_entries=int(os.getenv("REVISION_MAX_ENTRIES", "2000")),
+)
+
+
+def revision_response(revision: Revision) -> RevisionResponse:
+    return validate_model(RevisionResponse, revision.snapshot())
+
+
+async def _upgrade_analysis(revision_id: str, req: ProductAnalysisRequest) -> None:
+    try:
+        cards, source, error = await run_product_analysis(req)
+    except Exception as exc:  # 配额排队超时等：保留模版结果
+        revision_store.finish(revision_id, error=str(exc) or exc.__class__.__name__)
+        return
+    if source == "fallback":
+        revision_store.finish(revision_id, error=error or "大模型结果不可用")
+        return
+    revision_store.finish(revision_id, {"cards": [_dump_card(card) for card in cards]}, source)
+
+
+async def instant_analysis(req: ProductAnalysisRequest) -> ProductAnalysisResponse:
+    """立即返回预生成、缓存或模版卡片；都未命中时在后台调用大模型，结果通过 revision 获取。"""
+    precomputed = precomputed_cards(req)
+    if precomputed:
+        revision = revision_store.create("analyze", {"cards": precomputed}, "precomputed", pending=False)
+        cards = [validate_model(PainPointCard, card) for card in precomputed]
+        return ProductAnalysisResponse(cards=cards, source="precomputed", revision=revision.token)
+
+    configured = llm_client.is_configured()
+    if configured and req.cache is None:
+        cached = await analysis_cache.get(_analysis_cache_key(req))
+        if cached:
+            revision = revision_store.create("analyze", {"cards": cached}, "cache", pending=False)
+            cards = [validate_model(PainPointCard, card) for card in cached]
+            return ProductAnalysisResponse(cards=cards, source="cache", revision=revision.token)
+
+    cards = _fallback_cards(req)
+    revision = revision_store.create(
+        "analyze", {"cards": [_dump_card(card) for card in cards]}, "fallback", pending=configured
+    )
+    if configured:
+        # 刚确认过缓存未命中，后台直接生成并覆盖缓存，不再重复读取
+        update = {"cache": CacheMode.refresh} if req.cache is None else {}
+        background = req.model_copy(update=update) if hasattr(req, "model_copy") else req.copy(update=update)
+        revision_store.spawn(_upgrade_analysis(revision.id, background))
+    return ProductAnalysisResponse(cards=cards, source="fallback", revision=revision.token, pending=configured)
+
+
+async def _upgrade_script(revision_id: str, req: GenerateScriptRequest) -> None:
+    try:
+        script, source = await run_video_script(req)
+    except Exception as exc:
+        revision_store.finish(revision_id, error=str(exc) or exc.__class__.__name__)
+        return
+    if source == "fallback":
+        revision_store.finish(revision_id, error="大模型结果不可用")
+        return
+    dumped = script.model_dump() if hasattr(script, "model_dump") else script.dict()
+    revision_store.finish(revision_id, {"script": dumped}, source)
+
+
+async def instant_script(req: GenerateScriptRequest) -> GenerateScriptResponse:
+    """立即返回预生成或模版脚本，没有预生成结果时大模型脚本在后台生成，结果通过 revision 获取。"""
+    precomputed = precomputed_script(req)
+    if precomputed is not None:
+        dumped = precomputed.model_dump() if hasattr(precomputed, "model_dump") else precomputed.dict()
+        revision = revision_store.create("script", {"script": dumped}, "precomputed", pending=False)
+        return GenerateScriptResponse(script=precomputed, source="precomputed", revision=revision.token)
+
+    configured = llm_client.is_configured()
+    script = _fallback_script(req)
+    dumped = script.model_dump() if hasattr(script, "model_dump") else script.dict()
+    revision = revision_store.create("script", {"script": dumped}, "fallback", pending=configured)
+    if configured:
+        revision_store.spawn(_upgrade_script(revision.id, req))
+    return GenerateScriptResponse(script=script, source="fallback", revision=revision.token, pending=configured)
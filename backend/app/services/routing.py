@@ -0,0 +1,201 @@
+from __future__ import annotations
+
+import asyncio
+import math
+import os
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Sequence, Tuple, TypeVar
+
+from .breaker import CircuitOpenError
+from .deadline import DeadlineExceeded
+from .outbound import OutboundWaitTooLong
+
+
+T = TypeVar("T")
+
+# 本地直接拒绝（熔断打开、排队来不及、请求预算用完），请求没有发到 provider，不计入其耗时与成败
+LOCAL_ERRORS = (CircuitOpenError, OutboundWaitTooLong, DeadlineExceeded)
+
+
+class ProviderHealth:
+    """单个 provider 最近 N 次调用的耗时与成败，用于路由权重和对冲阈值。"""
+
+    def __init__(self, window: int) -> None:
+        self.samples: Deque[Tuple[float, bool]] = deque(maxlen=window)
+        self.counters: Dict[str, int] = {"calls": 0, "errors": 0, "wins": 0, "cancelled": 0}
+
+    def record(self, latency: float, ok: bool) -> None:
+        self.samples.append((latency, ok))
+        self.counters["calls"] += 1
+        if not ok:
+            self.counters["errors"] += 1
+
+    def successes(self) -> int:
+        return sum(1 for _, ok in self.samples if ok)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        """只看成功样本：失败往往很快返回（401、5xx），计入会让故障 provider 显得最快。"""
+        latencies = sorted(latency for latency, ok in self.samples if ok)
+        if not latencies:
+            return None
+        idx = min(len(latencies) - 1, max(0, math.ceil(pct * len(latencies)) - 1))
+        return latencies[idx]
+
+    def error_rate(self) -> float:
+        if not self.samples:
+            return 0.0
+        return sum(1 for _, ok in self.samples if not ok) / len(self.samples)
+
+
+class ProviderRouter:
+    """
+    多 provider 路由 + 对冲请求（hedged request）。
+
+    - 每个 provider 维护滚动窗口（耗时、错误），权重 = 成功率 / 成功调用的中位耗时，
+      按权重随机挑选主 provider，其余按权重降序作为备选；
+    - 主 provider 超过其成功调用的 p95 耗时（成功样本不足时用默认值）仍未返回，就向下一个 provider
+      发出同样的请求；主 provider 提前失败则立即切换；
+    - 先拿到“可解析”结果的一方获胜，其余请求取消。
+    """
+
+    def __init__(
+        self,
+        window: int,
+        hedge_percentile: float,
+        hedge_default: float,
+        hedge_min: float,
+        hedge_max: float,
+        min_samples: int,
+        max_attempts: int,
+    ) -> None:
+        self.window = window
+        self.hedge_percentile = hedge_percentile
+        self.hedge_default = hedge_default
+        self.hedge_min = hedge_min
+        self.hedge_max = hedge_max
+        self.min_samples = min_samples
+        self.max_attempts = max(max_attempts, 1)
+        self.health: Dict[str, ProviderHealth] = {}
+        self.counters: Dict[str, int] = {"routed": 0, "hedged": 0, "hedge_wins": 0, "failovers": 0}
+
+    def _health(self, name: str) -> ProviderHealth:
+        if name not in self.health:
+            self.health[name] = ProviderHealth(self.window)
+        return self.health[name]
+
+    def weight(self, name: str) -> float:
+        health = self._health(name)
+        median = health.percentile(0.5) if health.successes() >= self.min_samples else None
+        success = 1.0 - health.error_rate()
+        # 避免某个 provider 权重归零后再也拿不到流量、无法恢复
+        return max(success, 0.05) / max(median or self.hedge_default, 0.05)
+
+    def hedge_delay(self, name: str) -> float:
+        health = self._health(name)
+        if health.successes() < self.min_samples:
+            return self.hedge_default
+        p = health.percentile(self.hedge_percentile) or self.hedge_default
+        return min(max(p, self.hedge_min), self.hedge_max)
+
+    def order(self, names: Sequence[str], preferred: Optional[str] = None) -> List[str]:
+        candidates = list(dict.fromkeys(names))
+        if preferred in candidates:
+            rest = [name for name in candidates if name != preferred]
+            return [preferred] + sorted(rest, key=self.weight, reverse=True)
+        if len(candidates) <= 1:
+            return candidates
+        weights = [self.weight(name) for name in candidates]
+        primary = random.choices(candidates, weights=weights, k=1)[0]
+        rest = [name for name in candidates if name != primary]
+        return [primary] + sorted(rest, key=self.weight, reverse=True)
+
+    async def _attempt(self, name: str, call: Callable[[str], Awaitable[T]]) -> T:
+        health = self._health(name)
+        started = time.perf_counter()
+        try:
+            result = await call(name)
+        except asyncio.CancelledError:
+            # 被对冲取消：耗时是下界，仍计入窗口，避免慢 provider 的 p95 被低估
+            health.counters["cancelled"] += 1
+            health.samples.append((time.perf_counter() - started, True))
+            raise
+        except LOCAL_ERRORS:
+            raise
+        except Exception:
+            health.record(time.perf_counter() - started, False)
+            raise
+        health.record(time.perf_counter() - started, True)
+        return result
+
+    async def run(self, names: Sequence[str], call: Callable[[str], Awaitable[T]]) -> T:
+        """按路由顺序执行 `call(provider_name)`，返回第一个成功结果；全部失败时抛出最后一个异常。"""
+        order = list(names)[: self.max_attempts]
+        if not order:
+            raise RuntimeError("没有可用的 LLM provider")
+        self.counters["routed"] += 1
+
+        pending: Dict[asyncio.Task, str] = {}
+        last_error: Optional[BaseException] = None
+        next_idx = 0
+
+        def launch() -> None:
+            nonlocal next_idx
+            name = order[next_idx]
+            next_idx += 1
+            pending[asyncio.ensure_future(self._attempt(name, call))] = name
+
+        launch()
+        try:
+            while pending:
+                can_hedge = next_idx < len(order)
+                timeout = self.hedge_delay(order[next_idx - 1]) if can_hedge else None
+                done, _ = await asyncio.wait(list(pending), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self.counters["hedged"] += 1
+                    launch()
+                    continue
+                for task in done:
+                    name = pending.pop(task)
+                    if task.exception() is None:
+                        self._health(name).counters["wins"] += 1
+                        if name != order[0]:
+                            self.counters["hedge_wins"] += 1
+                        return task.result()
+                    last_error = task.exception()
+                if not pending and next_idx < len(order):
+                    self.counters["failovers"] += 1
+                    launch()
+        finally:
+            for task in pending:
+                task.cancel()
+        assert last_error is not None
+        raise last_error
+
+    def stats(self) -> Dict[str, Any]:
+        providers = {}
+        for name, health in self.health.items():
+            p50, p95 = health.percentile(0.5), health.percentile(0.95)
+            providers[name] = {
+                **health.counters,
+                "window": len(health.samples),
+                "error_rate": round(health.error_rate(), 3),
+                "p50": round(p50, 3) if p50 is not None else None,
+                "p95": round(p95, 3) if p95 is not None else None,
+                "hedge_delay": round(self.hedge_delay(name), 3),
+                "weight": round(self.weight(name), 3),
+            }
+        return {**self.counters, "providers": providers}
+
+
+def router_from_env() -> ProviderRouter:
+    return ProviderRouter(
+        window=int(os.getenv("LLM_ROUTE_WINDOW", "100")),
+        hedge_percentile=float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95")),
+        hedge_default=float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "8")),
+        hedge_min=float(os.getenv("LLM_HEDGE_MIN_DELAY", "1")),
+        hedge_max=float(os.getenv("LLM_HEDGE_MAX_DELAY", "20")),
+        min_samples=int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20")),
+        max_attempts=int(os.getenv("LLM_HEDGE_MAX_ATTEMPTS", "2")),
+    )
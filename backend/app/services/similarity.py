@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import heapq
+import os
+import re
+import zlib
+from typing import FrozenSet, List, Optional, Sequence
+
+
+# 字符 n-gram 的长度；中文口播文案用 3-gram 既能识别换词改写，又不会把同主题的不同文案判成重复
+SHINGLE_SIZE = int(os.getenv("DEDUP_SHINGLE_SIZE", "3"))
+# bottom-k MinHash 签名长度：只保留最小的 k 个 shingle 哈希
+SIGNATURE_SIZE = int(os.getenv("DEDUP_SIGNATURE_SIZE", "64"))
+# 估计的 Jaccard 相似度达到该值即视为近似重复
+DUPLICATE_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.6"))
+
+# 空白、标点、符号不参与比较；只在标点或换行上不同的两条文案算作相同
+_NOISE = re.compile(r"[\W_]+")
+
+Signature = FrozenSet[int]
+
+
+def normalize(text: str) -> str:
+    return _NOISE.sub("", str(text).casefold())
+
+
+def signature(text: str, size: int = SHINGLE_SIZE, k: int = SIGNATURE_SIZE) -> Signature:
+    """
+    单哈希 bottom-k MinHash：每个 shingle 只算一次 crc32，保留最小的 k 个。
+    shingle 不足 k 个时签名就是完整集合，相似度即精确的 Jaccard。
+    """
+    cleaned = normalize(text)
+    if not cleaned:
+        return frozenset()
+    # 定长编码（每字 4 字节）下字节偏移与字符偏移一一对应，直接切字节，不必逐个 shingle 编码
+    encoded = cleaned.encode("utf-32-le")
+    if len(cleaned) <= size:
+        return frozenset((zlib.crc32(encoded),))
+    step = size * 4
+    hashes = {zlib.crc32(encoded[i : i + step]) for i in range(0, len(encoded) - step + 1, 4)}
+    if len(hashes) <= k:
+        return frozenset(hashes)
+    return frozenset(heapq.nsmallest(k, hashes))
+
+
+def similarity(a: Signature, b: Signature, k: int = SIGNATURE_SIZE) -> float:
+    """两个签名的 Jaccard 估计：取并集中最小的 k 个哈希，看其中有多少同时出现在两边。"""
+    if not a or not b:
+        return 0.0
+    union = a | b
+    if len(union) <= k:
+        return len(a & b) / len(union)
+    cutoff = sorted(union)[k - 1]
+    return sum(1 for value in a & b if value <= cutoff) / k
+
+
+def duplicate_indices(
+    texts: Sequence[str],
+    threshold: Optional[float] = None,
+    keep: Sequence[Signature] = (),
+) -> List[int]:
+    """
+    按顺序扫描，返回与前面保留的文本（以及 `keep` 中已有的签名）近似重复的下标；
+    先出现的一条保留，空文本也算重复。
+    """
+    limit = DUPLICATE_THRESHOLD if threshold is None else threshold
+    kept: List[Signature] = list(keep)
+    duplicates: List[int] = []
+    for idx, text in enumerate(texts):
+        sig = signature(text)
+        if not sig or any(similarity(sig, other) >= limit for other in kept):
+            duplicates.append(idx)
+            continue
+        kept.append(sig)
+    return duplicates
@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import math
+import os
+import re
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple
+
+try:  # 可选依赖：安装了 tiktoken 时按 cl100k_base 精确计数
+    import tiktoken  # type: ignore
+
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:  # pragma: no cover - 未安装或离线时退回本地估算
+    _ENCODING = None
+
+
+# 与 cl100k_base 的切分规则大致对齐：汉字约 1.3 token/字，英文单词约 4 字符一个 token，
+# 数字每 3 位一个 token，标点和换行各算一个
+_PIECES = re.compile(
+    r"(?P<cjk>[㐀-䶿一-鿿豈-﫿]+)"
+    r"|(?P<word>[A-Za-z]+)"
+    r"|(?P<digits>\d+)"
+    r"|(?P<newline>\n+)"
+    r"|(?P<space>[ \t\r\f\v]+)"
+    r"|(?P<other>.)",
+    re.DOTALL,
+)
+
+# OpenAI chat 格式的固定开销：每条 message 约 4 个 token，回复前缀 3 个
+MESSAGE_OVERHEAD = 4
+REPLY_PRIMING = 3
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    total = 0
+    for match in _PIECES.finditer(text):
+        kind = match.lastgroup
+        piece = match.group(0)
+        if kind == "cjk":
+            total += math.ceil(len(piece) * 4 / 3)
+        elif kind == "word":
+            total += math.ceil(len(piece) / 4)
+        elif kind == "digits":
+            total += math.ceil(len(piece) / 3)
+        elif kind in ("newline", "other"):
+            total += 1
+    return total
+
+
+def count_message_tokens(messages: Sequence[Dict[str, str]]) -> int:
+    return sum(MESSAGE_OVERHEAD + count_tokens(m.get("content", "")) for m in messages) + REPLY_PRIMING
+
+
+# 截掉 JSON 之后的说明文字：缩进输出中只有顶层对象的右括号顶格；
+# stop 序列本身不会出现在输出里，缺失的右括号由 parse_json_payload 补齐
+JSON_OBJECT_STOP: Tuple[str, ...] = ("\n}\n\n", "}\n```")
+
+
+@dataclass(frozen=True)
+class TokenBudget:
+    name: str
+    max_input: int
+    max_output: int
+    stop: Tuple[str, ...] = ()
+
+
+def _budget(name: str, max_input: int, max_output: int, stop: Tuple[str, ...] = JSON_OBJECT_STOP) -> TokenBudget:
+    prefix = f"LLM_BUDGET_{name.upper()}"
+    return TokenBudget(
+        name=name,
+        max_input=int(os.getenv(f"{prefix}_INPUT", str(max_input))),
+        max_output=int(os.getenv(f"{prefix}_OUTPUT", str(max_output))),
+        stop=stop,
+    )
+
+
+# 输出预算按期望的输出形状估算：3~4 张卡片、3 条 240 字口播、单条口播、5 条 160 字小红书文案
+BUDGETS: Dict[str, TokenBudget] = {
+    "analyze": _budget("analyze", max_input=900, max_output=2400),
+    "script": _budget("script", max_input=900, max_output=1300),
+    "script_variant": _budget("script_variant", max_input=500, max_output=500),
+    "xhs": _budget("xhs", max_input=600, max_output=1500),
+}
+
+PROMPT_MODE = os.getenv("LLM_PROMPT_MODE", "auto").lower()
+
+
+def select_prompt(budget: TokenBudget, full: List[Dict[str, str]], compact: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """
+    auto：完整 prompt 在输入预算内就用完整版，否则用精简版；
+    LLM_PROMPT_MODE=full / compact 可强制指定。
+    """
+    if PROMPT_MODE == "full":
+        chosen = full
+    elif PROMPT_MODE == "compact":
+        chosen = compact
+    else:
+        chosen = full if count_message_tokens(full) <= budget.max_input else compact
+    if count_message_tokens(chosen) > budget.max_input:
+        token_meter.record_over_budget(budget.name)
+    return chosen
+
+
+def _mean(values: Optional[Sequence[float]]) -> Optional[float]:
+    return round(sum(values) / len(values), 3) if values else None
+
+
+class TokenMeter:
+    """按调用场景汇总 prompt / completion token；上游返回 usage 时以其为准，否则用本地估算。"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._latency: Dict[str, Dict[str, Deque[float]]] = {}
+
+    def _entry(self, label: str) -> Dict[str, int]:
+        return self._stats.setdefault(
+            label,
+            {
+                "calls": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "estimated_calls": 0,
+                "truncated": 0,
+                "over_budget": 0,
+                "cached_tokens": 0,
+                "cache_hit_calls": 0,
+            },
+        )
+
+    def record(
+        self,
+        label: str,
+        prompt_tokens: int,
+        completion_tokens: int,
+        estimated: bool,
+        finish_reason: Optional[str] = None,
+        cached_tokens: int = 0,
+        latency: Optional[float] = None,
+    ) -> None:
+        with self._lock:
+            entry = self._entry(label)
+            entry["calls"] += 1
+            entry["prompt_tokens"] += prompt_tokens
+            entry["completion_tokens"] += completion_tokens
+            entry["estimated_calls"] += int(estimated)
+            entry["truncated"] += int(finish_reason == "length")
+            entry["cached_tokens"] += cached_tokens
+            entry["cache_hit_calls"] += int(cached_tokens > 0)
+            if latency is not None:
+                # 按是否命中前缀缓存分开统计耗时，便于对比
+                bucket = "latency_cached" if cached_tokens > 0 else "latency_uncached"
+                self._latency.setdefault(label, {}).setdefault(bucket, deque(maxlen=500)).append(latency)
+
+    def record_over_budget(self, label: str) -> None:
+        with self._lock:
+            self._entry(label)["over_budget"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            result: Dict[str, Any] = {}
+            for label, entry in self._stats.items():
+                calls = entry["calls"] or 1
+                budget = BUDGETS.get(label)
+                latency = self._latency.get(label, {})
+                result[label] = {
+                    **entry,
+                    "avg_prompt_tokens": round(entry["prompt_tokens"] / calls, 1),
+                    "avg_completion_tokens": round(entry["completion_tokens"] / calls, 1),
+                    "cached_ratio": round(entry["cached_tokens"] / entry["prompt_tokens"], 3)
+                    if entry["prompt_tokens"]
+                    else 0.0,
+                    "avg_latency_cached": _mean(latency.get("latency_cached")),
+                    "avg_latency_uncached": _mean(latency.get("latency_uncached")),
+                    "budget": {"input": budget.max_input, "output": budget.max_output} if budget else None,
+                }
+            return {"counter": "tiktoken" if _ENCODING is not None else "estimate", "endpoints": result}
+
+
+token_meter = TokenMeter()
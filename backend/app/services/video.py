@@ -2,27 +2,29 @@ from __future__ import annotations
 
 import json
 import os
-from datetime import datetime
+import time
 from pathlib import Path
 from typing import Tuple, Union
 
 import requests
 
-from ..models import GenerateVideoRequest, HeygenStatusResponse
+from ..models import GenerateVideoRequest
+from .assets import StoredAsset, asset_store
+from .heygen import heygen_client
+from .jobs import DATA_DIR, JobCheckpoint, JobQueue, RetryableJobError
+from .metrics import registry
+from .outbound import OutboundWaitTooLong
+from .video_status import status_tracker
 
 
-ASSETS_DIR = Path(__file__).resolve().parent.parent / "generated"
-ASSETS_DIR.mkdir(parents=True, exist_ok=True)
+ASSETS_DIR = asset_store.root
 BRAND_DECLARATION = os.getenv("BRAND_DECLARATION", "瑞明门窗，稳定交付，安全可信，共创增长")
 
 
-def _timestamp_slug() -> str:
-    return datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
-
-
-def _write_placeholder(path: Path, content: str) -> Path:
-    path.write_text(content, encoding="utf-8")
-    return path
+def _write_debug(data: dict) -> StoredAsset:
+    # 调试文件只用于排查，不等待落盘
+    asset, _ = asset_store.put_text(json.dumps(data, ensure_ascii=False, indent=2), ext="json", kind="heygen_debug")
+    return asset
 
 
 def _build_heygen_payload(req: GenerateVideoRequest) -> dict:
@@ -38,9 +40,10 @@ def _build_heygen_payload(req: GenerateVideoRequest) -> dict:
     if BRAND_DECLARATION:
         full_text = f"{full_text}\n{BRAND_DECLARATION}"
 
-    avatar_id = req.avatar_id or os.getenv("HEYGEN_AVATAR_ID", "Miyu_standing_office_front")
-    avatar_style = os.getenv("HEYGEN_AVATAR_STYLE", "normal")
-    voice_id = os.getenv("HEYGEN_VOICE_ID", "119caed25533477ba63822d5d1552d25")
+    config = heygen_client.config
+    avatar_id = req.avatar_id or config.avatar_id
+    avatar_style = config.avatar_style
+    voice_id = config.voice_id
 
     payload: dict = {
         "title": script.headline,
@@ -61,91 +64,82 @@ def _build_heygen_payload(req: GenerateVideoRequest) -> dict:
         "dimension": {"width": 1280, "height": 720},
     }
 
-    if os.getenv("HEYGEN_BACKGROUND_MUSIC_ID"):
-        payload["background"] = {"music_id": os.getenv("HEYGEN_BACKGROUND_MUSIC_ID")}
+    if config.background_music_id:
+        payload["background"] = {"music_id": config.background_music_id}
 
-    if os.getenv("HEYGEN_BRAND_LOGO_URL"):
-        payload["logo_url"] = os.getenv("HEYGEN_BRAND_LOGO_URL")
+    if config.brand_logo_url:
+        payload["logo_url"] = config.brand_logo_url
 
-    if os.getenv("HEYGEN_CALLBACK_URL"):
-        payload["callback_url"] = os.getenv("HEYGEN_CALLBACK_URL")
+    if config.callback_url:
+        payload["callback_url"] = config.callback_url
 
     return payload
 
 
-def _call_heygen(req: GenerateVideoRequest, slug: str) -> tuple[str | None, str | None, str | None, Path | None]:
+def _is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, requests.HTTPError) and exc.response is not None:
+        status = exc.response.status_code
+        return status == 429 or status >= 500
+    # 读超时说明请求已经发出，HeyGen 可能已接单开始渲染，重试会重复计费
+    if isinstance(exc, requests.ReadTimeout):
+        return False
+    # 提交通道排队过长：交给任务队列稍后重试，不占着 worker 干等
+    return isinstance(exc, (requests.ConnectionError, requests.Timeout, OutboundWaitTooLong))
+
+
+def _call_heygen(
+    req: GenerateVideoRequest,
+) -> tuple[str | None, str | None, str | None, StoredAsset | None, bool]:
     """
     Send script to HeyGen API.
-    Returns: (video_url or job url, job_id, error_message, debug_file)
+    Returns: (video_url or job url, job_id, error_message, debug_file, retryable)
     """
-    api_key = os.getenv("HEYGEN_API_KEY")
-    if not api_key:
-        return None, None, "HEYGEN_API_KEY 未配置，未触发调用。", None
-
-    # 默认使用官方示例的 v2 生成接口，可通过 HEYGEN_API_URL 覆盖
-    endpoint = os.getenv("HEYGEN_API_URL", "https://api.heygen.com/v2/video/generate")
-    headers = {
-        "x-api-key": api_key,
-        "accept": "application/json",
-        "Content-Type": "application/json",
-    }
+    if not heygen_client.is_configured():
+        return None, None, "HEYGEN_API_KEY 未配置，未触发调用。", None, False
+
+    endpoint = heygen_client.config.api_url
     payload = _build_heygen_payload(req)
-    debug_file = ASSETS_DIR / f"heygen_debug_{slug}.json"
 
     try:
-        resp = requests.post(endpoint, headers=headers, json=payload, timeout=120)
-        resp.raise_for_status()
-        data = resp.json()
+        data = heygen_client.submit(payload)
     except Exception as exc:
-        debug_file.write_text(
-            json.dumps(
-                {
-                    "error": str(exc),
-                    "hint": "检查 HEYGEN_API_URL 与 payload 是否符合官方文档（示例: https://api.heygen.com/v2/video/generate）",
-                    "endpoint": endpoint,
-                    "payload": payload,
-                },
-                ensure_ascii=False,
-                indent=2,
-            ),
-            encoding="utf-8",
+        debug_file = _write_debug(
+            {
+                "error": str(exc),
+                "hint": "检查 HEYGEN_API_URL 与 payload 是否符合官方文档（示例: https://api.heygen.com/v2/video/generate）",
+                "endpoint": endpoint,
+                "payload": payload,
+            },
         )
-        return None, None, str(exc), debug_file
+        return None, None, str(exc), debug_file, _is_retryable(exc)
 
     data_block = data.get("data") or {}
     video_url = data_block.get("video_url") or data_block.get("download_url")
     job_id = data_block.get("video_id") or data_block.get("id")
 
-    debug_file.write_text(
-        json.dumps({"response": data, "endpoint": endpoint, "payload": payload}, ensure_ascii=False, indent=2),
-        encoding="utf-8",
-    )
+    debug_file = _write_debug({"response": data, "endpoint": endpoint, "payload": payload})
 
     # 如果没有视频链接但有 job_id，返回查询链接
     if not video_url and job_id:
-        status_base = os.getenv("HEYGEN_STATUS_URL", "https://api.heygen.com/v1/video_status.get?video_id=")
-        video_url = status_base.format(video_id=job_id) if "{video_id}" in status_base else f"{status_base}{job_id}"
+        video_url = heygen_client.config.status_url_for(job_id)
 
-    return video_url, job_id, None, debug_file
+    return video_url, job_id, None, debug_file, False
 
 
-def generate_video_assets(req: GenerateVideoRequest) -> Tuple[Union[Path, str], Union[Path, str], str | None]:
-    """
-    - 优先调用 HeyGen API 生成视频，返回远端链接或查询链接。
-    - 如果未配置 HeyGen 或调用失败，落到本地占位文件。
-    """
+def _write_video_assets(
+    req: GenerateVideoRequest,
+    video_url: str | None,
+    job_id: str | None,
+    heygen_error: str | None,
+    debug_file: StoredAsset | None,
+) -> Tuple[Union[StoredAsset, str], StoredAsset]:
     script = req.script
-    slug = _timestamp_slug()
-
-    # 尝试调用 HeyGen
-    video_url, job_id, heygen_error, debug_file = _call_heygen(req, slug)
-
     summary_lines = [
         f"视频风格: {req.video_style}",
         f"配音: {req.voice.language} · {req.voice.voice_style} · {req.voice.age_group}",
         f"HeyGen 调用: {'成功' if video_url else '未触发/失败'}",
         f"HeyGen 错误: {heygen_error or '无'}",
-        f"HeyGen 调试文件: {debug_file.name if debug_file else '无'}",
+        f"HeyGen 调试文件: {debug_file.url if debug_file else '无'}",
         f"job_id: {job_id or '无'}",
         f"video_url: {video_url or '无'}",
         "",
@@ -154,40 +148,97 @@ def generate_video_assets(req: GenerateVideoRequest) -> Tuple[Union[Path, str],
     for scene in script.scenes:
         summary_lines.append(f"- {scene.title}: 画面={scene.visuals} | 旁白={scene.voice_over} | 字幕={scene.screen_text}")
 
-    video_path = ASSETS_DIR / f"demo_video_{slug}.txt"
-    audio_path = ASSETS_DIR / f"demo_voice_{slug}.txt"
-
-    _write_placeholder(video_path, "\n".join(summary_lines))
-    _write_placeholder(
-        audio_path,
+    video_asset, video_written = asset_store.put_text("\n".join(summary_lines), kind="placeholder")
+    audio_asset, audio_written = asset_store.put_text(
         "这是一个配音占位文件。后续可接入真实 TTS 输出。\n\n完整旁白：\n" + "\n".join(scene.voice_over for scene in script.scenes),
+        kind="placeholder",
     )
+    # 两个文件并行写入；返回前确认落盘，任务标记成功时链接即可下载
+    video_written.result()
+    audio_written.result()
+
+    # 如果 HeyGen 返回了远端地址，则 video_url 为字符串；否则返回本地占位文件
+    return video_url or video_asset, audio_asset
 
-    # 如果 HeyGen 返回了远端地址，则 video_url 为字符串；否则返回本地占位路径
-    final_video = video_url or video_path
-    final_audio = audio_path
 
-    return final_video, final_audio, job_id
+def _asset_url(asset: Union[StoredAsset, str]) -> str:
+    return asset if isinstance(asset, str) else asset.url
 
 
-def check_heygen_status(video_id: str) -> HeygenStatusResponse:
-    api_key = os.getenv("HEYGEN_API_KEY")
-    if not api_key:
-        return HeygenStatusResponse(job_id=video_id, status="unconfigured", video_url=None, raw={"error": "HEYGEN_API_KEY missing"})
+def _submit_once(
+    req: GenerateVideoRequest, checkpoint: JobCheckpoint
+) -> tuple[str | None, str | None, str | None, StoredAsset | None, bool]:
+    """
+    同一个任务只向 HeyGen 提交一次：提交前后各记一次进度，进程中断后重新执行时——
+    已拿到 video_id 的直接沿用；提交已发出但没有结果的不再重提（可能已在渲染，重提会重复计费），按失败返回。
+    """
+    if not heygen_client.is_configured():
+        return _call_heygen(req)
+    submitted = checkpoint.data.get("submitted")
+    if submitted:
+        return submitted["video_url"], submitted["job_id"], None, None, False
+    if checkpoint.data.get("submitting"):
+        error = "上次提交 HeyGen 时进程中断，视频可能已在渲染；请先在 HeyGen 后台确认，再决定是否重新提交"
+        return None, None, error, None, False
+    checkpoint.save(submitting=True)
+    video_url, job_id, heygen_error, debug_file, retryable = _call_heygen(req)
+    if job_id:
+        checkpoint.save(submitted={"video_url": video_url, "job_id": job_id})
+    elif retryable:
+        # 明确没有被接单（429/5xx/连不上），下次尝试可以安全重提
+        checkpoint.save(submitting=False)
+    return video_url, job_id, heygen_error, debug_file, retryable
+
+
+def run_video_job(payload: dict, attempt: int, final_attempt: bool, checkpoint: JobCheckpoint) -> dict:
+    """
+    视频任务的 worker 处理函数：提交 HeyGen，遇到 429/5xx/网络错误时交给队列退避重试；
+    成功或最后一次尝试后写入占位文件，返回 GenerateVideoResponse 的字段。
+    """
+    req = GenerateVideoRequest(**payload["request"])
+    video_url, job_id, heygen_error, debug_file, retryable = _submit_once(req, checkpoint)
+    if heygen_error and retryable and not final_attempt:
+        raise RetryableJobError(heygen_error)
+    if job_id:
+        status_tracker.track(job_id)
+
+    final_video, final_audio = _write_video_assets(req, video_url, job_id, heygen_error, debug_file)
+    return {
+        "video_url": _asset_url(final_video),
+        "audio_url": _asset_url(final_audio),
+        "job_id": job_id,
+        "status": "queued" if job_id else None,
+    }
 
-    status_base = os.getenv("HEYGEN_STATUS_URL", "https://api.heygen.com/v1/video_status.get?video_id=")
-    url = status_base.format(video_id=video_id) if "{video_id}" in status_base else f"{status_base}{video_id}"
-    headers = {"x-api-key": api_key, "accept": "application/json"}
 
-    try:
-        resp = requests.get(url, headers=headers, timeout=60)
-        resp.raise_for_status()
-        data = resp.json()
-    except Exception as exc:
-        return HeygenStatusResponse(job_id=video_id, status="error", video_url=None, raw={"error": str(exc), "url": url})
+video_jobs = JobQueue(
+    "video",
+    db_path=Path(os.getenv("VIDEO_JOB_DB") or DATA_DIR / "jobs.sqlite3"),
+    handler=run_video_job,
+    workers=int(os.getenv("VIDEO_JOB_WORKERS", "4")),
+    max_attempts=int(os.getenv("VIDEO_JOB_MAX_ATTEMPTS", "3")),
+    retry_base=float(os.getenv("VIDEO_JOB_RETRY_BASE", "5")),
+)
+
+
+def _queue_gauge() -> dict:
+    stats = video_jobs.stats()
+    return {("queued",): float(stats["depth"]), ("running",): float(stats["running"])}
+
+
+registry.gauge("aipromo_video_jobs", "视频任务队列中排队 / 执行中的任务数", ("status",)).set_function(_queue_gauge)
+
+
+def enqueue_video_job(req: GenerateVideoRequest) -> str:
+    request = req.model_dump() if hasattr(req, "model_dump") else req.dict()
+    return video_jobs.enqueue({"request": request})
 
-    data_block = data.get("data") or {}
-    status = data_block.get("status") or data_block.get("task_status") or "unknown"
-    video_url = data_block.get("video_url") or data_block.get("download_url")
 
-    return HeygenStatusResponse(job_id=video_id, status=status, video_url=video_url, raw=data)
+def resume_status_tracking() -> int:
+    """进程重启后，把仍在轮询期内的 HeyGen 视频重新登记到状态轮询，返回登记数量。"""
+    count = 0
+    for result, finished_at in video_jobs.recent_results(time.time() - status_tracker.max_age):
+        if result.get("job_id"):
+            status_tracker.track(result["job_id"], submitted_at=finished_at)
+            count += 1
+    return count
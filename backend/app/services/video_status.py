@@ -0,0 +1,305 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import hmac
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from ..models import HeygenStatusResponse
+from .heygen import heygen_client
+from .outbound import Priority
+
+
+TERMINAL_STATUSES = {"completed", "failed"}
+
+
+@dataclass
+class TrackedVideo:
+    video_id: str
+    submitted_at: float
+    status: str = "pending"
+    video_url: Optional[str] = None
+    raw: Optional[dict] = None
+    polls: int = 0
+    errors: int = 0
+    next_poll_at: float = 0.0
+    updated_at: float = field(default_factory=time.time)
+
+    @property
+    def terminal(self) -> bool:
+        return self.status in TERMINAL_STATUSES
+
+
+class StatusBroadcaster:
+    """按 video_id 把状态变化推送给订阅的 SSE 连接；publish 可以在任意线程调用。"""
+
+    def __init__(self) -> None:
+        self._subscribers: Dict[str, Set[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, video_id: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue()
+        with self._lock:
+            self._subscribers.setdefault(video_id, set()).add((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, video_id: str, queue: asyncio.Queue) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(video_id)
+            if not subscribers:
+                return
+            subscribers.difference_update({item for item in subscribers if item[1] is queue})
+            if not subscribers:
+                del self._subscribers[video_id]
+
+    def publish(self, video_id: str, payload: Dict[str, Any]) -> None:
+        with self._lock:
+            targets = list(self._subscribers.get(video_id, ()))
+        for loop, queue in targets:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, payload)
+            except RuntimeError:  # 事件循环已关闭
+                self.unsubscribe(video_id, queue)
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(items) for items in self._subscribers.values())
+
+
+CALLBACK_EVENTS = {
+    "avatar_video.success": "completed",
+    "avatar_video.fail": "failed",
+}
+
+
+def verify_callback_signature(secret: str, body: bytes, signature: Optional[str]) -> bool:
+    if not signature:
+        return False
+    expected = hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature.strip().lower())
+
+
+class VideoStatusTracker:
+    """
+    服务端统一轮询 HeyGen 渲染状态，客户端的 /api/video_status 只读内存缓存。
+
+    轮询节奏随渲染进度自适应：远未到预计完成时间时稀疏轮询，接近预计完成时间时收紧，
+    超时后再逐步退避；进入终态（completed/failed）即停止轮询。预计渲染时长取最近完成任务
+    耗时的指数滑动平均。
+
+    配置了回调（HeyGen webhook）后，回调直接写入终态，轮询只作为低频兜底；
+    每次状态变化都会通过 `broadcaster` 推送给订阅者。
+    """
+
+    def __init__(
+        self,
+        expected_render: float,
+        min_interval: float,
+        max_interval: float,
+        retention: float,
+        max_age: float,
+        callback_poll_interval: Optional[float] = None,
+        max_tracked: int = 10000,
+    ) -> None:
+        self.expected_render = expected_render
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.retention = retention
+        self.max_age = max_age
+        self.callback_poll_interval = callback_poll_interval
+        self.max_tracked = max_tracked
+        self.broadcaster = StatusBroadcaster()
+        self._entries: Dict[str, TrackedVideo] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.counters: Dict[str, int] = {"upstream_polls": 0, "upstream_errors": 0, "cache_reads": 0, "unknown_reads": 0, "callbacks": 0, "callbacks_ignored": 0}
+
+    def _next_interval(self, entry: TrackedVideo, now: float) -> float:
+        elapsed = now - entry.submitted_at
+        remaining = self.expected_render - elapsed
+        if self.callback_poll_interval:
+            return self.callback_poll_interval
+        if entry.errors:
+            interval = self.min_interval * (2 ** entry.errors)
+        elif remaining > self.expected_render * 0.3:
+            # 离预计完成还早：把剩余时间对半分，最多 max_interval
+            interval = remaining / 2
+        elif remaining > -self.expected_render * 0.5:
+            interval = self.min_interval
+        else:
+            overdue = -remaining - self.expected_render * 0.5
+            interval = self.min_interval + overdue / 4
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def track(self, video_id: str, submitted_at: Optional[float] = None) -> None:
+        now = time.time()
+        with self._lock:
+            if video_id in self._entries:
+                return
+            self._evict(now)
+            if len(self._entries) >= self.max_tracked:
+                return
+            self._entries[video_id] = TrackedVideo(video_id=video_id, submitted_at=submitted_at or now, next_poll_at=now)
+        self._wakeup.set()
+
+    def _evict(self, now: float) -> None:
+        expired = [
+            vid
+            for vid, entry in self._entries.items()
+            if (entry.terminal and now - entry.updated_at > self.retention) or now - entry.submitted_at > self.max_age
+        ]
+        for vid in expired:
+            del self._entries[vid]
+
+    def get(self, video_id: str) -> Optional[HeygenStatusResponse]:
+        """
+        只返回已登记的视频（视频任务提交后或经签名校验的回调登记），未知 id 返回 None；
+        不替客户端随意传来的 id 登记轮询，避免占满登记表、消耗状态查询配额。
+        """
+        if not heygen_client.is_configured():
+            return HeygenStatusResponse(
+                job_id=video_id, status="unconfigured", video_url=None, raw={"error": "HEYGEN_API_KEY missing"}
+            )
+        with self._lock:
+            entry = self._entries.get(video_id)
+            if entry is None:
+                self.counters["unknown_reads"] += 1
+                return None
+            self.counters["cache_reads"] += 1
+            return self._snapshot(entry)
+
+    @staticmethod
+    def _snapshot(entry: TrackedVideo) -> HeygenStatusResponse:
+        return HeygenStatusResponse(job_id=entry.video_id, status=entry.status, video_url=entry.video_url, raw=entry.raw)
+
+    def _publish(self, entry: TrackedVideo, previous: Tuple[str, Optional[str]]) -> None:
+        if (entry.status, entry.video_url) == previous:
+            return
+        snapshot = self._snapshot(entry)
+        self.broadcaster.publish(entry.video_id, snapshot.model_dump() if hasattr(snapshot, "model_dump") else snapshot.dict())
+
+    def apply_callback(self, video_id: str, status: str, video_url: Optional[str], raw: dict) -> bool:
+        """只更新已登记的视频；签名有效但不是本服务提交的视频直接忽略，返回是否已更新。"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(video_id)
+            if entry is None:
+                self.counters["callbacks_ignored"] += 1
+                return False
+            previous = (entry.status, entry.video_url)
+            self.counters["callbacks"] += 1
+            entry.status = status
+            entry.video_url = video_url or entry.video_url
+            entry.raw = raw
+            entry.updated_at = now
+            if status == "completed":
+                self.expected_render = 0.8 * self.expected_render + 0.2 * (now - entry.submitted_at)
+        self._publish(entry, previous)
+        return True
+
+    def _poll(self, entry: TrackedVideo) -> None:
+        try:
+            # 后台轮询让位于用户直接发起的状态查询
+            data = heygen_client.status(entry.video_id, priority=Priority.background)
+        except Exception as exc:
+            now = time.time()
+            with self._lock:
+                self.counters["upstream_errors"] += 1
+                entry.errors += 1
+                entry.raw = {"error": str(exc), "url": heygen_client.config.status_url_for(entry.video_id)}
+                entry.next_poll_at = now + self._next_interval(entry, now)
+            return
+
+        data_block = data.get("data") or {}
+        now = time.time()
+        with self._lock:
+            previous = (entry.status, entry.video_url)
+            self.counters["upstream_polls"] += 1
+            entry.polls += 1
+            entry.errors = 0
+            if entry.terminal:
+                # 轮询在途时回调已写入终态，轮询看到的可能是更早的状态，不能覆盖
+                return
+            entry.status = data_block.get("status") or data_block.get("task_status") or "unknown"
+            entry.video_url = data_block.get("video_url") or data_block.get("download_url") or entry.video_url
+            entry.raw = data
+            entry.updated_at = now
+            if entry.status == "completed":
+                # 用实际渲染耗时校准预计时长
+                self.expected_render = 0.8 * self.expected_render + 0.2 * (now - entry.submitted_at)
+            entry.next_poll_at = now + self._next_interval(entry, now)
+        self._publish(entry, previous)
+
+    def apply_callback_event(self, event: dict) -> bool:
+        """处理 HeyGen webhook 事件，返回是否识别并更新了状态。"""
+        status = CALLBACK_EVENTS.get(str(event.get("event_type")))
+        data = event.get("event_data") or {}
+        video_id = data.get("video_id")
+        if not status or not video_id:
+            return False
+        return self.apply_callback(video_id, status, data.get("url") or data.get("video_url"), event)
+
+    def _due(self, now: float) -> List[TrackedVideo]:
+        with self._lock:
+            self._evict(now)
+            return [e for e in self._entries.values() if not e.terminal and e.next_poll_at <= now]
+
+    def _sleep_time(self, now: float) -> float:
+        with self._lock:
+            pending = [e.next_poll_at for e in self._entries.values() if not e.terminal]
+        if not pending:
+            return self.max_interval
+        return min(max(min(pending) - now, 0.05), self.max_interval)
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            for entry in self._due(time.time()):
+                if self._stopping.is_set():
+                    return
+                self._poll(entry)
+            self._wakeup.wait(self._sleep_time(time.time()))
+            self._wakeup.clear()
+
+    def start(self) -> None:
+        if self._thread is not None or not heygen_client.is_configured():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="heygen-status-poller", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            active = sum(1 for e in self._entries.values() if not e.terminal)
+            return {
+                **self.counters,
+                "tracked": len(self._entries),
+                "active": active,
+                "expected_render": round(self.expected_render, 1),
+                "subscribers": self.broadcaster.subscriber_count(),
+            }
+
+
+status_tracker = VideoStatusTracker(
+    expected_render=float(os.getenv("HEYGEN_EXPECTED_RENDER_SECONDS", "120")),
+    min_interval=float(os.getenv("HEYGEN_POLL_MIN_INTERVAL", "3")),
+    max_interval=float(os.getenv("HEYGEN_POLL_MAX_INTERVAL", "30")),
+    retention=float(os.getenv("HEYGEN_STATUS_RETENTION", "3600")),
+    max_age=float(os.getenv("HEYGEN_POLL_MAX_AGE", "7200")),
+    # 启用回调后轮询只做兜底
+    callback_poll_interval=(
+        float(os.getenv("HEYGEN_CALLBACK_POLL_INTERVAL", "300")) if heygen_client.config.webhook_secret else None
+    ),
+)
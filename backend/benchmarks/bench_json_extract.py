@@ -0,0 +1,122 @@
+"""
+Micro-benchmark: legacy regex extract_json_block vs TolerantJsonScanner.
+
+对 corpus/malformed_responses.jsonl 中的每条模型输出，比较旧实现（贪婪正则 + json.loads）
+与新扫描器能否解析、能保住多少条目，以及单次耗时。
+
+    cd backend
+    python -m benchmarks.bench_json_extract [--repeat 2000] [--json]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import re
+import sys
+import timeit
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from app.services.json_extract import TolerantJsonScanner, parse_json_payload
+
+
+CORPUS = Path(__file__).resolve().parent / "corpus" / "malformed_responses.jsonl"
+
+
+def legacy_parse(text: str) -> Any:
+    match = re.search(r"\{.*\}", text, re.DOTALL)
+    return json.loads(match.group(0) if match else text.strip())
+
+
+def tolerant_parse(text: str, expect: str) -> Any:
+    return parse_json_payload(text, expect=(expect,))
+
+
+def streamed_items(text: str, chunk_size: int = 7) -> int:
+    scanner = TolerantJsonScanner()
+    count = 0
+    for start in range(0, len(text), chunk_size):
+        count += len(scanner.feed(text[start : start + chunk_size]))
+    return count
+
+
+def _count_items(value: Any, expect: str) -> Optional[int]:
+    if isinstance(value, dict):
+        value = value.get(expect)
+    return len(value) if isinstance(value, list) else None
+
+
+def _attempt(fn, *args) -> Any:
+    try:
+        return fn(*args)
+    except Exception:
+        return None
+
+
+def run(repeat: int) -> Dict[str, Any]:
+    rows: List[Dict[str, Any]] = []
+    for line in CORPUS.read_text(encoding="utf-8").splitlines():
+        if not line.strip():
+            continue
+        case = json.loads(line)
+        text, expect = case["text"], case["expect"]
+        legacy_items = _count_items(_attempt(legacy_parse, text), expect)
+        tolerant_items = _count_items(_attempt(tolerant_parse, text, expect), expect)
+        rows.append(
+            {
+                "name": case["name"],
+                "bytes": len(text.encode("utf-8")),
+                "min_items": case["min_items"],
+                "legacy_items": legacy_items,
+                "tolerant_items": tolerant_items,
+                "streamed_items": streamed_items(text) if expect == "cards" else None,
+                "legacy_us": timeit.timeit(lambda: _attempt(legacy_parse, text), number=repeat) / repeat * 1e6,
+                "tolerant_us": timeit.timeit(lambda: _attempt(tolerant_parse, text, expect), number=repeat)
+                / repeat
+                * 1e6,
+            }
+        )
+
+    def ok(key: str) -> int:
+        return sum(1 for row in rows if (row[key] or 0) >= row["min_items"])
+
+    return {
+        "cases": rows,
+        "summary": {
+            "total": len(rows),
+            "legacy_ok": ok("legacy_items"),
+            "tolerant_ok": ok("tolerant_items"),
+            "legacy_us_mean": sum(r["legacy_us"] for r in rows) / len(rows),
+            "tolerant_us_mean": sum(r["tolerant_us"] for r in rows) / len(rows),
+        },
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--json", action="store_true", help="输出机器可读 JSON")
+    args = parser.parse_args()
+
+    result = run(args.repeat)
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        print(f"{'case':32} {'bytes':>6} {'need':>4} {'legacy':>6} {'new':>4} {'legacy µs':>10} {'new µs':>8}")
+        for row in result["cases"]:
+            print(
+                f"{row['name']:32} {row['bytes']:>6} {row['min_items']:>4} "
+                f"{str(row['legacy_items']):>6} {str(row['tolerant_items']):>4} "
+                f"{row['legacy_us']:>10.1f} {row['tolerant_us']:>8.1f}"
+            )
+        summary = result["summary"]
+        print(
+            f"\nsalvaged: legacy {summary['legacy_ok']}/{summary['total']}, "
+            f"tolerant {summary['tolerant_ok']}/{summary['total']}; "
+            f"mean µs legacy {summary['legacy_us_mean']:.1f}, tolerant {summary['tolerant_us_mean']:.1f}"
+        )
+    return 0 if result["summary"]["tolerant_ok"] == result["summary"]["total"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""
+Micro-benchmark: saved-card library search latency at scale.
+
+在临时 SQLite 文件中生成 N 张卡片（由若干产品、痛点、方案、渠道文案片段随机拼接），
+然后测量关键词检索、单字检索、产品 / 渠道 / 日期筛选以及翻页的单次耗时（中位数与 p95）。
+
+    cd backend
+    python -m benchmarks.bench_library [--cards 100000] [--repeat 200] [--json]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import statistics
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+from app.services.library import CardLibrary
+
+
+PRODUCTS = ["断桥铝系统窗", "铝包木门窗", "阳光房", "隔音窗", "推拉门", "折叠门", "防火窗", "纱窗一体窗"]
+TITLES = ["交付周期不稳定", "售后响应慢", "报价体系混乱", "样品与大货不一致", "安装队伍水平参差", "旺季断货", "渠道利润被压缩"]
+PAINS = ["交期一拖再拖，终端客户催单", "问题拖成投诉，后续项目不敢合作", "渠道利润不可控", "验收扯皮，尾款结不了", "好窗装坏，口碑受损"]
+SOLUTIONS = ["按区域备货加排产看板", "48 小时上门与质保档案", "统一渠道价盘与区域保护", "封样留档与抽检报告随车", "安装标准视频与认证安装队"]
+CHANNELS = ["客户私聊", "朋友圈", "公众号", "短视频脚本", "小红书"]
+PHRASES = ["旺季交期我们按天承诺", "隔音效果实测 35 分贝", "气密水密三道检测", "工程客户复购率高", "支持 PVC 与铝合金型材", "经销商零库存压力"]
+
+
+def _card(rng: random.Random) -> Dict[str, Any]:
+    title = rng.choice(TITLES)
+    return {
+        "id": uuid.uuid4().hex,
+        "title": title,
+        "scenario": f"{rng.choice(PRODUCTS)}项目里{rng.choice(PAINS)}",
+        "pain_point": rng.choice(PAINS),
+        "solution": rng.choice(SOLUTIONS),
+        "recommended_copies": [
+            {"channel": channel, "copy": f"{title}：{rng.choice(PHRASES)}，{rng.choice(PHRASES)}。"}
+            for channel in rng.sample(CHANNELS, 2)
+        ],
+    }
+
+
+def seed(library: CardLibrary, count: int, rng: random.Random, batch: int = 2000) -> float:
+    started = time.perf_counter()
+    for offset in range(0, count, batch):
+        library.save_many([(_card(rng), rng.choice(PRODUCTS)) for _ in range(min(batch, count - offset))])
+    return time.perf_counter() - started
+
+
+def _measure(fn: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    samples: List[float] = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {"p50_ms": statistics.median(samples), "p95_ms": samples[int(len(samples) * 0.95) - 1]}
+
+
+def run(cards: int, repeat: int) -> Dict[str, Any]:
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        library = CardLibrary(Path(tmp) / "cards.sqlite3")
+        seed_seconds = seed(library, cards, rng)
+        _, second_page = library.query(q="交期", limit=20)
+        midpoint = time.time() - seed_seconds / 2
+        cases = {
+            "list": lambda: library.query(limit=20),
+            "search_common": lambda: library.query(q="交期", limit=20),
+            "search_phrase": lambda: library.query(q="排产看板", limit=20),
+            "search_single_char": lambda: library.query(q="窗", limit=20),
+            "search_rare": lambda: library.query(q="35 分贝 PVC", limit=20),
+            "search_miss": lambda: library.query(q="不存在的词组", limit=20),
+            "product_filter": lambda: library.query(q="售后", product="阳光房", limit=20),
+            "channel_filter": lambda: library.query(q="复购", channel="小红书", limit=20),
+            "date_filter": lambda: library.query(q="封样", until=midpoint, limit=20),
+            "next_page": lambda: library.query(q="交期", cursor=second_page, limit=20),
+        }
+        results = {name: _measure(fn, repeat) for name, fn in cases.items()}
+        library.close()
+    return {"cards": cards, "seed_seconds": seed_seconds, "cases": results}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cards", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--json", action="store_true", help="输出机器可读 JSON")
+    args = parser.parse_args()
+
+    result = run(args.cards, args.repeat)
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        print(f"seeded {result['cards']} cards in {result['seed_seconds']:.1f}s")
+        print(f"{'case':20} {'p50 ms':>8} {'p95 ms':>8}")
+        for name, row in result["cases"].items():
+            print(f"{name:20} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
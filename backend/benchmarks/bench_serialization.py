@@ -0,0 +1,257 @@
+"""
+Micro-benchmark: model construction + response serialization for /api/analyze and /api/generate_script.
+
+对比每个请求在「解析结果 → 业务模型 → 响应 JSON」上花的 CPU：
+
+- legacy：旧的 `_parse_llm_cards` / `_parse_llm_script`（先建模型，加品牌标签时再逐个重建），
+  响应交给 FastAPI 按 response_model 处理；
+- fast：字段组装完后一次 `model_validate`，响应直接 `model_dump_json`。
+
+FastAPI 的 response_model 处理分两种口径：`fastapi`（当前安装版本的实际路径）与
+`classic`（dump → 再校验 → jsonable_encoder → json.dumps，较老版本 FastAPI 的路径）。
+
+    cd backend
+    python -m benchmarks.bench_serialization [--repeat 2000] [--json]
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import inspect
+import json
+import sys
+import textwrap
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Sequence
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute, serialize_response
+
+from app.main import app
+from app.models import (
+    GenerateScriptResponse,
+    MarketingCopy,
+    PainPointCard,
+    ProductAnalysisResponse,
+    Scene,
+    VideoScript,
+    dump_model_json,
+)
+from app.services.ai import _build_marketing_copies, _parse_llm_cards, _parse_llm_script, _wrap_brand_tag
+
+
+def card_payload(cards: int = 4, copies: int = 4) -> List[Dict[str, Any]]:
+    """与线上模型输出同量级：3~4 张卡片，每张 3~4 条 40~120 字的渠道文案。"""
+    channels = ["客户私聊", "朋友圈", "公众号", "短视频"]
+    return [
+        {
+            "title": f"旺季交付周期不稳定 {idx}",
+            "scenario": "渠道商在旺季集中下单系统窗，工厂排产跟不上，安装队伍也排不开，终端业主反复催促工期。",
+            "pain_point": "交期一拖再拖，终端客户催单，渠道信誉受损，后续项目不敢再接大单。",
+            "solution": "按区域备货 + 排产看板，下单即给出可承诺交期，延期按天补偿。",
+            "recommended_copies": [
+                {
+                    "channel": channels[n % len(channels)],
+                    "copy": f"第{n + 1}条：旺季系统窗交期我们按天承诺，排产看板实时可查，延期按天补偿，"
+                    "渠道不用再替工厂背锅，终端业主也能安心等货。#门窗 #系统窗",
+                }
+                for n in range(copies)
+            ],
+        }
+        for idx in range(1, cards + 1)
+    ]
+
+
+def script_payload(copies: int = 3) -> Dict[str, Any]:
+    """3 条约 240 字的口播文案。"""
+    body = (
+        "做门窗的老板都知道，旺季最怕的就是交期失控。我们把排产看板开放给渠道，下单当天就能看到可承诺交期，"
+        "延期按天补偿；安装节点提前三天确认，现场问题 48 小时上门。客户不再反复催单，你的信誉也就稳住了。"
+        "想知道具体怎么落地？留言或私信聊一聊。"
+    )
+    return {"headline": "系统窗交期这样承诺", "copies": [f"镜头{n + 1}：{body}" for n in range(copies)]}
+
+
+# ---- 旧实现（改造前的 ai.py），用于对比 ----
+
+
+def legacy_parse_cards(raw_cards: Sequence[dict]) -> List[PainPointCard]:
+    cards: List[PainPointCard] = []
+    for entry in raw_cards:
+        title, solution = entry.get("title"), entry.get("solution")
+        pain_point, scenario = entry.get("pain_point"), entry.get("scenario")
+        if not (title and solution and pain_point and scenario):
+            continue
+        copies: List[MarketingCopy] = []
+        for copy in entry.get("recommended_copies", []):
+            copy_text = copy.get("copy") or copy.get("content")
+            if copy_text:
+                copies.append(MarketingCopy(channel=copy.get("channel") or "客户私聊", ad_copy=copy_text))
+        if not copies:
+            copies = _build_marketing_copies(title, scenario, pain_point, solution)
+        cards.append(
+            PainPointCard(
+                id=entry.get("id") or str(uuid.uuid4()),
+                title=title,
+                scenario=scenario,
+                pain_point=pain_point,
+                solution=solution,
+                recommended_copies=[MarketingCopy(channel=c.channel, ad_copy=_wrap_brand_tag(c.ad_copy)) for c in copies],
+            )
+        )
+    return cards
+
+
+def legacy_parse_script(data: dict) -> VideoScript:
+    headline = data.get("headline") or "视频口播文案"
+    scenes: List[Scene] = []
+    for idx, item in enumerate(data["copies"], start=1):
+        cleaned = str(item).strip().replace("Scene", "").replace("镜头", "").strip("：: ").strip()
+        scenes.append(
+            Scene(
+                id=idx,
+                title=f"文案 {idx}",
+                visuals="口播视频",
+                voice_over=cleaned,
+                screen_text=textwrap.shorten(headline, 32),
+            )
+        )
+    script = VideoScript(headline=headline, scenes=scenes[:3])
+    wrapped = [
+        Scene(
+            id=s.id,
+            title=s.title,
+            visuals=s.visuals,
+            voice_over=_wrap_brand_tag(s.voice_over),
+            screen_text=s.screen_text,
+        )
+        for s in script.scenes
+    ]
+    return VideoScript(headline=script.headline, scenes=wrapped)
+
+
+# ---- 响应序列化 ----
+
+
+def _route(path: str) -> APIRoute:
+    return next(r for r in app.routes if isinstance(r, APIRoute) and r.path == path)
+
+
+_DUMP_JSON = "dump_json" in inspect.signature(serialize_response).parameters
+
+
+async def fastapi_response(route: APIRoute, content: Any) -> bytes:
+    """当前安装的 FastAPI 按 response_model 的处理：校验返回值，再序列化。"""
+    kwargs = {"dump_json": True} if _DUMP_JSON else {}
+    value = await serialize_response(field=route.response_field, response_content=content, is_coroutine=True, **kwargs)
+    return value if isinstance(value, bytes) else JSONResponse(value).body
+
+
+async def classic_response(route: APIRoute, content: Any) -> bytes:
+    """较老 FastAPI 的处理：先 dump 成 dict，再整棵校验一遍，jsonable_encoder 后 json.dumps。"""
+    raw = content.model_dump(by_alias=True)
+    value = type(content).model_validate(raw)
+    return JSONResponse(jsonable_encoder(value.model_dump(by_alias=True))).body
+
+
+async def direct_response(route: APIRoute, content: Any) -> bytes:
+    return dump_model_json(content).encode("utf-8")
+
+
+def _cpu_us(fn: Callable[[], Awaitable[Any]], repeat: int, rounds: int = 5) -> float:
+    """每轮 repeat 次，取各轮中最小的单次 CPU 时间，减少调度噪声。"""
+
+    async def loop() -> float:
+        for _ in range(min(repeat // 10, 100)):  # 预热
+            await fn()
+        best = float("inf")
+        for _ in range(rounds):
+            started = time.process_time()
+            for _ in range(repeat):
+                await fn()
+            best = min(best, time.process_time() - started)
+        return best
+
+    return asyncio.run(loop()) / repeat * 1e6
+
+
+def run(repeat: int) -> Dict[str, Any]:
+    cards_raw = card_payload()
+    script_raw = script_payload()
+    analyze_route, script_route = _route("/api/analyze"), _route("/api/generate_script")
+
+    def analyze(parse: Callable, respond: Callable) -> Callable[[], Awaitable[bytes]]:
+        async def call() -> bytes:
+            return await respond(analyze_route, ProductAnalysisResponse(cards=parse(cards_raw)))
+
+        return call
+
+    def script(parse: Callable, respond: Callable) -> Callable[[], Awaitable[bytes]]:
+        async def call() -> bytes:
+            return await respond(script_route, GenerateScriptResponse(script=parse(script_raw)))
+
+        return call
+
+    cases = {
+        "analyze": {
+            "payload_bytes": len(json.dumps({"cards": cards_raw}, ensure_ascii=False).encode("utf-8")),
+            "legacy_fastapi": analyze(legacy_parse_cards, fastapi_response),
+            "legacy_classic": analyze(legacy_parse_cards, classic_response),
+            "fast": analyze(_parse_llm_cards, direct_response),
+            "build_legacy": analyze(legacy_parse_cards, lambda route, content: _noop()),
+            "build_fast": analyze(_parse_llm_cards, lambda route, content: _noop()),
+        },
+        "generate_script": {
+            "payload_bytes": len(json.dumps(script_raw, ensure_ascii=False).encode("utf-8")),
+            "legacy_fastapi": script(legacy_parse_script, fastapi_response),
+            "legacy_classic": script(legacy_parse_script, classic_response),
+            "fast": script(lambda data: _parse_llm_script(data, wrap_brand=True), direct_response),
+            "build_legacy": script(legacy_parse_script, lambda route, content: _noop()),
+            "build_fast": script(lambda data: _parse_llm_script(data, wrap_brand=True), lambda route, content: _noop()),
+        },
+    }
+
+    rows = []
+    for name, case in cases.items():
+        row: Dict[str, Any] = {"endpoint": name, "payload_bytes": case.pop("payload_bytes")}
+        for label, fn in case.items():
+            row[f"{label}_us"] = round(_cpu_us(fn, repeat), 1)
+        row["saved_vs_fastapi_us"] = round(row["legacy_fastapi_us"] - row["fast_us"], 1)
+        row["saved_vs_classic_us"] = round(row["legacy_classic_us"] - row["fast_us"], 1)
+        row["speedup_vs_fastapi"] = round(row["legacy_fastapi_us"] / row["fast_us"], 2)
+        rows.append(row)
+    return {"fastapi_dump_json": _DUMP_JSON, "cases": rows}
+
+
+async def _noop() -> bytes:
+    return b""
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--json", action="store_true", help="输出机器可读 JSON")
+    args = parser.parse_args()
+
+    result = run(args.repeat)
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return 0
+    print(f"{'endpoint':16} {'build old':>10} {'build new':>10} {'old+fastapi':>12} {'old+classic':>12} {'new':>8}  (CPU µs/req)")
+    for row in result["cases"]:
+        print(
+            f"{row['endpoint']:16} {row['build_legacy_us']:>10.1f} {row['build_fast_us']:>10.1f} "
+            f"{row['legacy_fastapi_us']:>12.1f} {row['legacy_classic_us']:>12.1f} {row['fast_us']:>8.1f}"
+        )
+    for row in result["cases"]:
+        print(
+            f"{row['endpoint']}: saves {row['saved_vs_fastapi_us']:.1f} µs/req vs installed FastAPI "
+            f"({row['speedup_vs_fastapi']}x), {row['saved_vs_classic_us']:.1f} µs/req vs classic path"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,198 @@
+"""
+Local HeyGen stand-in for benchmarks and manual testing.
+
+实现 `POST /v2/video/generate` 与 `GET /v1/video_status.get`；渲染在 `render_seconds` 后完成，
+若提交时带了 callback_url，则按 HeyGen webhook 格式回调，并用 `webhook_secret` 做 HMAC-SHA256 签名。
+
+    cd backend
+    python -m benchmarks.fake_heygen --port 9100 --render-seconds 5 --webhook-secret dev
+
+然后设置：
+    HEYGEN_API_KEY=dev
+    HEYGEN_API_URL=http://127.0.0.1:9100/v2/video/generate
+    HEYGEN_STATUS_URL=http://127.0.0.1:9100/v1/video_status.get?video_id=
+    HEYGEN_CALLBACK_URL=http://127.0.0.1:8000/api/heygen/callback
+    HEYGEN_WEBHOOK_SECRET=dev
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import hmac
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+from urllib.parse import parse_qs, urlparse
+from urllib.request import Request, urlopen
+
+
+class FakeHeygen:
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        render_seconds: float = 5.0,
+        submit_latency: float = 0.0,
+        status_latency: float = 0.0,
+        error_rate: float = 0.0,
+        webhook_secret: Optional[str] = None,
+    ) -> None:
+        self.render_seconds = render_seconds
+        self.submit_latency = submit_latency
+        self.status_latency = status_latency
+        self.error_rate = error_rate
+        self.webhook_secret = webhook_secret
+        self.videos: Dict[str, Dict[str, Any]] = {}
+        self.counters = {"submits": 0, "status_checks": 0, "callbacks_sent": 0, "callback_failures": 0}
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def env(self) -> Dict[str, str]:
+        """Environment variables that point the backend at this stand-in."""
+        env = {
+            "HEYGEN_API_KEY": "fake-heygen",
+            "HEYGEN_API_URL": f"{self.base_url}/v2/video/generate",
+            "HEYGEN_STATUS_URL": f"{self.base_url}/v1/video_status.get?video_id=",
+        }
+        if self.webhook_secret:
+            env["HEYGEN_WEBHOOK_SECRET"] = self.webhook_secret
+        return env
+
+    def start(self) -> "FakeHeygen":
+        self._thread = threading.Thread(target=self.server.serve_forever, name="fake-heygen", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def status_of(self, video_id: str) -> Dict[str, Any]:
+        with self._lock:
+            video = self.videos.get(video_id)
+        if video is None:
+            return {"status": "failed", "error": "video not found"}
+        if video["failed"]:
+            return {"status": "failed", "error": "render failed"}
+        if time.time() >= video["ready_at"]:
+            return {"status": "completed", "video_url": f"{self.base_url}/videos/{video_id}.mp4"}
+        return {"status": "processing"}
+
+    def _fire_callback(self, video_id: str, callback_url: str) -> None:
+        state = self.status_of(video_id)
+        if state["status"] == "completed":
+            event = {"event_type": "avatar_video.success", "event_data": {"video_id": video_id, "url": state["video_url"]}}
+        else:
+            event = {"event_type": "avatar_video.fail", "event_data": {"video_id": video_id, "msg": state.get("error")}}
+        body = json.dumps(event).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        if self.webhook_secret:
+            headers["Signature"] = hmac.new(self.webhook_secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+        try:
+            with urlopen(Request(callback_url, data=body, headers=headers, method="POST"), timeout=10):
+                pass
+            key = "callbacks_sent"
+        except Exception:
+            key = "callback_failures"
+        with self._lock:
+            self.counters[key] += 1
+
+    def _submit(self, payload: Dict[str, Any]) -> str:
+        video_id = uuid.uuid4().hex
+        failed = random.random() < self.error_rate
+        with self._lock:
+            self.counters["submits"] += 1
+            self.videos[video_id] = {"ready_at": time.time() + self.render_seconds, "failed": failed, "payload": payload}
+        callback_url = payload.get("callback_url")
+        if callback_url:
+            timer = threading.Timer(self.render_seconds, self._fire_callback, args=(video_id, callback_url))
+            timer.daemon = True
+            timer.start()
+        return video_id
+
+    def create_video(self, callback_url: Optional[str] = None) -> str:
+        """不经 HTTP 直接登记一个渲染任务，压测时用来准备 video_id。"""
+        return self._submit({"callback_url": callback_url} if callback_url else {})
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _send(self, code: int, body: Dict[str, Any]) -> None:
+                raw = json.dumps(body).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def do_POST(self) -> None:  # noqa: N802
+                length = int(self.headers.get("Content-Length") or 0)
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                if urlparse(self.path).path != "/v2/video/generate":
+                    self._send(404, {"error": "not found"})
+                    return
+                if fake.submit_latency:
+                    time.sleep(fake.submit_latency)
+                video_id = fake._submit(payload)
+                self._send(200, {"error": None, "data": {"video_id": video_id}})
+
+            def do_GET(self) -> None:  # noqa: N802
+                parsed = urlparse(self.path)
+                if parsed.path != "/v1/video_status.get":
+                    self._send(404, {"error": "not found"})
+                    return
+                if fake.status_latency:
+                    time.sleep(fake.status_latency)
+                video_id = (parse_qs(parsed.query).get("video_id") or [""])[0]
+                with fake._lock:
+                    fake.counters["status_checks"] += 1
+                self._send(200, {"code": 100, "data": {"id": video_id, **fake.status_of(video_id)}})
+
+            def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+                pass
+
+        return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--render-seconds", type=float, default=5.0)
+    parser.add_argument("--submit-latency", type=float, default=0.0)
+    parser.add_argument("--status-latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--webhook-secret")
+    args = parser.parse_args()
+
+    fake = FakeHeygen(
+        host=args.host,
+        port=args.port,
+        render_seconds=args.render_seconds,
+        submit_latency=args.submit_latency,
+        status_latency=args.status_latency,
+        error_rate=args.error_rate,
+        webhook_secret=args.webhook_secret,
+    )
+    print(f"fake HeyGen listening on {fake.base_url}")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+"""
+Local OpenAI-compatible stand-in for benchmarks and manual testing.
+
+实现 `POST /v1/chat/completions`（含 `stream: true`），按 prompt 中的 JSON 格式说明返回
+痛点卡片 / 口播脚本 / 单条口播 / 小红书文案。可配置响应耗时、抖动、流式分片节奏、
+畸形输出比例（前后说明文字、尾逗号、截断）、近似重复输出比例（多条文案只差一个序号）与 5xx/429 比例。
+
+    cd backend
+    python -m benchmarks.fake_openai --port 9200 --latency 0.3 --malformed-rate 0.1
+
+然后设置：
+    OPENAI_API_KEY=fake-openai
+    OPENAI_BASE_URL=http://127.0.0.1:9200/v1
+    OPENAI_MODEL=fake-gpt
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+
+from app.services.tokens import count_message_tokens, count_tokens
+
+
+def _cards(topic: str) -> Dict[str, Any]:
+    return {
+        "cards": [
+            {
+                "title": f"{topic}交付周期不稳定",
+                "scenario": f"渠道商在旺季集中下单{topic}，工厂排产跟不上",
+                "pain_point": "交期一拖再拖，终端客户催单，渠道信誉受损",
+                "solution": "按区域备货 + 排产看板，下单即给出可承诺交期",
+                "recommended_copies": [
+                    {"channel": "客户私聊", "copy": f"旺季{topic}交期我们按天承诺，排产看板实时可查。"},
+                    {"channel": "朋友圈", "copy": f"这个月第 12 批{topic}准时发车，交期说到做到。"},
+                ],
+            },
+            {
+                "title": "售后响应慢",
+                "scenario": "项目安装后出现渗水、异响，售后踢皮球",
+                "pain_point": "问题拖成投诉，后续项目不敢再合作",
+                "solution": "48 小时上门 + 质保档案可追溯",
+                "recommended_copies": [{"channel": "公众号", "copy": "售后不是成本，是下一单的开始。"}],
+            },
+            {
+                "title": "报价体系混乱",
+                "scenario": "同一型号不同业务员报价差异大",
+                "pain_point": "渠道利润不可控，价格战伤害品牌",
+                "solution": "统一渠道价盘 + 区域保护",
+                "recommended_copies": [{"channel": "短视频", "copy": "价盘统一，渠道才敢长期投入。"}],
+            },
+        ]
+    }
+
+
+def _extra_cards(topic: str) -> Dict[str, Any]:
+    """带「补充要求」的重新生成请求返回的卡片，与 _cards 不重复。"""
+    return {
+        "cards": [
+            {
+                "title": "样品与大货不一致",
+                "scenario": f"工程客户确认{topic}样品后下单，到货型材壁厚和五金都缩水",
+                "pain_point": "验收扯皮，尾款迟迟结不了",
+                "solution": "封样留档 + 大货随机抽检报告随车",
+                "recommended_copies": [{"channel": "客户私聊", "copy": "封样什么样，大货就什么样，报告随车给您。"}],
+            },
+            {
+                "title": "安装队伍水平参差",
+                "scenario": "经销商自找的安装师傅打胶、固定不规范",
+                "pain_point": "好窗装坏，口碑算在品牌头上",
+                "solution": "安装标准视频 + 区域认证安装队",
+                "recommended_copies": [{"channel": "朋友圈", "copy": "三分产品七分安装，认证安装队上门。"}],
+            },
+        ]
+    }
+
+
+# 每条风格不同、开头不同；近似重复模式下所有条目只差一个序号
+_VOICE_OVERS = [
+    "做{topic}的老板都知道，旺季最怕的就是交期失控。把排产看板开放给渠道，下单当天就能看到可承诺交期，客户不再反复催单，你的信誉也就稳住了。",
+    "以前我们接单全靠业务员拍胸脯，现在客户在手机上自己查排产进度。同样是{topic}，一个靠嘴，一个靠系统，你说渠道更愿意跟谁长期合作？",
+    "上个月有个经销商朋友跟我吐槽，三个工地同时催货，他只能挨个打电话道歉。后来他换了我们的区域备货，这个月一单都没延期，评论区聊聊你家交期。",
+    "你有没有算过，一次交期延误要赔多少？违约金、返工、丢掉的回头客。{topic}选厂先看它敢不敢把交期写进合同，我们敢，私信我要合同模版。",
+    "说真的，{topic}拼到最后拼的不是价格，是谁能准时到货。我们每周公布发货准点率，数据摆在那里，收藏这条，选厂的时候对照着问。",
+    "很多人以为{topic}售后就是修修补补，其实最好的售后是不出问题。出厂前三道气密水密检测，报告随货走，想看报告的评论区扣 1。",
+]
+
+_XHS_COPIES = [
+    "{topic}选厂避坑：先问交期敢不敢写进合同，再看排产能不能实时查。#门窗 #系统窗 #工程渠道",
+    "做渠道三年总结：价格战打不赢，准时交付才是回头客的来源。#门窗厂家 #渠道合作 #交付保障",
+    "工地最怕什么？不是贵，是等。区域仓备货，下单 48 小时到现场。#工程项目 #门窗 #供应链",
+    "封样留档、抽检报告随车，验收再也不扯皮。#品质交付 #系统窗 #工程验收",
+    "安装决定七成体验，认证安装队上门，打胶固定按标准走。#门窗安装 #售后 #口碑",
+    "售后 48 小时上门，质保档案扫码可查，经销商不用再替厂家背锅。#售后保障 #门窗品牌 #渠道商",
+    "旺季不断货的秘密：排产看板开放给渠道，缺口提前两周预警。#排产 #门窗工厂 #旺季备货",
+    "同样的{topic}，壁厚、五金、密封胶差一点，十年后就是两种窗。#系统窗 #门窗选购 #品质",
+]
+
+_VARIANT_NAMES = ("痛点共鸣型", "对比反差型", "故事真实型")
+
+
+def _voice_over(topic: str, idx: int = 1) -> str:
+    return (
+        f"做{topic}的老板都知道，旺季最怕的就是交期失控。第{idx}个建议：把排产看板开放给渠道，"
+        "下单当天就能看到可承诺交期，客户不再反复催单，你的信誉也就稳住了。"
+    )
+
+
+def _payload_for(prompt: str, rng: random.Random, duplicate: bool = False) -> Dict[str, Any]:
+    topic = "系统窗"
+    # 重新生成请求（带「补充要求」）从后半部分的条目里挑，模拟模型换了角度
+    retry = "【补充要求】" in prompt
+    if '"cards"' in prompt:
+        return _extra_cards(topic) if retry else _cards(topic)
+    if '"voice_over"' in prompt:
+        if duplicate:
+            return {"headline": f"{topic}交期这样承诺", "voice_over": _voice_over(topic)}
+        idx = next((i for i, name in enumerate(_VARIANT_NAMES) if name in prompt), 0)
+        text = _VOICE_OVERS[rng.randrange(3, len(_VOICE_OVERS)) if retry else idx]
+        return {"headline": f"{topic}交期这样承诺", "voice_over": text.format(topic=topic)}
+    if '"headline"' in prompt:
+        copies = [_voice_over(topic, i) for i in range(1, 4)] if duplicate else [t.format(topic=topic) for t in _VOICE_OVERS[:3]]
+        return {"headline": f"{topic}交期这样承诺", "copies": copies}
+    if duplicate:
+        copies = [
+            f"{topic}第{i}条笔记：交期说到做到，排产看板开放给渠道，售后 48 小时上门。#门窗 #系统窗 #工程渠道"
+            for i in range(1, 6)
+        ]
+    else:
+        pool = _XHS_COPIES[5:] if retry else _XHS_COPIES[:5]
+        copies = [text.format(topic=topic) for text in pool]
+    return {"copies": copies}
+
+
+def _malform(text: str, rng: random.Random) -> str:
+    """模拟真实模型的常见坏输出，均在 parse_json_payload 的容错范围内（截断时会丢掉最后一个条目）。"""
+    kind = rng.choice(("prose", "trailing_comma", "truncated"))
+    if kind == "prose":
+        return f"好的，以下是结果：\n```json\n{text}\n```\n希望对你有帮助！"
+    if kind == "trailing_comma":
+        return text.replace("]", ",]", 1)
+    return text[: int(len(text) * 0.8)]
+
+
+class FakeOpenAI:
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.2,
+        jitter: float = 0.05,
+        chunk_chars: int = 24,
+        chunk_delay: float = 0.005,
+        malformed_rate: float = 0.0,
+        error_rate: float = 0.0,
+        duplicate_rate: float = 0.0,
+        model: str = "fake-gpt",
+        seed: Optional[int] = None,
+    ) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.chunk_chars = max(chunk_chars, 1)
+        self.chunk_delay = chunk_delay
+        self.malformed_rate = malformed_rate
+        self.error_rate = error_rate
+        self.duplicate_rate = duplicate_rate
+        self.model = model
+        self.counters = {"completions": 0, "streams": 0, "malformed": 0, "errors": 0, "duplicates": 0}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    @property
+    def env(self) -> Dict[str, str]:
+        """Environment variables that point the backend at this stand-in."""
+        return {"OPENAI_API_KEY": "fake-openai", "OPENAI_BASE_URL": self.base_url, "OPENAI_MODEL": self.model}
+
+    def start(self) -> "FakeOpenAI":
+        self._thread = threading.Thread(target=self.server.serve_forever, name="fake-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _roll(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "delay": max(self.latency + self._rng.uniform(-self.jitter, self.jitter), 0.0),
+                "error": self._rng.random() < self.error_rate,
+                "malformed": self._rng.random() < self.malformed_rate,
+                "duplicate": self._rng.random() < self.duplicate_rate,
+                "rng": random.Random(self._rng.random()),
+            }
+
+    def _bump(self, key: str) -> None:
+        with self._lock:
+            self.counters[key] += 1
+
+    def completion_text(
+        self, messages: List[Dict[str, str]], malformed: bool, rng: random.Random, duplicate: bool = False
+    ) -> str:
+        prompt = messages[-1].get("content", "") if messages else ""
+        text = json.dumps(_payload_for(prompt, rng, duplicate), ensure_ascii=False, indent=2)
+        return _malform(text, rng) if malformed else text
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _send(self, code: int, body: Dict[str, Any]) -> None:
+                raw = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def _chunk(self, data: str) -> None:
+                raw = f"data: {data}\n\n".encode("utf-8")
+                self.wfile.write(f"{len(raw):x}\r\n".encode("ascii") + raw + b"\r\n")
+                self.wfile.flush()
+
+            def do_POST(self) -> None:  # noqa: N802
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if not urlparse(self.path).path.endswith("/chat/completions"):
+                    self._send(404, {"error": {"message": "not found"}})
+                    return
+
+                roll = fake._roll()
+                if roll["error"]:
+                    fake._bump("errors")
+                    time.sleep(roll["delay"] / 4)
+                    code = roll["rng"].choice((429, 500, 503))
+                    self._send(code, {"error": {"message": "fake upstream error", "code": code}})
+                    return
+                if roll["malformed"]:
+                    fake._bump("malformed")
+                if roll["duplicate"]:
+                    fake._bump("duplicates")
+
+                messages = body.get("messages") or []
+                text = fake.completion_text(messages, roll["malformed"], roll["rng"], roll["duplicate"])
+                usage = {
+                    "prompt_tokens": count_message_tokens(messages),
+                    "completion_tokens": count_tokens(text),
+                }
+                usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+                completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+
+                if not body.get("stream"):
+                    fake._bump("completions")
+                    time.sleep(roll["delay"])
+                    self._send(
+                        200,
+                        {
+                            "id": completion_id,
+                            "object": "chat.completion",
+                            "model": fake.model,
+                            "choices": [
+                                {"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}
+                            ],
+                            "usage": usage,
+                        },
+                    )
+                    return
+
+                # 流式：首包前等待 delay 的一半，其余时间摊到各分片上
+                fake._bump("streams")
+                time.sleep(roll["delay"] / 2)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for start in range(0, len(text), fake.chunk_chars):
+                    delta = text[start : start + fake.chunk_chars]
+                    chunk = {
+                        "id": completion_id,
+                        "model": fake.model,
+                        "choices": [{"index": 0, "delta": {"content": delta}, "finish_reason": None}],
+                    }
+                    self._chunk(json.dumps(chunk, ensure_ascii=False))
+                    if fake.chunk_delay:
+                        time.sleep(fake.chunk_delay)
+                final = {"id": completion_id, "model": fake.model, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+                self._chunk(json.dumps(final))
+                if (body.get("stream_options") or {}).get("include_usage"):
+                    self._chunk(json.dumps({"id": completion_id, "model": fake.model, "choices": [], "usage": usage}))
+                self._chunk("[DONE]")
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+
+            def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+                pass
+
+        return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9200)
+    parser.add_argument("--latency", type=float, default=0.2, help="单次补全耗时（秒）")
+    parser.add_argument("--jitter", type=float, default=0.05, help="耗时随机抖动幅度（秒）")
+    parser.add_argument("--chunk-chars", type=int, default=24, help="流式输出每个分片的字符数")
+    parser.add_argument("--chunk-delay", type=float, default=0.005, help="流式分片间隔（秒）")
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--duplicate-rate", type=float, default=0.0, help="多条文案近似重复的比例")
+    parser.add_argument("--model", default="fake-gpt")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        jitter=args.jitter,
+        chunk_chars=args.chunk_chars,
+        chunk_delay=args.chunk_delay,
+        malformed_rate=args.malformed_rate,
+        error_rate=args.error_rate,
+        duplicate_rate=args.duplicate_rate,
+        model=args.model,
+        seed=args.seed,
+    )
+    print(f"fake OpenAI listening on {fake.base_url}")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,584 @@
+"""
+Load test: drive every endpoint in app.main against local OpenAI / HeyGen stand-ins.
+
+启动 fake_openai、fake_heygen 与一个 uvicorn 子进程（环境变量指向两个替身，不会访问真实服务），
+按固定并发逐个接口压测，输出每个 (接口, 并发) 的 RPS、p50/p95/p99 耗时与错误率。
+
+    cd backend
+    python -m benchmarks.load_test --concurrency 1,8,32 --requests 100 --output load.json
+    python -m benchmarks.load_test --endpoints analyze,analyze_stream --llm-latency 0.5
+    python -m benchmarks.load_test --baseline load.json   # 与上一次结果对比，有退步时退出码为 1
+
+生成文件目录与任务队列都放在临时目录，结束后删除。
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import hmac
+import itertools
+import json
+import math
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Sequence
+
+import httpx
+
+from .fake_heygen import FakeHeygen
+from .fake_openai import FakeOpenAI
+
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+WEBHOOK_SECRET = "load-test"
+
+
+@dataclass
+class BenchContext:
+    heygen: FakeHeygen
+    callback_url: str
+    batch_rows: int
+    seq: Iterator[int] = field(default_factory=itertools.count)
+    card: Dict[str, Any] = field(default_factory=dict)
+    script: Dict[str, Any] = field(default_factory=dict)
+    avatar_id: Optional[str] = None
+    job_ids: List[str] = field(default_factory=list)
+    video_ids: List[str] = field(default_factory=list)
+    revision_ids: List[str] = field(default_factory=list)
+
+    def next_id(self) -> int:
+        return next(self.seq)
+
+
+VOICE = {"language": "zh-CN", "voice_style": "沉稳", "age_group": "中年"}
+
+
+def _analysis_body(i: int) -> Dict[str, Any]:
+    # 每个请求的商品名都不同，避免被分析缓存和 single-flight 合并掉
+    return {
+        "product_name": f"断桥铝系统窗 #{i}",
+        "persona": "工厂老板",
+        "target_customer": "门窗经销商",
+        "audience_type": "B端",
+        "product_keywords": ["隔音", "断桥铝"],
+        "cache": "bypass",
+    }
+
+
+def _card(ctx: BenchContext, i: int) -> Dict[str, Any]:
+    return {**ctx.card, "title": f"{ctx.card['title']} #{i}"}
+
+
+def _save_card_body(ctx: BenchContext, i: int) -> Dict[str, Any]:
+    # card_id 在卡片库里唯一，每次保存都换一个新 id
+    return {"card": {**_card(ctx, i), "id": f"bench-{ctx.next_id()}"}, "product_name": "断桥铝系统窗"}
+
+
+async def _send(client: httpx.AsyncClient, method: str, url: str, **kwargs: Any) -> int:
+    response = await client.request(method, url, **kwargs)
+    return response.status_code
+
+
+async def _submit_video(client: httpx.AsyncClient, ctx: BenchContext, timeout: float = 60.0) -> Optional[str]:
+    """经 /api/generate_video 提交并等任务结束，返回 HeyGen video_id；状态接口只认本服务提交过的视频。"""
+    response = await client.post(
+        "/api/generate_video",
+        json={"script": ctx.script, "voice": VOICE, "video_style": "口播", "avatar_id": ctx.avatar_id},
+    )
+    if response.status_code != 200:
+        return None
+    job_id = response.json()["job_id"]
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = (await client.get(f"/api/video_jobs/{job_id}")).json()
+        if job["status"] in ("succeeded", "failed"):
+            return (job.get("result") or {}).get("job_id")
+        await asyncio.sleep(0.05)
+    return None
+
+
+async def _video_stream(client: httpx.AsyncClient, ctx: BenchContext) -> int:
+    video_id = await _submit_video(client, ctx)
+    if video_id is None:
+        return 599
+    return await _drain(client, "GET", "/api/video_status/stream", params={"video_id": video_id})
+
+
+async def _save_and_delete(client: httpx.AsyncClient, ctx: BenchContext, i: int) -> int:
+    """先保存再删除同一张卡片，删除不会落空；耗时包含保存。"""
+    body = _save_card_body(ctx, i)
+    response = await client.post("/api/cards", json=body)
+    if response.status_code != 200:
+        return response.status_code
+    return await _send(client, "DELETE", f"/api/cards/{body['card']['id']}")
+
+
+async def _revision_stream(client: httpx.AsyncClient, i: int) -> int:
+    response = await client.post("/api/analyze", json={**_analysis_body(i), "instant": True})
+    if response.status_code != 200:
+        return response.status_code
+    revision = response.json().get("revision")
+    if not revision:
+        return 599
+    return await _drain(client, "GET", f"/api/revisions/{revision}/stream")
+
+
+async def _drain(client: httpx.AsyncClient, method: str, url: str, **kwargs: Any) -> int:
+    """流式接口读到连接结束为止，耗时包含整段输出。"""
+    async with client.stream(method, url, **kwargs) as response:
+        async for _ in response.aiter_bytes():
+            pass
+        return response.status_code
+
+
+def _batch_csv(rows: int, offset: int) -> bytes:
+    lines = ["product_name,persona,target_customer,audience_type,product_keywords,cache"]
+    for idx in range(rows):
+        lines.append(f"断桥铝系统窗 #{offset}-{idx},工厂老板,门窗经销商,B端,隔音;断桥铝,bypass")
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def _callback_request(ctx: BenchContext, i: int) -> Dict[str, Any]:
+    video_id = ctx.video_ids[i % len(ctx.video_ids)]
+    body = json.dumps(
+        {"event_type": "avatar_video.success", "event_data": {"video_id": video_id, "url": f"https://example.com/{video_id}.mp4"}}
+    ).encode("utf-8")
+    signature = hmac.new(WEBHOOK_SECRET.encode("utf-8"), body, hashlib.sha256).hexdigest()
+    return {"content": body, "headers": {"Content-Type": "application/json", "Signature": signature}}
+
+
+Call = Callable[[httpx.AsyncClient, BenchContext, int], Awaitable[int]]
+
+
+@dataclass(frozen=True)
+class Scenario:
+    name: str
+    route: str
+    call: Call
+    needs: Sequence[str] = ()
+
+
+SCENARIOS: List[Scenario] = [
+    Scenario("metrics", "GET /metrics", lambda c, ctx, i: _send(c, "GET", "/metrics")),
+    Scenario("analyze", "POST /api/analyze", lambda c, ctx, i: _send(c, "POST", "/api/analyze", json=_analysis_body(i))),
+    Scenario(
+        "analyze_stream",
+        "POST /api/analyze/stream",
+        lambda c, ctx, i: _drain(c, "POST", "/api/analyze/stream", json=_analysis_body(i)),
+    ),
+    Scenario(
+        "analyze_instant",
+        "POST /api/analyze (instant)",
+        lambda c, ctx, i: _send(c, "POST", "/api/analyze", json={**_analysis_body(i), "instant": True}),
+    ),
+    Scenario(
+        "revision",
+        "GET /api/revisions/{revision_id}",
+        lambda c, ctx, i: _send(c, "GET", f"/api/revisions/{ctx.revision_ids[i % len(ctx.revision_ids)]}"),
+        needs=("revision_ids",),
+    ),
+    Scenario(
+        "revision_stream",
+        "GET /api/revisions/{revision_id}/stream",
+        # 每次先发一个 instant 分析拿到新版本再订阅，耗时包含首版返回和后台升级
+        lambda c, ctx, i: _revision_stream(c, i),
+    ),
+    Scenario(
+        "analyze_batch",
+        "POST /api/analyze_batch",
+        lambda c, ctx, i: _drain(
+            c, "POST", "/api/analyze_batch", files={"file": ("rows.csv", _batch_csv(ctx.batch_rows, i), "text/csv")}
+        ),
+    ),
+    Scenario("cache_stats", "GET /api/cache_stats", lambda c, ctx, i: _send(c, "GET", "/api/cache_stats")),
+    Scenario("llm_stats", "GET /api/llm_stats", lambda c, ctx, i: _send(c, "GET", "/api/llm_stats")),
+    Scenario("outbound_stats", "GET /api/outbound_stats", lambda c, ctx, i: _send(c, "GET", "/api/outbound_stats")),
+    Scenario(
+        "generate_script",
+        "POST /api/generate_script",
+        lambda c, ctx, i: _send(
+            c, "POST", "/api/generate_script", json={"selected_card": _card(ctx, i), "voice": VOICE, "video_style": "口播"}
+        ),
+        needs=("card",),
+    ),
+    Scenario(
+        "generate_script_instant",
+        "POST /api/generate_script (instant)",
+        lambda c, ctx, i: _send(
+            c,
+            "POST",
+            "/api/generate_script",
+            json={"selected_card": _card(ctx, i), "voice": VOICE, "video_style": "口播", "instant": True},
+        ),
+        needs=("card",),
+    ),
+    Scenario(
+        "generate_xhs",
+        "POST /api/generate_xhs",
+        lambda c, ctx, i: _send(c, "POST", "/api/generate_xhs", json={"selected_card": _card(ctx, i)}),
+        needs=("card",),
+    ),
+    Scenario(
+        "cards_save",
+        "POST /api/cards",
+        lambda c, ctx, i: _send(c, "POST", "/api/cards", json=_save_card_body(ctx, i)),
+        needs=("card",),
+    ),
+    Scenario(
+        "cards_search",
+        "GET /api/cards",
+        # 单双号交替走关键词检索和按产品筛选两条查询路径
+        lambda c, ctx, i: _send(
+            c,
+            "GET",
+            "/api/cards",
+            params={"q": ctx.card["title"][:4], "limit": 20} if i % 2 else {"product": "断桥铝系统窗", "limit": 20},
+        ),
+        needs=("card",),
+    ),
+    Scenario("cards_delete", "DELETE /api/cards/{card_id}", _save_and_delete, needs=("card",)),
+    Scenario("card_library_stats", "GET /api/card_library_stats", lambda c, ctx, i: _send(c, "GET", "/api/card_library_stats")),
+    Scenario("avatars", "GET /api/avatars", lambda c, ctx, i: _send(c, "GET", "/api/avatars", params={"limit": 50})),
+    Scenario(
+        "avatar_detail",
+        "GET /api/avatars/{avatar_id}",
+        lambda c, ctx, i: _send(c, "GET", f"/api/avatars/{ctx.avatar_id}"),
+        needs=("avatar_id",),
+    ),
+    Scenario(
+        "generate_video",
+        "POST /api/generate_video",
+        lambda c, ctx, i: _send(
+            c,
+            "POST",
+            "/api/generate_video",
+            json={"script": ctx.script, "voice": VOICE, "video_style": "口播", "avatar_id": ctx.avatar_id},
+        ),
+        needs=("script",),
+    ),
+    Scenario(
+        "video_job",
+        "GET /api/video_jobs/{job_id}",
+        lambda c, ctx, i: _send(c, "GET", f"/api/video_jobs/{ctx.job_ids[i % len(ctx.job_ids)]}"),
+        needs=("job_ids",),
+    ),
+    Scenario("video_queue_stats", "GET /api/video_queue_stats", lambda c, ctx, i: _send(c, "GET", "/api/video_queue_stats")),
+    Scenario(
+        "video_status",
+        "GET /api/video_status",
+        lambda c, ctx, i: _send(c, "GET", "/api/video_status", params={"video_id": ctx.video_ids[i % len(ctx.video_ids)]}),
+        needs=("video_ids",),
+    ),
+    Scenario(
+        "video_status_stream",
+        "GET /api/video_status/stream",
+        # 每次都经任务队列提交一个新视频再订阅，耗时包含入队提交和替身的渲染时长
+        lambda c, ctx, i: _video_stream(c, ctx),
+        needs=("script",),
+    ),
+    Scenario(
+        "heygen_callback",
+        "POST /api/heygen/callback",
+        lambda c, ctx, i: _send(c, "POST", "/api/heygen/callback", **_callback_request(ctx, i)),
+        needs=("video_ids",),
+    ),
+    Scenario("video_status_stats", "GET /api/video_status_stats", lambda c, ctx, i: _send(c, "GET", "/api/video_status_stats")),
+    Scenario("asset_stats", "GET /api/asset_stats", lambda c, ctx, i: _send(c, "GET", "/api/asset_stats")),
+]
+
+
+def percentile(values: Sequence[float], pct: float) -> Optional[float]:
+    """最近秩法（nearest-rank），values 需已排序。"""
+    if not values:
+        return None
+    idx = min(len(values) - 1, max(0, math.ceil(pct * len(values)) - 1))
+    return values[idx]
+
+
+def _ms(value: Optional[float]) -> Optional[float]:
+    return round(value * 1000, 2) if value is not None else None
+
+
+async def run_level(
+    client: httpx.AsyncClient, ctx: BenchContext, scenario: Scenario, concurrency: int, total: int
+) -> Dict[str, Any]:
+    """闭环压测：concurrency 个协程循环发请求，直到一共发完 total 个。"""
+    remaining = iter(range(total))
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    errors = 0
+
+    async def worker() -> None:
+        nonlocal errors
+        for _ in remaining:
+            i = ctx.next_id()
+            started = time.perf_counter()
+            try:
+                status = str(await scenario.call(client, ctx, i))
+            except httpx.HTTPError as exc:
+                status = exc.__class__.__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+            if not status.isdigit() or int(status) >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "endpoint": scenario.name,
+        "route": scenario.route,
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "error_rate": round(errors / total, 4) if total else 0.0,
+        "duration_s": round(wall, 3),
+        "rps": round(total / wall, 2) if wall > 0 else None,
+        "latency_ms": {
+            "mean": _ms(sum(latencies) / len(latencies)) if latencies else None,
+            "p50": _ms(percentile(latencies, 0.50)),
+            "p95": _ms(percentile(latencies, 0.95)),
+            "p99": _ms(percentile(latencies, 0.99)),
+            "max": _ms(latencies[-1]) if latencies else None,
+        },
+        "statuses": statuses,
+    }
+
+
+async def prepare(client: httpx.AsyncClient, ctx: BenchContext, video_pool: int) -> None:
+    """准备依赖数据：一张卡片（并存入卡片库）、一份脚本、若干 instant 结果版本、视频任务和 HeyGen video_id。"""
+    response = await client.post("/api/analyze", json=_analysis_body(ctx.next_id()))
+    if response.status_code == 200 and response.json().get("cards"):
+        ctx.card = response.json()["cards"][0]
+    if ctx.card:
+        response = await client.post(
+            "/api/generate_script", json={"selected_card": ctx.card, "voice": VOICE, "video_style": "口播"}
+        )
+        if response.status_code == 200:
+            ctx.script = response.json()["script"]
+        # 检索场景需要库里有卡片可查
+        for _ in range(20):
+            await client.post("/api/cards", json=_save_card_body(ctx, ctx.next_id()))
+    for _ in range(10):
+        response = await client.post("/api/analyze", json={**_analysis_body(ctx.next_id()), "instant": True})
+        if response.status_code == 200 and response.json().get("revision"):
+            ctx.revision_ids.append(response.json()["revision"])
+    response = await client.get("/api/avatars", params={"limit": 1})
+    if response.status_code == 200 and response.json().get("avatars"):
+        ctx.avatar_id = response.json()["avatars"][0]["avatar_id"]
+    if ctx.script:
+        for _ in range(5):
+            response = await client.post(
+                "/api/generate_video",
+                json={"script": ctx.script, "voice": VOICE, "video_style": "口播", "avatar_id": ctx.avatar_id},
+            )
+            if response.status_code == 200:
+                ctx.job_ids.append(response.json()["job_id"])
+        # 状态查询与回调用的视频都要经本服务提交，直接在替身上建的 id 会被当成未知视频返回 404
+        submitted = await asyncio.gather(*(_submit_video(client, ctx) for _ in range(video_pool)))
+        ctx.video_ids = [video_id for video_id in submitted if video_id]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_ready(base_url: str, proc: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"uvicorn 启动失败，退出码 {proc.returncode}")
+        try:
+            if httpx.get(f"{base_url}/api/cache_stats", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("等待 uvicorn 启动超时")
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Any], threshold: float) -> List[Dict[str, Any]]:
+    """RPS 下降或 p95 上升超过 threshold（比例）即记为退步。"""
+    previous = {(row["endpoint"], row["concurrency"]): row for row in baseline.get("results", [])}
+    rows = []
+    for row in results:
+        old = previous.get((row["endpoint"], row["concurrency"]))
+        if old is None:
+            continue
+        rps_change = (row["rps"] / old["rps"] - 1) if old.get("rps") and row.get("rps") else None
+        old_p95, new_p95 = old["latency_ms"]["p95"], row["latency_ms"]["p95"]
+        p95_change = (new_p95 / old_p95 - 1) if old_p95 and new_p95 else None
+        regressed = (rps_change is not None and rps_change < -threshold) or (
+            p95_change is not None and p95_change > threshold
+        )
+        rows.append(
+            {
+                "endpoint": row["endpoint"],
+                "concurrency": row["concurrency"],
+                "rps_change": round(rps_change, 4) if rps_change is not None else None,
+                "p95_change": round(p95_change, 4) if p95_change is not None else None,
+                "error_rate_change": round(row["error_rate"] - old["error_rate"], 4),
+                "regressed": regressed or row["error_rate"] > old["error_rate"] + threshold,
+            }
+        )
+    return rows
+
+
+async def run(args: argparse.Namespace, base_url: str, heygen: FakeHeygen) -> Dict[str, Any]:
+    selected = [s for s in SCENARIOS if not args.endpoints or s.name in args.endpoints]
+    limits = httpx.Limits(max_connections=max(args.concurrency) * 2, max_keepalive_connections=max(args.concurrency))
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        ctx = BenchContext(heygen=heygen, callback_url=f"{base_url}/api/heygen/callback", batch_rows=args.batch_rows)
+        await prepare(client, ctx, video_pool=50)
+        results: List[Dict[str, Any]] = []
+        skipped: Dict[str, str] = {}
+        for scenario in selected:
+            missing = [name for name in scenario.needs if not getattr(ctx, name)]
+            if missing:
+                skipped[scenario.name] = f"缺少前置数据: {', '.join(missing)}"
+                continue
+            await run_level(client, ctx, scenario, 1, args.warmup)
+            for concurrency in args.concurrency:
+                row = await run_level(client, ctx, scenario, concurrency, args.requests)
+                results.append(row)
+                if not args.quiet:
+                    latency = row["latency_ms"]
+                    print(
+                        f"{row['endpoint']:20} c={concurrency:<4} rps={row['rps']:>8} p50={latency['p50']:>9} "
+                        f"p95={latency['p95']:>9} p99={latency['p99']:>9} err={row['error_rate']:.2%}",
+                        file=sys.stderr,
+                    )
+        server_stats = {}
+        for path in ("/api/llm_stats", "/api/outbound_stats", "/api/video_queue_stats", "/api/video_status_stats"):
+            response = await client.get(path)
+            if response.status_code == 200:
+                server_stats[path] = response.json()
+    return {"results": results, "skipped": skipped, "server": server_stats}
+
+
+def _csv_ints(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item.strip()]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=_csv_ints, default=[1, 8, 32], help="逗号分隔的并发档位")
+    parser.add_argument("--requests", type=int, default=100, help="每个 (接口, 并发) 的请求数")
+    parser.add_argument("--warmup", type=int, default=3, help="每个接口正式压测前的预热请求数")
+    parser.add_argument("--endpoints", type=lambda v: [s for s in v.split(",") if s], help="只压测这些接口（逗号分隔）")
+    parser.add_argument("--batch-rows", type=int, default=10, help="analyze_batch 每次上传的行数")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--llm-jitter", type=float, default=0.05)
+    parser.add_argument("--llm-malformed-rate", type=float, default=0.05)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--llm-duplicate-rate", type=float, default=0.05, help="替身返回近似重复文案的比例")
+    parser.add_argument("--heygen-render-seconds", type=float, default=0.5)
+    parser.add_argument("--heygen-latency", type=float, default=0.05, help="HeyGen 提交与状态查询的耗时")
+    parser.add_argument("--heygen-error-rate", type=float, default=0.0)
+    parser.add_argument("--output", type=Path, help="结果 JSON 写入该文件（默认输出到 stdout）")
+    parser.add_argument("--baseline", type=Path, help="与之前的结果 JSON 对比")
+    parser.add_argument("--threshold", type=float, default=0.1, help="判定退步的相对变化，默认 10%%")
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args()
+
+    unknown = set(args.endpoints or ()) - {s.name for s in SCENARIOS}
+    if unknown:
+        parser.error(f"未知接口: {', '.join(sorted(unknown))}；可选 {', '.join(s.name for s in SCENARIOS)}")
+
+    openai = FakeOpenAI(
+        latency=args.llm_latency,
+        jitter=args.llm_jitter,
+        malformed_rate=args.llm_malformed_rate,
+        error_rate=args.llm_error_rate,
+        duplicate_rate=args.llm_duplicate_rate,
+        seed=0,
+    ).start()
+    heygen = FakeHeygen(
+        render_seconds=args.heygen_render_seconds,
+        submit_latency=args.heygen_latency,
+        status_latency=args.heygen_latency,
+        error_rate=args.heygen_error_rate,
+        webhook_secret=WEBHOOK_SECRET,
+    ).start()
+
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    workdir = tempfile.TemporaryDirectory(prefix="aipromo-load-")
+    env = {
+        **os.environ,
+        **openai.env,
+        **heygen.env,
+        "DEEPSEEK_API_KEY": "",
+        "HEYGEN_CALLBACK_URL": f"{base_url}/api/heygen/callback",
+        # 客户端限流按真实 HeyGen 配额设置，压测替身时放开
+        "HEYGEN_SUBMIT_RATE_PER_MIN": "60000",
+        "HEYGEN_STATUS_RATE_PER_MIN": "60000",
+        "VIDEO_JOB_DB": str(Path(workdir.name) / "jobs.sqlite3"),
+        "CARD_LIBRARY_DB": str(Path(workdir.name) / "cards.sqlite3"),
+        "ANALYZE_CACHE_DB": "",
+        "GENERATED_ASSETS_DIR": str(Path(workdir.name) / "generated"),
+    }
+    command = [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port)]
+    proc = subprocess.Popen(command + ["--log-level", "warning", "--no-access-log"], cwd=BACKEND_DIR, env=env)
+    try:
+        _wait_ready(base_url, proc)
+        outcome = asyncio.run(run(args, base_url, heygen))
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        openai.stop()
+        heygen.stop()
+        workdir.cleanup()
+
+    report: Dict[str, Any] = {
+        "meta": {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "timestamp": int(time.time()),
+            "config": {
+                key: value
+                for key, value in vars(args).items()
+                if key not in {"output", "baseline", "quiet"}
+            },
+            "stand_ins": {"openai": openai.counters, "heygen": heygen.counters},
+        },
+        **outcome,
+    }
+    exit_code = 0
+    if args.baseline:
+        report["comparison"] = compare(report["results"], json.loads(args.baseline.read_text(encoding="utf-8")), args.threshold)
+        exit_code = 1 if any(row["regressed"] for row in report["comparison"]) else 0
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        args.output.write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,60 @@
+import asyncio
+import random
+
+import pytest
+
+from app.services.breaker import CircuitOpenError
+from app.services.routing import ProviderRouter
+
+
+def _router() -> ProviderRouter:
+    return ProviderRouter(
+        window=100,
+        hedge_percentile=0.95,
+        hedge_default=8.0,
+        hedge_min=1.0,
+        hedge_max=20.0,
+        min_samples=20,
+        max_attempts=2,
+    )
+
+
+def test_failing_provider_ranks_below_slow_healthy_one():
+    router = _router()
+    for _ in range(100):
+        router._health("failing").record(0.05, False)
+        router._health("slow").record(6.0, True)
+
+    assert router._health("failing").percentile(0.5) is None
+    assert router.weight("failing") < router.weight("slow")
+    assert router.hedge_delay("failing") == router.hedge_default
+
+    random.seed(0)
+    primaries = [router.order(["failing", "slow"])[0] for _ in range(1000)]
+    assert primaries.count("slow") > 900
+
+
+def test_percentiles_ignore_failed_samples():
+    router = _router()
+    health = router._health("mixed")
+    for _ in range(50):
+        health.record(0.01, False)
+        health.record(3.0, True)
+
+    assert health.percentile(0.5) == 3.0
+    assert health.percentile(0.95) == 3.0
+    assert health.error_rate() == 0.5
+
+
+def test_local_short_circuit_is_not_a_provider_sample():
+    router = _router()
+
+    async def call(name: str) -> str:
+        raise CircuitOpenError("openai/gpt", 30)
+
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(router.run(["openai"], call))
+
+    health = router._health("openai")
+    assert len(health.samples) == 0
+    assert health.counters["errors"] == 0
@@ -3,11 +3,25 @@ import AnalysisPanel from "./components/AnalysisPanel";
 import ProductForm from "./components/ProductForm";
 import VideoConfig from "./components/VideoConfig";
 import XhsPanel from "./components/XhsPanel";
-import { analyzeProduct, generateScript, generateVideo, getVideoStatus, generateXhs } from "./api";
+import {
+  analyzeProductStream,
+  generateScript,
+  generateVideo,
+  getVideoStatus,
+  generateXhs,
+  getRevision,
+  deleteSavedCard,
+  saveCard,
+  searchSavedCards,
+  subscribeRevision,
+  subscribeVideoStatus,
+  waitForVideoJob
+} from "./api";
 import {
   AnalysisFormData,
   HeygenAvatarOption,
   PainPointCard,
+  RevisionResponse,
   VoiceConfig,
   VideoScript
 } from "./types";
@@ -60,6 +74,7 @@ function App() {
   const [selectedAvatarId, setSelectedAvatarId] = useState<string>(AVATARS[0]?.id || "");
 
   const [script, setScript] = useState<VideoScript | undefined>();
+  const [scriptRevision, setScriptRevision] = useState<string | undefined>();
   const [selectedVideoCopyIndex, setSelectedVideoCopyIndex] = useState<number>(0);
   const [videoUrl, setVideoUrl] = useState<string | undefined>();
   const [audioUrl, setAudioUrl] = useState<string | undefined>();
@@ -94,11 +109,41 @@ function App() {
 
   useEffect(() => {
     if (jobId && (!videoUrl || videoUrl.includes("video_status"))) {
-      pollVideoStatus(jobId);
+      setIsPolling(true);
+      return subscribeVideoStatus(
+        jobId,
+        (res) => {
+          setVideoStatus(res.status);
+          if (res.video_url) {
+            setVideoUrl(res.video_url);
+          }
+          if (res.video_url || ["completed", "failed", "unconfigured"].includes(res.status)) {
+            setIsPolling(false);
+          }
+        },
+        () => pollVideoStatus(jobId)
+      );
     }
     // eslint-disable-next-line react-hooks/exhaustive-deps
   }, [jobId]);
 
+  useEffect(() => {
+    if (!scriptRevision) {
+      return;
+    }
+    const applyRevision = (res: RevisionResponse) => {
+      if (res.script && res.source !== "fallback") {
+        setScript(res.script);
+      }
+      if (res.status === "done") {
+        setScriptRevision(undefined);
+      }
+    };
+    return subscribeRevision(scriptRevision, applyRevision, () => {
+      getRevision(scriptRevision).then(applyRevision).catch(() => setScriptRevision(undefined));
+    });
+  }, [scriptRevision]);
+
   useEffect(() => {
     const model = WINDOW_MODELS.find((item) => item.id === selectedWindowId);
     if (model) {
@@ -143,8 +188,11 @@ function App() {
       setXhsCopies([]);
       setSelectedXhsIndex(null);
 
-      const response = await analyzeProduct(formForRequest);
-      setCards(response.cards);
+      setCards([]);
+      await analyzeProductStream(formForRequest, (card) => {
+        setCards((prev) => [...prev, card]);
+        setCurrentStep(2);
+      });
       setCurrentStep(2);
     } catch (error) {
       const message = error instanceof Error ? error.message : String(error);
@@ -166,13 +214,43 @@ function App() {
     setSelectedVideoCopyIndex(0);
   };
 
-  const toggleSave = (cardId: string) => {
-    setCards((prev) =>
-      prev.map((card) => (card.id === cardId ? { ...card, saved: !card.saved } : card))
-    );
+  const toggleSave = async (cardId: string) => {
+    const target = cards.find((card) => card.id === cardId);
+    if (!target) {
+      return;
+    }
+    const saved = !target.saved;
+    setCards((prev) => prev.map((card) => (card.id === cardId ? { ...card, saved } : card)));
+    try {
+      if (saved) {
+        await saveCard({ ...target, saved }, formData.productName);
+      } else {
+        await deleteSavedCard(cardId);
+      }
+    } catch (error) {
+      // 写入卡片库失败时恢复原状态
+      setCards((prev) => prev.map((card) => (card.id === cardId ? { ...card, saved: !saved } : card)));
+      const message = error instanceof Error ? error.message : String(error);
+      setErrorMessage(message);
+    }
+  };
+
+  const searchLibrary = async (keyword: string) => {
+    try {
+      setErrorMessage(undefined);
+      const response = await searchSavedCards({ q: keyword || undefined, limit: 20 });
+      setSelectedCard(null);
+      setCards(response.cards.map((item) => item.card));
+      if (!response.cards.length) {
+        setErrorMessage("卡片库中没有匹配的卡片。");
+      }
+    } catch (error) {
+      const message = error instanceof Error ? error.message : String(error);
+      setErrorMessage(message);
+    }
   };
 
-  const ensureScript = async () => {
+  const ensureScript = async (instant = true) => {
     if (!selectedCard) {
       setErrorMessage("请先采纳一条文案。");
       return;
@@ -180,9 +258,11 @@ function App() {
     try {
       setIsScriptLoading(true);
       setErrorMessage(undefined);
-      const response = await generateScript(selectedCard, voiceConfig, videoStyle, formData.provider);
+      // 先展示模版脚本，大模型脚本生成后再替换；直接生成视频时等待正式脚本
+      const response = await generateScript(selectedCard, voiceConfig, videoStyle, formData.provider, instant);
       setScript(response.script);
       setSelectedVideoCopyIndex(0);
+      setScriptRevision(response.pending ? response.revision : undefined);
       return response.script;
     } catch (error) {
       const message = error instanceof Error ? error.message : String(error);
@@ -213,7 +293,7 @@ function App() {
   };
 
   const generateVideoAssets = async () => {
-    const scriptResult = script || (await ensureScript());
+    const scriptResult = script || (await ensureScript(false));
     if (!selectedCard || !scriptResult) {
       return;
     }
@@ -225,7 +305,8 @@ function App() {
     try {
       setIsVideoLoading(true);
       setErrorMessage(undefined);
-      const response = await generateVideo(scriptForVideo, voiceConfig, videoStyle, selectedAvatarId);
+      const job = await generateVideo(scriptForVideo, voiceConfig, videoStyle, selectedAvatarId);
+      const response = await waitForVideoJob(job.job_id);
       setVideoUrl(response.video_url);
       setAudioUrl(response.audio_url);
       setJobId(response.job_id);
@@ -239,7 +320,8 @@ function App() {
   };
 
   const pollVideoStatus = (currentJobId: string, attempt = 0) => {
-    const maxAttempts = 12;
+    // 状态由服务端统一轮询并缓存，客户端轮询只读缓存，可以覆盖完整渲染时长
+    const maxAttempts = 75;
     setIsPolling(true);
     getVideoStatus(currentJobId)
       .then((res) => {
@@ -296,7 +378,7 @@ function App() {
             videoStyle={videoStyle}
             onVoiceChange={setVoiceConfig}
             onVideoStyleChange={setVideoStyle}
-            onGenerateScript={ensureScript}
+            onGenerateScript={() => ensureScript()}
             onGenerateVideo={generateVideoAssets}
             script={script}
             generatingScript={isScriptLoading}
@@ -321,6 +403,7 @@ function App() {
             selectedCardId={selectedCard?.id}
             onSelect={selectCard}
             onToggleSave={toggleSave}
+            onSearchLibrary={searchLibrary}
             isLoading={isAnalyzing}
             publishPlatform={formData.publishPlatform}
           />
@@ -2,7 +2,12 @@ import {
   AnalysisFormData,
   AnalysisResponse,
   PainPointCard,
+  RevisionResponse,
+  SavedCard,
+  SavedCardListResponse,
+  SavedCardQuery,
   ScriptResponse,
+  VideoJobResponse,
   VideoResponse,
   VoiceConfig,
   VideoScript,
@@ -23,20 +28,24 @@ function buildKeywords(raw: string): string[] {
     .filter(Boolean);
 }
 
+function buildAnalyzeBody(form: AnalysisFormData): string {
+  return JSON.stringify({
+    product_name: form.productName,
+    persona: form.persona,
+    target_customer: form.targetCustomer,
+    audience_type: form.audienceType,
+    provider: form.provider,
+    publish_platform: form.publishPlatform,
+    product_keywords: buildKeywords(form.productKeywords),
+    additional_context: form.additionalContext
+  });
+}
+
 export async function analyzeProduct(form: AnalysisFormData): Promise<AnalysisResponse> {
   const response = await fetch(`${API_BASE}/api/analyze`, {
     method: "POST",
     headers: jsonHeaders,
-    body: JSON.stringify({
-      product_name: form.productName,
-      persona: form.persona,
-      target_customer: form.targetCustomer,
-      audience_type: form.audienceType,
-      provider: form.provider,
-      publish_platform: form.publishPlatform,
-      product_keywords: buildKeywords(form.productKeywords),
-      additional_context: form.additionalContext
-    })
+    body: buildAnalyzeBody(form)
   });
 
   if (!response.ok) {
@@ -46,11 +55,55 @@ export async function analyzeProduct(form: AnalysisFormData): Promise<AnalysisRe
   return response.json();
 }
 
+// 流式分析：每收到一张卡片就回调一次，返回全部卡片
+export async function analyzeProductStream(
+  form: AnalysisFormData,
+  onCard: (card: PainPointCard) => void
+): Promise<AnalysisResponse> {
+  const response = await fetch(`${API_BASE}/api/analyze/stream`, {
+    method: "POST",
+    headers: jsonHeaders,
+    body: buildAnalyzeBody(form)
+  });
+
+  if (!response.ok || !response.body) {
+    throw new Error(`分析失败：${response.statusText}`);
+  }
+
+  const cards: PainPointCard[] = [];
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) {
+      break;
+    }
+    buffer += decoder.decode(value, { stream: true });
+    const events = buffer.split("\n\n");
+    buffer = events.pop() || "";
+    for (const raw of events) {
+      const lines = raw.split("\n");
+      const event = lines.find((line) => line.startsWith("event:"))?.slice(6).trim();
+      const data = lines.find((line) => line.startsWith("data:"))?.slice(5).trim();
+      if (event === "card" && data) {
+        const card = JSON.parse(data) as PainPointCard;
+        cards.push(card);
+        onCard(card);
+      }
+    }
+  }
+
+  return { cards };
+}
+
 export async function generateScript(
   selectedCard: PainPointCard,
   voice: VoiceConfig,
   videoStyle: string,
-  provider?: string
+  provider?: string,
+  instant?: boolean
 ): Promise<ScriptResponse> {
   const response = await fetch(`${API_BASE}/api/generate_script`, {
     method: "POST",
@@ -59,7 +112,8 @@ export async function generateScript(
       selected_card: selectedCard,
       voice,
       video_style: videoStyle,
-      provider
+      provider,
+      instant
     })
   });
 
@@ -75,7 +129,7 @@ export async function generateVideo(
   voice: VoiceConfig,
   videoStyle: string,
   avatarId?: string
-): Promise<VideoResponse> {
+): Promise<VideoJobResponse> {
   const response = await fetch(`${API_BASE}/api/generate_video`, {
     method: "POST",
     headers: jsonHeaders,
@@ -94,6 +148,36 @@ export async function generateVideo(
   return response.json();
 }
 
+export async function getVideoJob(jobId: string): Promise<VideoJobResponse> {
+  const response = await fetch(`${API_BASE}/api/video_jobs/${encodeURIComponent(jobId)}`, {
+    method: "GET",
+    headers: jsonHeaders
+  });
+  if (!response.ok) {
+    throw new Error(`查询视频任务失败：${response.statusText}`);
+  }
+  return response.json();
+}
+
+// 视频生成在后台排队执行，轮询任务直到完成并返回结果
+export async function waitForVideoJob(
+  jobId: string,
+  intervalMs = 1500,
+  maxAttempts = 200
+): Promise<VideoResponse> {
+  for (let attempt = 0; attempt < maxAttempts; attempt += 1) {
+    const job = await getVideoJob(jobId);
+    if (job.status === "succeeded" && job.result) {
+      return job.result;
+    }
+    if (job.status === "failed") {
+      throw new Error(`视频生成失败：${job.error || "未知错误"}`);
+    }
+    await new Promise((resolve) => setTimeout(resolve, intervalMs));
+  }
+  throw new Error("视频生成超时，请稍后重试");
+}
+
 export async function getVideoStatus(videoId: string): Promise<VideoStatusResponse> {
   const response = await fetch(`${API_BASE}/api/video_status?video_id=${encodeURIComponent(videoId)}`, {
     method: "GET",
@@ -105,6 +189,118 @@ export async function getVideoStatus(videoId: string): Promise<VideoStatusRespon
   return response.json();
 }
 
+export async function getRevision(revision: string): Promise<RevisionResponse> {
+  const response = await fetch(`${API_BASE}/api/revisions/${encodeURIComponent(revision)}`, {
+    headers: { Accept: "application/json" }
+  });
+
+  if (!response.ok) {
+    throw new Error(`结果获取失败：${response.statusText}`);
+  }
+
+  return response.json();
+}
+
+// 订阅 instant 结果的后台升级（SSE），status 为 done 时结束；返回取消订阅函数
+export function subscribeRevision(
+  revision: string,
+  onRevision: (revision: RevisionResponse) => void,
+  onError?: () => void
+): () => void {
+  const source = new EventSource(`${API_BASE}/api/revisions/${encodeURIComponent(revision)}/stream`);
+  let finished = false;
+  source.addEventListener("revision", (event) => {
+    const data = JSON.parse((event as MessageEvent).data) as RevisionResponse;
+    if (data.status === "done") {
+      finished = true;
+      source.close();
+    }
+    onRevision(data);
+  });
+  source.onerror = () => {
+    source.close();
+    if (!finished) {
+      onError?.();
+    }
+  };
+  return () => {
+    finished = true;
+    source.close();
+  };
+}
+
+const FINAL_VIDEO_STATUSES = ["completed", "failed", "unconfigured"];
+
+// 订阅服务端推送的视频状态（SSE），返回取消订阅函数；连接异常时回调 onError 以便回退到轮询
+export function subscribeVideoStatus(
+  videoId: string,
+  onStatus: (status: VideoStatusResponse) => void,
+  onError?: () => void
+): () => void {
+  const source = new EventSource(`${API_BASE}/api/video_status/stream?video_id=${encodeURIComponent(videoId)}`);
+  let finished = false;
+  source.addEventListener("status", (event) => {
+    const status = JSON.parse((event as MessageEvent).data) as VideoStatusResponse;
+    if (FINAL_VIDEO_STATUSES.includes(status.status)) {
+      finished = true;
+      source.close();
+    }
+    onStatus(status);
+  });
+  source.onerror = () => {
+    source.close();
+    if (!finished) {
+      onError?.();
+    }
+  };
+  return () => {
+    finished = true;
+    source.close();
+  };
+}
+
+export async function saveCard(card: PainPointCard, productName: string): Promise<SavedCard> {
+  const response = await fetch(`${API_BASE}/api/cards`, {
+    method: "POST",
+    headers: jsonHeaders,
+    body: JSON.stringify({ card, product_name: productName })
+  });
+
+  if (!response.ok) {
+    throw new Error(`保存失败：${response.statusText}`);
+  }
+
+  return response.json();
+}
+
+export async function deleteSavedCard(cardId: string): Promise<void> {
+  const response = await fetch(`${API_BASE}/api/cards/${encodeURIComponent(cardId)}`, { method: "DELETE" });
+
+  // 404 说明已经不在卡片库中，视为取消成功
+  if (!response.ok && response.status !== 404) {
+    throw new Error(`取消保存失败：${response.statusText}`);
+  }
+}
+
+// 检索已保存的卡片，按保存时间倒序；翻页时传入上一页的 next_cursor
+export async function searchSavedCards(query: SavedCardQuery): Promise<SavedCardListResponse> {
+  const params = new URLSearchParams();
+  Object.entries(query).forEach(([key, value]) => {
+    if (value !== undefined && value !== "") {
+      params.set(key, String(value));
+    }
+  });
+  const response = await fetch(`${API_BASE}/api/cards?${params.toString()}`, {
+    headers: { Accept: "application/json" }
+  });
+
+  if (!response.ok) {
+    throw new Error(`卡片库检索失败：${response.statusText}`);
+  }
+
+  return response.json();
+}
+
 export async function generateXhs(selectedCard: PainPointCard, provider?: string): Promise<XhsResponse> {
   const response = await fetch(`${API_BASE}/api/generate_xhs`, {
     method: "POST",
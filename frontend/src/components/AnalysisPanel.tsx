@@ -1,3 +1,4 @@
+import { useState } from "react";
 import { PainPointCard } from "../types";
 
 interface AnalysisPanelProps {
@@ -5,6 +6,7 @@ interface AnalysisPanelProps {
   selectedCardId?: string;
   onSelect: (card: PainPointCard) => void;
   onToggleSave: (cardId: string) => void;
+  onSearchLibrary?: (keyword: string) => void;
   isLoading: boolean;
   publishPlatform?: "short_video" | "xhs";
 }
@@ -14,9 +16,12 @@ export function AnalysisPanel({
   selectedCardId,
   onSelect,
   onToggleSave,
+  onSearchLibrary,
   isLoading,
   publishPlatform,
 }: AnalysisPanelProps) {
+  const [keyword, setKeyword] = useState("");
+
   return (
     <div className="panel right-panel">
       <div className="brand-banner" style={{ marginBottom: 10 }}>
@@ -36,6 +41,26 @@ export function AnalysisPanel({
         {isLoading && <span className="chip">智能分析中...</span>}
       </div>
 
+      {onSearchLibrary && (
+        <form
+          style={{ display: "flex", gap: 8, marginTop: 12 }}
+          onSubmit={(event) => {
+            event.preventDefault();
+            onSearchLibrary(keyword.trim());
+          }}
+        >
+          <input
+            value={keyword}
+            onChange={(event) => setKeyword(event.target.value)}
+            placeholder="检索已保存的卡片（关键词，留空列出全部）"
+            style={{ flex: 1 }}
+          />
+          <button type="submit" className="secondary" disabled={isLoading}>
+            检索卡片库
+          </button>
+        </form>
+      )}
+
       {!cards.length && (
         <div style={{ marginTop: 40, textAlign: "center", color: "#64748b" }}>
           {isLoading ? "正在智能分析产品，请稍候..." : "提交产品信息，AI 将生成多条营销洞察。"}
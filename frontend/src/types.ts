@@ -48,10 +48,48 @@ export interface VideoScript {
 
 export interface AnalysisResponse {
   cards: PainPointCard[];
+  source?: string;
+  revision?: string;
+  pending?: boolean;
 }
 
 export interface ScriptResponse {
   script: VideoScript;
+  source?: string;
+  revision?: string;
+  pending?: boolean;
+}
+
+// instant 模式下后台升级的结果版本
+export interface RevisionResponse {
+  revision: string;
+  kind: "analyze" | "script";
+  status: "pending" | "done";
+  source: string;
+  error?: string;
+  cards?: PainPointCard[];
+  script?: VideoScript;
+}
+
+export interface SavedCard {
+  card: PainPointCard;
+  product_name: string;
+  saved_at: number;
+}
+
+export interface SavedCardListResponse {
+  cards: SavedCard[];
+  next_cursor?: string;
+}
+
+export interface SavedCardQuery {
+  q?: string;
+  product?: string;
+  channel?: string;
+  since?: number;
+  until?: number;
+  cursor?: string;
+  limit?: number;
 }
 
 export interface VideoResponse {
@@ -61,6 +99,17 @@ export interface VideoResponse {
   status?: string;
 }
 
+export interface VideoJobResponse {
+  job_id: string;
+  status: "queued" | "running" | "succeeded" | "failed";
+  attempts: number;
+  error?: string;
+  result?: VideoResponse;
+  created_at?: number;
+  started_at?: number;
+  finished_at?: number;
+}
+
 export interface HeygenAvatarOption {
   id: string;
   name: string;